@@ -0,0 +1,26 @@
+"""
+Guards admin end points (profiler, slow queries, catalog sync) with the admin token of their config.
+"""
+import hmac
+from flask import request, abort
+
+header = 'X-Admin-Token'
+
+
+def is_admin_token(token, admin_token):
+    """
+    Tells whether given token is the admin token, in constant time. Nothing is when no admin
+    token is configured.
+    """
+    if not admin_token or token is None:
+        return False
+    # Compared as bytes, compare_digest rejects str with non ascii characters
+    return hmac.compare_digest(token.encode('utf-8'), admin_token.encode('utf-8'))
+
+
+def authorize(admin_token):
+    """
+    Aborts the request with 403 unless it carries the admin token in X-Admin-Token header
+    """
+    if not is_admin_token(request.headers.get(header), admin_token):
+        abort(403)
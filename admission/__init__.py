@@ -0,0 +1,2 @@
+from .controller import AdmissionController, Rejected
+from .middleware import init_app, take_slot
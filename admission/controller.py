@@ -0,0 +1,81 @@
+import heapq
+import itertools
+import threading
+
+
+class Rejected(Exception):
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class _Waiter:
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+        self.cancelled = False
+
+
+class AdmissionController:
+    """
+    Limits number of requests running concurrently. Requests beyond the limit wait in a
+    bounded queue, served by priority (lower value first) and then in arrival order.
+    A request which is not admitted within its timeout, or which finds the queue full,
+    is rejected right away instead of piling up.
+    """
+
+    def __init__(self, max_concurrency, max_queue):
+        self._max_concurrency = max_concurrency
+        self._max_queue = max_queue
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queue = []
+        self._queued = 0
+        self._sequence = itertools.count()
+
+    @property
+    def active(self):
+        return self._active
+
+    @property
+    def queued(self):
+        return self._queued
+
+    def acquire(self, priority=0, timeout=None):
+        """
+        Blocks until the request is admitted. Raises Rejected when queue is full or
+        timeout (seconds) elapses.
+        """
+        with self._lock:
+            if self._active < self._max_concurrency and not self._queued:
+                self._active += 1
+                return
+            if self._queued >= self._max_queue:
+                raise Rejected('QUEUE_FULL')
+            waiter = _Waiter()
+            heapq.heappush(self._queue, (priority, next(self._sequence), waiter))
+            self._queued += 1
+
+        waiter.event.wait(timeout)
+        with self._lock:
+            if waiter.granted:
+                return
+            # Left in the heap and skipped when it reaches the top
+            waiter.cancelled = True
+            self._queued -= 1
+        raise Rejected('QUEUE_TIMEOUT')
+
+    def release(self):
+        with self._lock:
+            while self._queue:
+                _, _, waiter = heapq.heappop(self._queue)
+                if waiter.cancelled:
+                    continue
+                # Hand over the slot to the waiter, active count stays the same
+                waiter.granted = True
+                self._queued -= 1
+                waiter.event.set()
+                return
+            self._active -= 1
@@ -0,0 +1,91 @@
+import logging
+from flask import g, request
+from deadlines import remaining
+from tracing import span
+from .controller import AdmissionController, Rejected
+logger = logging.getLogger(__name__)
+
+# Reads are admitted before queued writes
+READ_PRIORITY = 0
+WRITE_PRIORITY = 1
+read_methods = ('GET', 'HEAD', 'OPTIONS')
+
+
+def init_app(app, config):
+    """
+    Applies admission control to routes. Routes are mapped (by endpoint, or by blueprint
+    name) to groups, and every group has its own concurrency limit, queue size and timeout.
+    """
+    if not config.get('enabled', True):
+        return None
+
+    admission = Admission(config)
+    app.before_request(admission.before_request)
+    app.teardown_request(admission.teardown_request)
+    return admission
+
+
+class Admission:
+
+    def __init__(self, config):
+        self._retry_after = config.get('retry_after', 1)
+        self._routes = config.get('routes', {})
+        self._groups = {}
+        for name, group in config.get('groups', {}).items():
+            self._groups[name] = (
+                AdmissionController(group['max_concurrency'], group.get('max_queue', 0)),
+                group.get('queue_timeout', 1.0))
+
+    def group_of(self, endpoint):
+        if not endpoint:
+            return None
+        name = self._routes.get(endpoint) or self._routes.get(endpoint.split('.', 1)[0])
+        return self._groups.get(name) if name else None
+
+    def before_request(self):
+        group = self.group_of(request.endpoint)
+        if group is None:
+            return None
+
+        controller, timeout = group
+        left = remaining()
+        if left is not None:
+            # A request does not wait in the queue beyond its deadline
+            timeout = min(timeout, left)
+        priority = READ_PRIORITY if request.method in read_methods else WRITE_PRIORITY
+        try:
+            with span('queue', 'Admission wait'):
+                controller.acquire(priority, timeout)
+        except Rejected as err:
+            logger.warning('Rejected %s %s due to %s (active: %d, queued: %d)', request.method, request.path,
+                           err.reason, controller.active, controller.queued)
+            return {
+                'code': 503,
+                'name': 'SERVICE_OVERLOADED',
+                'description': 'Server is busy ({}), please retry later'.format(err.reason)
+            }, 503, {'Retry-After': str(self._retry_after)}
+
+        g.admission_controller = controller
+        return None
+
+    def teardown_request(self, exc):
+        controller = g.pop('admission_controller', None)
+        if controller is not None:
+            controller.release()
+
+
+def take_slot():
+    """
+    Takes the admission slot of the current request over from teardown, e.g. for a streamed response
+    whose body is generated after teardown. Returns a function releasing the slot once (a no-op when
+    the request holds no slot), which the caller must call when it is done.
+    """
+    controller = g.pop('admission_controller', None)
+
+    def release():
+        nonlocal controller
+        held, controller = controller, None
+        if held is not None:
+            held.release()
+
+    return release
@@ -1,10 +1,16 @@
 import books
 import external_books
+import tracing
+import jsoncodec
+import compression
+import health
+import admission
+import deadlines
 from flask import Flask, request
 from werkzeug.exceptions import HTTPException, InternalServerError
 import logging
-import json
 import config
+import lifecycle
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG,
@@ -18,7 +24,7 @@ logger = logging.getLogger(__name__)
 def handle_http_exception(e):
     """Return JSON instead of HTML for HTTP errors."""
     response = e.get_response()
-    response.data = json.dumps({
+    response.data = jsoncodec.dumps({
         "code": e.code,
         "name": e.name,
         "description": e.description,
@@ -32,10 +38,50 @@ def handle_generic_exception(e):
     return {}, 500
 
 
-app = Flask(__name__)
-app.register_blueprint(external_books.createBlueprint(config.external_books_api), url_prefix='/api/external-books')
-app.register_blueprint(books.createBlueprint(config.books_api), url_prefix='/api/v1')
-app.register_error_handler(HTTPException, handle_http_exception)
-#app.register_error_handler(Exception, handle_generic_exception)
+class BooksApiFlask(Flask):
+    """
+    Encodes dicts returned by routes with jsoncodec instead of flask's json module.
+    """
 
+    def make_response(self, rv):
+        with tracing.span('encode', 'Response encoding'):
+            if isinstance(rv, dict):
+                rv = self._json_response(rv)
+            elif isinstance(rv, tuple) and rv and isinstance(rv[0], dict):
+                rv = (self._json_response(rv[0]),) + rv[1:]
+            return super().make_response(rv)
+
+    def _json_response(self, value):
+        return self.response_class(jsoncodec.dumps(value), mimetype='application/json')
+
+
+def create_app(cfg):
+    """
+    Creates the flask app from given config module.
+    """
+    jsoncodec.use(cfg.json_codec['backend'])
+    app = BooksApiFlask(__name__)
+    tracing.init_app(app, cfg.tracing)
+    # Deadlines start before admission, so that the time a request is queued counts
+    deadlines.init_app(app, cfg.deadlines)
+    admission.init_app(app, cfg.admission)
+    # Optional middlewares are imported only when they are enabled, to keep startup fast
+    if cfg.profiling['enabled']:
+        import profiling
+        profiling.init_app(app, cfg.profiling)
+    if cfg.traffic_capture['enabled']:
+        import traffic
+        traffic.init_app(app, cfg.traffic_capture)
+    compression.init_app(app, cfg.compression)
+    app.register_blueprint(external_books.createBlueprint(cfg.external_books_api), url_prefix='/api/external-books')
+    app.register_blueprint(books.createBlueprint(cfg.books_api), url_prefix='/api/v1')
+    app.register_blueprint(health.createBlueprint(), url_prefix='/health')
+    app.register_error_handler(HTTPException, handle_http_exception)
+    #app.register_error_handler(Exception, handle_generic_exception)
+    # Db pools are opened in background, so that first requests need not wait for them
+    lifecycle.start()
+    return app
+
+
+app = create_app(config)
 logger.info('Server is listening for requests')
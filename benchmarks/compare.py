@@ -0,0 +1,34 @@
+"""
+Compares a benchmark report against a baseline and exits with status 1 on regressions.
+
+    > python -m benchmarks.compare baseline-micro.json benchmarks/results/micro.json
+
+The baseline is a report kept from an earlier run on the same machine.
+"""
+import argparse
+import sys
+
+from . import report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare benchmark results against a baseline')
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='Allowed relative slow down before a metric is reported as regressed')
+    args = parser.parse_args()
+
+    rows = report.compare(report.load(args.baseline), report.load(args.current), args.tolerance)
+    regressions = 0
+    for name, metric, base_value, value, change, regressed in rows:
+        regressions += regressed
+        print('{:<30} {:<16} {:>14} {:>14} {:>+8.1%} {}'.format(
+            name, metric, base_value, value, change, 'REGRESSED' if regressed else ''))
+
+    print('{} regressions in {} metrics'.format(regressions, len(rows)))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+Macro benchmarks which drive the flask app under concurrency.
+The app is served in process (against Postgres configured in config_qa.py and a local stub of
+the Ice and Fire api), unless '--target' points to an already running server.
+
+    > python -m benchmarks.macro --concurrency 16 --duration 10 --output benchmarks/results/macro.json
+"""
+import argparse
+import copy
+import threading
+import time
+import types
+from datetime import datetime
+
+import requests
+from werkzeug.serving import make_server
+
+import config_qa
+from . import report, stub_ice_and_fire
+
+
+def qa_config(ice_and_fire_api_base_url):
+    """
+    Returns a copy of config_qa module with Ice and Fire api pointing to the stub
+    """
+    cfg = types.SimpleNamespace(**{key: copy.deepcopy(value) for key, value in vars(config_qa).items()
+                                   if not key.startswith('_')})
+    cfg.external_books_api['ice_and_fire_api_base_url'] = ice_and_fire_api_base_url
+    return cfg
+
+
+def serve_app(cfg):
+    import app as app_module
+    server = make_server('127.0.0.1', 0, app_module.create_app(cfg), threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-app', daemon=True).start()
+    return server
+
+
+def new_book_info(i):
+    stamp = datetime.strftime(datetime.today(), '%Y%m%d%H%M%S%f')
+    return {
+        'name': 'Bench book {} {}'.format(i, stamp),
+        'isbn': 'bench-{}-{}'.format(i, stamp),
+        'authors': ['John Doe'],
+        'country': 'United States',
+        'number_of_pages': 350,
+        'publisher': 'Bench Publishing',
+        'release_date': '2019-01-01'
+    }
+
+
+def seed_books(base_url, count):
+    ids = []
+    for i in range(count):
+        resp = requests.post('{}/api/v1/books'.format(base_url), json=new_book_info(i))
+        ids.append(resp.json()['data'][0]['book']['id'])
+    return ids
+
+
+def scenarios(base_url, book_ids):
+    """
+    Returns scenario name -> function(session, i) issuing one request
+    """
+    books_url = '{}/api/v1/books'.format(base_url)
+    return {
+        'list_books': lambda session, i: session.get(books_url),
+        'list_books_filtered': lambda session, i: session.get(books_url, params={'publisher': 'Bench Publishing'}),
+        'get_book': lambda session, i: session.get('{}/{}'.format(books_url, book_ids[i % len(book_ids)])),
+        'create_book': lambda session, i: session.post(books_url, json=new_book_info(i)),
+        'external_books': lambda session, i: session.get('{}/api/external-books/'.format(base_url),
+                                                         params={'name': 'A Game of Thrones'}),
+    }
+
+
+def drive(func, concurrency, duration):
+    """
+    Calls func from 'concurrency' threads for 'duration' seconds and returns
+    (latencies in seconds, number of errors, elapsed seconds)
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(worker_id):
+        session = requests.Session()
+        local_latencies = []
+        local_errors = 0
+        i = worker_id
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                resp = func(session, i)
+                if resp.status_code >= 400:
+                    local_errors += 1
+            except requests.exceptions.RequestException:
+                local_errors += 1
+            local_latencies.append(time.perf_counter() - start)
+            i += concurrency
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.perf_counter() - start
+
+
+def run(base_url, names, concurrency, duration, seed):
+    book_ids = seed_books(base_url, seed)
+    all_scenarios = scenarios(base_url, book_ids)
+    results = {}
+    for name in names:
+        latencies, errors, elapsed = drive(all_scenarios[name], concurrency, duration)
+        if not latencies:
+            continue
+        result = report.summarize(latencies)
+        result['errors'] = errors
+        result['throughput_rps'] = round(len(latencies) / elapsed, 1)
+        results[name] = result
+        print('{:<22} {:>9.1f} req/s  p50 {:>8.2f} ms  p99 {:>8.2f} ms  errors {}'.format(
+            name, result['throughput_rps'], result['p50_ms'], result['p99_ms'], errors))
+
+    # RSS covers the in process server and the load generator together
+    results['process'] = {'peak_rss_kb': report.peak_rss_kb()}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Macro benchmarks of the books api')
+    parser.add_argument('--target', help='Base url of a running server, e.g. http://127.0.0.1:5000')
+    parser.add_argument('--scenarios', default='list_books,list_books_filtered,get_book,create_book,external_books')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per scenario')
+    parser.add_argument('--seed', type=int, default=50, help='Number of books created before benchmarking')
+    parser.add_argument('--output', default='benchmarks/results/macro.json')
+    args = parser.parse_args()
+
+    base_url = args.target
+    servers = []
+    if not base_url:
+        stub = stub_ice_and_fire.start()
+        servers.append(stub)
+        app_server = serve_app(qa_config('http://127.0.0.1:{}/api'.format(stub.server_port)))
+        servers.append(app_server)
+        base_url = 'http://127.0.0.1:{}'.format(app_server.server_port)
+
+    names = args.scenarios.split(',')
+    bench_report = report.new_report('macro', {
+        'target': args.target or 'in-process', 'scenarios': names, 'concurrency': args.concurrency,
+        'duration': args.duration, 'seed': args.seed})
+    try:
+        bench_report['results'] = run(base_url, names, args.concurrency, args.duration, args.seed)
+    finally:
+        for server in servers:
+            server.shutdown()
+
+    report.save(bench_report, args.output)
+    print('Saved results into {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""
+Micro benchmarks of book hot paths over synthetic rows.
+
+    > python -m benchmarks.micro --sizes 1000,100000,1000000 --output benchmarks/results/micro.json
+
+Results depend on the machine, hence no baseline is committed. Keep a report of a known good
+commit, run on the same machine, as the baseline to compare later runs against:
+
+    > cp benchmarks/results/micro.json baseline-micro.json
+    > python -m benchmarks.compare baseline-micro.json benchmarks/results/micro.json
+
+Embedded storages are compared with --storages memory,sqlite,read_model (Postgres is measured by macro benchmarks).
+"""
+import argparse
+import gc
+import itertools
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+from flask import json as flask_json
+
+import jsoncodec
+
+from books import BookRepo, DbBook
+from books.schema import book_schema
+from books.book import EncodedBookCache
+from books.storage import PostgresStorage, MemoryStorage, SqliteStorage, ReadModelStorage
+from books.storage.base import value_fields
+from . import report
+
+countries = ['United States', 'United Kingdom', 'India', 'Germany', 'France']
+publishers = ['Bantam Books', 'Voyager Books', 'Manning', 'ORielly', 'Acme Books Publishing']
+
+
+def synthetic_rows(size, seed=42):
+    """
+    Generates rows shaped like the result of 'SELECT ... FROM books'.
+    Rows are generated from a fixed seed, so that every run benchmarks the same data.
+    """
+    rnd = random.Random(seed)
+    first_day = date(1990, 1, 1)
+    return [
+        (i,
+         'Book {} {}'.format(i, rnd.randint(0, 10 ** 6)),
+         '978-{:010d}'.format(i),
+         json.dumps(['Author {}'.format(rnd.randint(0, 500)) for _ in range(rnd.randint(1, 3))]),
+         rnd.choice(countries),
+         rnd.randint(50, 1500),
+         rnd.choice(publishers),
+         first_day + timedelta(days=rnd.randint(0, 365 * 30)))
+        for i in range(1, size + 1)
+    ]
+
+
+def filter_combinations():
+    sample = {'name': 'A Game of Thrones', 'country': 'United States', 'publisher': 'Bantam Books',
+              'release_date': 1996}
+    keys = sorted(sample.keys())
+    return [{key: sample[key] for key in combination}
+            for length in range(len(keys) + 1) for combination in itertools.combinations(keys, length)]
+
+
+def measure(func, repeat):
+    """
+    Runs func 'repeat' times with garbage collection disabled and returns durations in seconds
+    """
+    durations = []
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            func()
+            durations.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return durations
+
+
+def run(sizes, repeat):
+    results = {}
+    postgres_storage = PostgresStorage(None)
+    filters = filter_combinations()
+
+    for size in sizes:
+        rows = synthetic_rows(size)
+        books = [DbBook._from_db_row(None, row) for row in rows]
+        values = [book.values() for book in books]
+        payloads = [dict(value, id=None) for value in values]
+        encoded_cache = EncodedBookCache(size)
+        encoded = [encoded_cache.get_or_encode(None, row) for row in rows]
+        query_loops = max(1, size // len(filters))
+
+        cases = {
+            'hydrate': lambda: [DbBook._from_db_row(None, row) for row in rows],
+            'hydrate_fields': lambda: [DbBook._from_db_row(None, row[:3], ('id', 'name', 'isbn')) for row in rows],
+            'values': lambda: [book.values() for book in books],
+            'serialize_flask': lambda: flask_json.dumps({'status_code': 200, 'status': 'success', 'data': values}),
+            'serialize': lambda: jsoncodec.dumps({'status_code': 200, 'status': 'success', 'data': values}),
+            'serialize_cached': lambda: jsoncodec.dumps({
+                'status_code': 200, 'status': 'success',
+                'data': jsoncodec.Fragments([encoded_cache.get_or_encode(None, row) for row in rows])}),
+            'validate': lambda: book_schema.validate_many(payloads),
+            'query_building': lambda: [postgres_storage._get_all_books_query(f)
+                                       for _ in range(query_loops) for f in filters],
+        }
+        for case, func in cases.items():
+            durations = measure(func, repeat)
+            ops = query_loops * len(filters) if case == 'query_building' else size
+            result = report.summarize(durations)
+            result['ops_per_sec'] = round(ops / (result['median_ms'] / 1000.0), 1)
+            results['{}[{}]'.format(case, size)] = result
+            print('{:<28} median {:>10.3f} ms  {:>14.1f} ops/sec'.format(
+                '{}[{}]'.format(case, size), result['median_ms'], result['ops_per_sec']))
+
+        del rows, books, values, payloads, encoded_cache, encoded
+
+    results['process'] = {'peak_rss_kb': report.peak_rss_kb()}
+    return results
+
+
+def create_storage(backend, directory):
+    if backend == 'memory':
+        return MemoryStorage()
+    if backend == 'sqlite':
+        return SqliteStorage(os.path.join(directory, 'books.db'))
+    if backend == 'read_model':
+        return ReadModelStorage(SqliteStorage(os.path.join(directory, 'books.db')))
+    raise ValueError('Unsupported storage backend: {}'.format(backend))
+
+
+def load_storage(storage, rows):
+    values = [dict(zip(value_fields, row[1:-1] + (row[-1].isoformat(),))) for row in rows]
+    if isinstance(storage, ReadModelStorage):
+        load_storage(storage.storage, rows)
+        storage.load()
+    elif isinstance(storage, SqliteStorage):
+        # A single transaction, inserting rows one by one would take a commit per row
+        with storage._transaction() as conn:
+            conn.executemany('INSERT INTO books ({}) VALUES ({})'.format(
+                ', '.join(value_fields), ', '.join(['?'] * len(value_fields))),
+                [tuple(value[field] for field in value_fields) for value in values])
+    else:
+        for value in values:
+            storage.insert(value)
+
+
+def run_storages(sizes, repeat, backends):
+    """
+    Measures reads of books through each storage, over the same synthetic rows
+    """
+    results = {}
+    for backend, size in itertools.product(backends, sizes):
+        rows = synthetic_rows(size)
+        ids = [rows[i][0] for i in range(0, size, max(1, size // 100))]
+        with tempfile.TemporaryDirectory() as directory:
+            storage = create_storage(backend, directory)
+            load_storage(storage, rows)
+            book_repo = BookRepo(storage, size)
+            cases = {
+                'storage_filter': (lambda: book_repo.get_books_encoded(None, publisher='Manning'),
+                                   len(book_repo.get_books(publisher='Manning'))),
+                'storage_ids': (lambda: book_repo.get_books_by_ids(ids), len(ids)),
+            }
+            for case, (func, ops) in cases.items():
+                result = report.summarize(measure(func, repeat))
+                result['ops_per_sec'] = round(ops / (result['median_ms'] / 1000.0), 1)
+                name = '{}_{}[{}]'.format(case, backend, size)
+                results[name] = result
+                print('{:<28} median {:>10.3f} ms  {:>14.1f} ops/sec'.format(
+                    name, result['median_ms'], result['ops_per_sec']))
+            storage.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro benchmarks of books hot paths')
+    parser.add_argument('--sizes', default='1000,100000,1000000',
+                        help='Comma separated number of synthetic rows')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default='benchmarks/results/micro.json')
+    parser.add_argument('--storages', default='',
+                        help='Comma separated storage backends to compare: memory, sqlite, read_model')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    storages = [backend for backend in args.storages.split(',') if backend]
+    bench_report = report.new_report('micro', {'sizes': sizes, 'repeat': args.repeat, 'storages': storages,
+                                               'json_backend': jsoncodec.backend_name()})
+    bench_report['results'] = run(sizes, args.repeat)
+    bench_report['results'].update(run_storages(sizes, args.repeat, storages))
+    report.save(bench_report, args.output)
+    print('Saved results into {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import json
+import math
+import os
+import platform
+import resource
+import statistics
+import sys
+from datetime import datetime
+
+
+def peak_rss_kb():
+    """
+    Peak resident set size of this process in kilobytes
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes while linux reports kilobytes
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    # Nearest rank method
+    ordered = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[min(len(ordered), max(rank, 1)) - 1]
+
+
+def summarize(durations):
+    """
+    Summarizes a list of durations (seconds) into milliseconds statistics
+    """
+    return {
+        'count': len(durations),
+        'min_ms': round(min(durations) * 1000, 4),
+        'median_ms': round(statistics.median(durations) * 1000, 4),
+        'p50_ms': round(percentile(durations, 50) * 1000, 4),
+        'p99_ms': round(percentile(durations, 99) * 1000, 4),
+        'max_ms': round(max(durations) * 1000, 4)
+    }
+
+
+def new_report(suite, params):
+    return {
+        'suite': suite,
+        'created_at': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'params': params,
+        'results': {}
+    }
+
+
+def save(report, path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+# Metrics where a bigger value is a better value
+higher_is_better = ('throughput_rps', 'ops_per_sec')
+# Suffixes of metrics where a smaller value is a better value
+lower_is_better = ('_ms', '_kb')
+
+
+def compare(baseline, current, tolerance=0.10):
+    """
+    Compares metrics of two reports and returns a list of
+    (benchmark, metric, baseline value, current value, change ratio, regressed) tuples.
+    A metric is regressed when it is worse than the baseline by more than the tolerance.
+    """
+    rows = []
+    for name, metrics in sorted(current['results'].items()):
+        base_metrics = baseline['results'].get(name)
+        if not base_metrics:
+            continue
+        for metric, value in sorted(metrics.items()):
+            if metric not in higher_is_better and not metric.endswith(lower_is_better):
+                continue
+            base_value = base_metrics.get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(base_value, (int, float)) or not base_value:
+                continue
+            change = (value - base_value) / float(base_value)
+            worse = -change if metric in higher_is_better else change
+            rows.append((name, metric, base_value, value, change, worse > tolerance))
+    return rows
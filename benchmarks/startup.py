@@ -0,0 +1,62 @@
+"""
+Measures startup time of the app: interpreter start, 'import app' and first response,
+each in a fresh process.
+
+    > python -m benchmarks.startup --runs 10 --output benchmarks/results/startup.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from . import report
+
+probe = '''
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+resp = app.app.test_client().get({path!r})
+responded = time.perf_counter()
+print(json.dumps({{'import': imported - start, 'first_response': responded - imported, 'status': resp.status_code}}))
+'''
+
+
+def measure_once(path):
+    start = time.perf_counter()
+    output = subprocess.check_output([sys.executable, '-c', probe.format(path=path)],
+                                     cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                     stderr=subprocess.DEVNULL)
+    elapsed = time.perf_counter() - start
+    result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+    result['process'] = elapsed
+    return result
+
+
+def run(runs, path):
+    samples = [measure_once(path) for _ in range(runs)]
+    results = {}
+    for key, name in [('import', 'import'), ('first_response', 'first_response'), ('process', 'process_total')]:
+        results[name] = report.summarize([sample[key] for sample in samples])
+        print('{:<16} median {:>9.2f} ms'.format(name, results[name]['median_ms']))
+    results['status'] = {'codes': sorted({sample['status'] for sample in samples})}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup time of the app')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--path', default='/health/live', help='Path requested as first request')
+    parser.add_argument('--output', default='benchmarks/results/startup.json')
+    args = parser.parse_args()
+
+    bench_report = report.new_report('startup', {'runs': args.runs, 'path': args.path})
+    bench_report['results'] = run(args.runs, args.path)
+    report.save(bench_report, args.output)
+    print('Saved results into {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
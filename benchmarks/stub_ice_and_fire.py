@@ -0,0 +1,86 @@
+"""
+A local stub of the Ice and Fire api, so that external books can be benchmarked
+without depending on the network and on the real api.
+
+    > python -m benchmarks.stub_ice_and_fire --port 5001
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+books = [
+    {
+        'name': 'A Game of Thrones',
+        'isbn': '978-0553103540',
+        'authors': ['George R. R. Martin'],
+        'numberOfPages': 694,
+        'publisher': 'Bantam Books',
+        'country': 'United States',
+        'released': '1996-08-01T00:00:00'
+    },
+    {
+        'name': 'A Clash of Kings',
+        'isbn': '978-0553108033',
+        'authors': ['George R. R. Martin'],
+        'numberOfPages': 768,
+        'publisher': 'Bantam Books',
+        'country': 'United States',
+        'released': '1999-02-02T00:00:00'
+    }
+]
+
+
+class IceAndFireHandler(BaseHTTPRequestHandler):
+    # Artificial latency (seconds) added to every response to mimic the real api
+    latency = 0.0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/api/books':
+            self.send_error(404)
+            return
+
+        name = parse_qs(url.query).get('name', [None])[0]
+        matching = [book for book in books if name is None or book['name'] == name]
+        if self.latency:
+            time.sleep(self.latency)
+
+        body = json.dumps(matching).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(port=0, latency=0.0):
+    """
+    Starts the stub in a daemon thread and returns the server. Its base url is
+    'http://127.0.0.1:<server.server_port>/api'
+    """
+    handler = type('StubHandler', (IceAndFireHandler,), {'latency': latency})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='ice-and-fire-stub', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stub of the Ice and Fire api')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+    handler = type('StubHandler', (IceAndFireHandler,), {'latency': args.latency})
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), handler)
+    print('Ice and Fire stub is listening on http://127.0.0.1:{}/api'.format(args.port))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,4 @@
 from .routes import createBlueprint, BookRoutes
 from .book import BookRepo, DbBook, BookError
+from .stats import BookStatsRepo
+from .changes import ChangeFeed
@@ -0,0 +1,88 @@
+import logging
+import os
+import threading
+import psycopg2
+import lifecycle
+logger = logging.getLogger(__name__)
+
+
+class AdvisoryLock:
+    """
+    A Postgres session level advisory lock which at most one process holds, e.g. to elect the
+    single process running a background job. Once acquired, the lock is held on a dedicated
+    connection until the process closes it or exits, and it is taken over by another process
+    when that connection is lost.
+    """
+
+    # Connections inherited from a parent process
+    _inherited = []
+
+    def __init__(self, connection_config, name):
+        # The connection is dedicated, hence pool settings do not apply to it
+        self._connection_config = {key: value for key, value in connection_config.items()
+                                   if key not in ('minconn', 'maxconn')}
+        self._name = name
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = os.getpid()
+        lifecycle.register(self)
+
+    def acquire(self):
+        """
+        Returns True when this process holds the lock, acquiring it when no other process holds it
+        """
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    # The lock is lost along with its connection
+                    cur = self._conn.cursor()
+                    cur.execute('SELECT 1')
+                    cur.close()
+                    return True
+                except psycopg2.Error as err:
+                    logger.warning('Lost advisory lock: %s due to error: %s', self._name, err)
+                    self._disconnect()
+
+            conn = None
+            try:
+                conn = psycopg2.connect(**self._connection_config)
+                conn.autocommit = True
+                cur = conn.cursor()
+                cur.execute('SELECT pg_try_advisory_lock(hashtext(%s))', (self._name,))
+                acquired = cur.fetchone()[0]
+                cur.close()
+            except psycopg2.Error as err:
+                logger.error('Unable to acquire advisory lock: %s due to error: %s', self._name, err)
+                acquired = False
+            if not acquired:
+                if conn is not None:
+                    conn.close()
+                return False
+            self._conn = conn
+            logger.info('Acquired advisory lock: %s in process %d', self._name, os.getpid())
+            return True
+
+    def held(self):
+        return self._conn is not None
+
+    def _disconnect(self):
+        try:
+            self._conn.close()
+        except psycopg2.Error:
+            pass
+        self._conn = None
+
+    def reset_after_fork(self):
+        if self._pid != os.getpid():
+            # The lock belongs to the session of the parent, closing it would release it
+            self._pid = os.getpid()
+            self._lock = threading.Lock()
+            if self._conn is not None:
+                AdvisoryLock._inherited.append(self._conn)
+                self._conn = None
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._disconnect()
+                logger.info('Released advisory lock: %s of process %d', self._name, self._pid)
@@ -2,54 +2,268 @@ from abc import ABC, abstractmethod
 import psycopg2
 import json
 import logging
-from datetime import datetime
+import re
+import sys
+import threading
+from collections import OrderedDict
+import jsoncodec
+from deadlines import check_deadline, remaining
+from tracing import span
+from .errors import BookError
+from .schema import book_schema
 logger = logging.getLogger(__name__)
 
+_number = re.compile(r'[0-9]+')
+
+
+def parse_number(value):
+    """
+    Returns the int of a string of ascii digits (surrounding spaces are ignored), or None for
+    any other string. Unlike str.isdigit(), digits which int() can not parse (e.g. '²') are
+    not accepted.
+    """
+    value = value.strip()
+    return int(value) if _number.fullmatch(value) else None
+
 
 class BookRepo:
+    """
+    Reads and writes books through a storage (see books.storage), e.g. Postgres
+    """
 
-    def __init__(self, cpool):
-        self._cpool = cpool
+    def __init__(self, storage, encoded_cache_size=10000, max_ids=100, max_limit=1000):
+        self._storage = storage
+        self._encoded_cache = EncodedBookCache(encoded_cache_size)
+        # Maximum number of books fetched by ids at once
+        self._max_ids = max_ids
+        # Maximum number of books a listing can be limited to
+        self._max_limit = max_limit
+        self._write_listeners = []
+
+    @property
+    def storage(self):
+        return self._storage
+
+    def add_write_listener(self, listener):
+        """
+        Registers a function(operation, id) called after a book of this repo is
+        created, updated or deleted. Operation is one of 'create', 'update' or 'delete'.
+        """
+        self._write_listeners.append(listener)
 
     supported_filters = ['name', 'country', 'publisher', 'release_date']
 
-    def get_books(self, **filters):
+    # Fields books can be sorted by
+    sortable_fields = ('id', 'name', 'country', 'number_of_pages', 'publisher', 'release_date')
+
+    # Dimensions books of a listing can be counted by
+    facet_dimensions = ('country', 'publisher', 'release_year')
+
+    # Columns of 'books' table in the order they are selected
+    book_fields = ('id', 'name', 'isbn', 'authors', 'country', 'number_of_pages', 'publisher', 'release_date')
+
+    def get_books(self, fields=None, sort=None, limit=None, **filters):
+        """
+        Get books matching with given filters. When fields are given, only those columns
+        are fetched and converted. Books are sorted by given sort (e.g. '-release_date,name'),
+        and only the first 'limit' of them are fetched when a limit is given.
         """
-        Get books matching with given filters
+        fields = self.parse_fields(fields)
+        rows = self._get_book_rows(filters, fields, sort, limit)
+        with span('hydrate', 'Row to book conversion'):
+            books = [DbBook._from_db_row(self._storage, row, fields) for row in rows]
+        for book in books:
+            self._attach(book)
+        return books
+
+    def get_books_encoded(self, fields=None, sort=None, limit=None, **filters):
         """
+        Get json encoded books matching with given filters, sorted and limited like get_books.
+        Encoded books are cached by id, and a cached one is reused as long as its row is
+        unchanged, so that unchanged rows are neither converted into books nor encoded again.
+        """
+        fields = self.parse_fields(fields)
+        rows = self._get_book_rows(filters, fields, sort, limit)
+        with span('hydrate', 'Row to book conversion'):
+            return [self._encoded_cache.get_or_encode(self._storage, row, fields) for row in rows]
 
-        ufilters = self.unsupported_filters(filters)
-        if len(ufilters) > 0:
-            raise BookError('FILTER_ERROR', 'Given filters: {} are not supported'.format(ufilters))
+    def get_books_with_facets_encoded(self, facets, fields=None, sort=None, limit=None, **filters):
+        """
+        Same as get_books_encoded, and also counts all books matching with filters by each of given
+        facets (e.g. 'country,release_year') with the same query. Returns (books, facets) where
+        facets are {facet: [{facet: value, 'books': count}]}, most frequent values first.
+        """
+        fields = self.parse_fields(fields)
+        facets = self.parse_facets(facets)
+        if facets is None:
+            return self.get_books_encoded(fields, sort, limit, **filters), {}
+        self._check_filters(filters)
+        limit = self.parse_limit(limit)
+        order = self.sort_order(self.parse_sort(sort), limit)
+        rows, counts = self._storage.select_with_facets(filters, facets, fields, order, limit)
+        with span('hydrate', 'Row to book conversion'):
+            books = [self._encoded_cache.get_or_encode(self._storage, row, fields) for row in rows]
+        return books, {facet: self._facet_values(facet, counts[facet]) for facet in facets}
 
-        try:
-            with ConnectionPoolContext(self._cpool) as conn:
-                query = self._get_all_books_query(filters)
-                logger.debug('Executing query: %s', query)
-                cur = conn.cursor()
-                params = tuple(filters[key] for key in sorted(filters.keys()))
-                cur.execute(query, params)
-                books = [DbBook._from_db_row(self._cpool, row) for row in cur.fetchall()]
-                cur.close()
-                return books
-        except psycopg2.Error as err:
-            raise BookError(
-                'GET_BOOKS_ERROR',
-                'Unable to fetch books with filters: {} due to error: {}'.format(filters, err.pgerror),
-                err)
-
-    def _get_all_books_query(self, filters):
-        query = 'SELECT id, name, isbn, authors, country, number_of_pages, publisher, release_date FROM books'
-        if not filters:
-            return query
+    @staticmethod
+    def _facet_values(facet, counts):
+        # Most frequent values first, then in the order of values, a book without a value last
+        counts = sorted(counts, key=lambda count: (-count[1], count[0] is None, count[0]))
+        return [{facet: value, 'books': books} for value, books in counts]
 
-        query += ' WHERE '
-        values = ['{}=%s'.format(key) for key in sorted(filters.keys()) if key is not 'release_date']
+    def get_books_by_ids(self, ids, fields=None):
+        """
+        Get books having given ids with a single query. Returns books in the order of given ids,
+        and the ids which are not found.
+        """
+        fields = self.parse_fields(fields)
+        rows, missing = self._get_book_rows_by_ids(ids, fields)
+        with span('hydrate', 'Row to book conversion'):
+            books = [DbBook._from_db_row(self._storage, row, fields) for row in rows]
+        for book in books:
+            self._attach(book)
+        return books, missing
+
+    def get_books_by_ids_encoded(self, ids, fields=None):
+        """
+        Same as get_books_by_ids, but books are json encoded (and cached like get_books_encoded)
+        """
+        fields = self.parse_fields(fields)
+        rows, missing = self._get_book_rows_by_ids(ids, fields)
+        with span('hydrate', 'Row to book conversion'):
+            return [self._encoded_cache.get_or_encode(self._storage, row, fields) for row in rows], missing
 
-        if 'release_date' in filters:
-            values.append("date_part('year', release_date)=%s")
+    @classmethod
+    def parse_ids(cls, ids):
+        """
+        Validates given ids (a list or a comma separated string) and returns them as a tuple of
+        ints in the given order, without duplicates.
+        """
+        if isinstance(ids, str):
+            ids = ids.split(',')
+
+        parsed = []
+        for id in ids:
+            if isinstance(id, str):
+                given, id = id.strip(), parse_number(id)
+                if id is None:
+                    raise BookError('FILTER_ERROR', 'ids must be numbers, but got: {}'.format(given))
+            elif not isinstance(id, int) or isinstance(id, bool):
+                raise BookError('FILTER_ERROR', 'ids must be numbers, but got: {}'.format(id))
+            if id not in parsed:
+                parsed.append(id)
+
+        if not parsed:
+            raise BookError('FILTER_ERROR', 'ids must not be empty')
+        return tuple(parsed)
+
+    def _get_book_rows_by_ids(self, ids, fields=None):
+        ids = self.parse_ids(ids)
+        if len(ids) > self._max_ids:
+            raise BookError('FILTER_ERROR', 'Not more than {} ids can be fetched at once, but got: {}'.format(
+                self._max_ids, len(ids)))
+
+        rows_by_id = {row[0]: row for row in self._storage.select_by_ids(ids, fields)}
+        return [rows_by_id[id] for id in ids if id in rows_by_id], [id for id in ids if id not in rows_by_id]
+
+    @classmethod
+    def parse_fields(cls, fields):
+        """
+        Validates given fields (a list or a comma separated string) and returns them as a tuple
+        ordered like table columns. 'id' is always included. Returns None when all fields
+        are requested.
+        """
+        if not fields:
+            return None
+        if isinstance(fields, str):
+            fields = fields.split(',')
+
+        fields = {field.strip() for field in fields if field.strip()}
+        unknown = sorted(fields.difference(cls.book_fields))
+        if unknown:
+            raise BookError('FIELD_ERROR', 'Given fields: {} are not supported'.format(unknown))
+
+        fields.add('id')
+        if len(fields) == len(cls.book_fields):
+            return None
+        return tuple(field for field in cls.book_fields if field in fields)
+
+    @classmethod
+    def parse_facets(cls, facets):
+        """
+        Validates given facets (a list or a comma separated string of facet_dimensions) and returns
+        them as a tuple in the order of facet_dimensions, or None when there are none
+        """
+        if not facets:
+            return None
+        if isinstance(facets, str):
+            facets = facets.split(',')
+
+        facets = {facet.strip() for facet in facets if facet.strip()}
+        unknown = sorted(facets.difference(cls.facet_dimensions))
+        if unknown:
+            raise BookError('FILTER_ERROR', 'Given facets: {} are not supported. Supported facets are: {}'.format(
+                unknown, ', '.join(cls.facet_dimensions)))
+        return tuple(facet for facet in cls.facet_dimensions if facet in facets) or None
+
+    def _get_book_rows(self, filters, fields=None, sort=None, limit=None):
+        self._check_filters(filters)
+        limit = self.parse_limit(limit)
+        order = self.sort_order(self.parse_sort(sort), limit)
+        return self._storage.select(filters, fields, order, limit)
+
+    @classmethod
+    def parse_sort(cls, sort):
+        """
+        Validates given sort (a list or a comma separated string of fields, each descending when it
+        starts with '-') and returns it as a tuple of (field, descending), or None when it is empty
+        """
+        if not sort:
+            return None
+        if isinstance(sort, str):
+            sort = sort.split(',')
+
+        parsed = []
+        for key in sort:
+            key = key.strip()
+            field = key.lstrip('-').strip()
+            if field not in cls.sortable_fields:
+                raise BookError('FILTER_ERROR', 'Books can not be sorted by: {}. Sortable fields are: {}'.format(
+                    key, ', '.join(cls.sortable_fields)))
+            if field in (parsed_field for parsed_field, descending in parsed):
+                raise BookError('FILTER_ERROR', 'Books are sorted by {} more than once'.format(field))
+            parsed.append((field, key.startswith('-')))
+        return tuple(parsed)
+
+    def parse_limit(self, limit):
+        if limit is None:
+            return None
+        if isinstance(limit, str):
+            given, limit = limit, parse_number(limit)
+            if limit is None:
+                raise BookError('FILTER_ERROR', 'limit must be a number, but got: {}'.format(given))
+        if not 0 < limit <= self._max_limit:
+            raise BookError('FILTER_ERROR', 'limit must be between 1 and {}, but got: {}'.format(
+                self._max_limit, limit))
+        return limit
 
-        return query + ' and '.join(values)
+    @staticmethod
+    def sort_order(sort, limit=None):
+        """
+        Returns the order of rows for given sort: ties are broken by id in the direction of the last
+        sorted field, so that the order is stable and an index scanned backwards serves a descending sort.
+        Returns None when rows need not be ordered.
+        """
+        if not sort:
+            return (('id', False),) if limit is not None else None
+        if 'id' in (field for field, descending in sort):
+            return sort
+        return sort + (('id', sort[-1][1]),)
+
+    def _check_filters(self, filters):
+        ufilters = self.unsupported_filters(filters)
+        if len(ufilters) > 0:
+            raise BookError('FILTER_ERROR', 'Given filters: {} are not supported'.format(ufilters))
 
     def unsupported_filters(self, filters):
         if not filters:
@@ -57,30 +271,95 @@ class BookRepo:
 
         return [key for key in filters.keys() if key not in self.supported_filters]
 
-    def get_book(self, id):
+    def get_book(self, id, fields=None):
         """
         Get a book having given id
         """
-        try:
-            with ConnectionPoolContext(self._cpool) as conn:
-                cur = conn.cursor()
-                query = 'SELECT id, name, isbn, authors, country, number_of_pages, publisher, release_date FROM books WHERE id = %s'
-                logger.debug('Executing query: %s', query)
-                cur.execute(query, (id,))
-                row = cur.fetchone()
-                if not row:
-                    return None
-
-                book = DbBook._from_db_row(self._cpool, row)
-                return book
-        except psycopg2.Error as err:
-            raise BookError(
-                'GET_BOOK_ERROR',
-                'Unable to fetch a book due to error: {} {}'.format(err.pgerror, err.pgcode),
-                err)
+        return self._get_book_by('id', id, fields)
+
+    def get_book_by_isbn(self, isbn, fields=None):
+        """
+        Get a book having given isbn, looked up through the unique index of isbn
+        """
+        return self._get_book_by('isbn', isbn, fields)
+
+    def _get_book_by(self, column, value, fields=None):
+        fields = self.parse_fields(fields)
+        row = self._storage.select_by(column, value, fields)
+        if not row:
+            return None
+
+        with span('hydrate', 'Row to book conversion'):
+            book = DbBook._from_db_row(self._storage, row, fields)
+        return self._attach(book)
 
     def get_empty_book(self):
-        return DbBook(self._cpool)
+        return self._attach(DbBook(self._storage))
+
+    def update_books(self, values, dry_run=False, max_affected=None, **filters):
+        """
+        Updates given values of all books matching with filters, with a single statement.
+        Returns ids of the updated books, or of the books which would be updated on a dry run.
+        Nothing is updated when more than max_affected books match.
+        """
+        unknown = sorted(set(values).difference(self.book_fields[1:]))
+        if unknown:
+            raise BookError('FIELD_ERROR', 'Given fields: {} can not be updated'.format(unknown))
+        if not values:
+            raise BookError('FIELD_ERROR', 'No fields are given to update')
+
+        values = book_schema.validate(values, partial=True)
+        if 'authors' in values:
+            values['authors'] = json.dumps(values['authors'])
+        return self._write_books('update', filters, values, dry_run, max_affected)
+
+    def update_each(self, changes):
+        """
+        Updates given values of each book by id ({id: values}) in a batch, e.g. values of books which
+        differ from another catalog. Returns ids of the updated books.
+        """
+        values_by_id = {}
+        for id, values in changes.items():
+            unknown = sorted(set(values).difference(self.book_fields[1:]))
+            if unknown:
+                raise BookError('FIELD_ERROR', 'Given fields: {} can not be updated'.format(unknown))
+            values = book_schema.validate(values, partial=True)
+            if 'authors' in values:
+                values['authors'] = json.dumps(values['authors'])
+            if values:
+                values_by_id[id] = values
+        if not values_by_id:
+            return []
+
+        ids = self._storage.update_many(values_by_id)
+        for id in ids:
+            _notify_write(self._write_listeners, 'update', id)
+        return ids
+
+    def delete_books(self, dry_run=False, max_affected=None, **filters):
+        """
+        Deletes all books matching with filters, with a single statement.
+        Returns ids of the deleted books, or of the books which would be deleted on a dry run.
+        Nothing is deleted when more than max_affected books match.
+        """
+        return self._write_books('delete', filters, None, dry_run, max_affected)
+
+    def _write_books(self, operation, filters, values, dry_run, max_affected):
+        self._check_filters(filters)
+        if not filters:
+            # A missing filter must not end up in writing all books
+            raise BookError('FILTER_ERROR', 'Filters are required to {} books'.format(operation))
+
+        ids = self._storage.write_where(operation, filters, values, dry_run, max_affected)
+        if not dry_run:
+            for id in ids:
+                _notify_write(self._write_listeners, operation, id)
+        return ids
+
+    def _attach(self, book):
+        # Shared with every book of this repo, so that listeners added later are notified too
+        book._write_listeners = self._write_listeners
+        return book
 
 
 class DbBook:
@@ -88,9 +367,9 @@ class DbBook:
     A book represents a row of 'books' table
     """
 
-    def __init__(self, cpool, id=None):
+    def __init__(self, storage, id=None):
         self._id = id
-        self._cpool = cpool
+        self._storage = storage
         self._name = ''
         self._isbn = ''
         self._authors = []
@@ -98,6 +377,9 @@ class DbBook:
         self._number_of_pages = 0
         self._publisher = ''
         self._release_date = None
+        # Fields loaded from db, None when it is a complete book
+        self._fields = None
+        self._write_listeners = ()
 
     @property
     def id(self):
@@ -109,8 +391,7 @@ class DbBook:
 
     @name.setter
     def name(self, name):
-        if name is None or len(name.strip()) == 0:
-            raise BookError('INVALID_PROPERTY', 'name is blank')
+        book_schema.check('name', name)
         self._name = name
 
     @property
@@ -119,8 +400,7 @@ class DbBook:
 
     @isbn.setter
     def isbn(self, isbn):
-        if isbn is None or len(isbn.strip()) == 0:
-            raise BookError('INVALID_PROPERTY', 'isbn is blank')
+        book_schema.check('isbn', isbn)
         self._isbn = isbn
 
     @property
@@ -129,6 +409,7 @@ class DbBook:
 
     @authors.setter
     def authors(self, authors):
+        book_schema.check('authors', authors)
         self._authors = authors
 
     @property
@@ -137,6 +418,7 @@ class DbBook:
 
     @country.setter
     def country(self, country):
+        book_schema.check('country', country)
         self._country = country
 
     @property
@@ -145,6 +427,7 @@ class DbBook:
 
     @number_of_pages.setter
     def number_of_pages(self, number_of_pages):
+        book_schema.check('number_of_pages', number_of_pages)
         self._number_of_pages = number_of_pages
 
     @property
@@ -153,6 +436,7 @@ class DbBook:
 
     @publisher.setter
     def publisher(self, publisher):
+        book_schema.check('publisher', publisher)
         self._publisher = publisher
 
     @property
@@ -161,89 +445,101 @@ class DbBook:
 
     @release_date.setter
     def release_date(self, release_date):
-        try:
-            datetime.strptime(release_date, '%Y-%m-%d')
-        except ValueError as err:
-            raise BookError('INVALID_PROPERTY', 'release_date is not a date', err)
-
+        book_schema.check('release_date', release_date)
         self._release_date = release_date
 
     def set_values(self, **values):
-        for key, value in values.items():
-            if key == 'id':
-                continue
-
-            if hasattr(self, key):
-                setattr(self, key, value)
+        """
+        Sets given values (id is ignored) after validating all of them at once
+        """
+        for key, value in book_schema.validate(values, partial=True).items():
+            setattr(self, '_' + key, value)
 
     def save(self):
-        try:
-            with ConnectionPoolContext(self._cpool) as conn:
-                cur = conn.cursor()
-                if self._id:
-                    self._update(cur)
-                else:
-                    self._create(cur)
-                conn.commit()
-        except psycopg2.Error as err:
-            raise BookError(
-                'SAVE_BOOK_ERROR',
-                'Unable to save a book due to error: {} {}'.format(err.pgerror, err.pgcode),
-                err)
+        """
+        Creates or updates the book. Creating a book whose isbn exists already is a no-op when
+        the existing book has the same values (e.g. a retried create), and the book takes its id.
+        Returns False for such a no-op, otherwise True.
+        """
+        if self._fields is not None:
+            raise BookError('PARTIAL_BOOK', 'A book loaded with fields: {} can not be saved'.format(self._fields))
+
+        values = self._column_values()
+        if self._id:
+            self._storage.update(self._id, values)
+            logger.debug('book record has been updated with id:%d', self._id)
+            self._notify_write('update')
+            return True
+
+        self._id, created = self._storage.insert(values)
+        if created:
+            logger.debug('New book record has been created with id: %d', self._id)
+            self._notify_write('create')
+        return created
 
     def delete(self):
         """
         Delete itself
         """
-        try:
-            with ConnectionPoolContext(self._cpool) as conn:
-                cur = conn.cursor()
-                cur.execute('DELETE FROM books WHERE id = %s', (self._id,))
-                conn.commit()
-                cur.close()
-        except psycopg2.Error as err:
-            raise BookError(
-                'DELETE_BOOK_ERROR',
-                'Unable to delete a book due to error: {} {}'.format(err.pgerror, err.pgcode),
-                err)
-
-    def _create(self, cur):
-        authors = json.dumps(self._authors) if self._authors else None
-        cur.execute(
-            'INSERT INTO books (name, isbn, authors, country,number_of_pages, publisher, release_date) VALUES(%s, %s, %s, %s, %s, %s, %s) RETURNING id',
-            (self._name,
-             self._isbn,
-             authors,
-             self._country,
-             self._number_of_pages,
-             self._publisher,
-             self._release_date))
-        self._id = cur.fetchone()[0]
-        logger.debug('New book record has been created with id: %d', self._id)
-
-    def _update(self, cur):
-        cur.execute("""UPDATE books
-                       SET name = %s, isbn = %s, authors = %s, country = %s,
-                       number_of_pages=%s, publisher=%s, release_date=%s
-                       WHERE id = %s""",
-                    (self._name, self._isbn, json.dumps(self._authors),
-                     self._country, self._number_of_pages, self._publisher, self._release_date,
-                     self._id))
-        logger.debug('book record has been updated with id:%d', self._id)
+        self._storage.delete(self._id)
+        self._notify_write('delete')
+
+    def _notify_write(self, operation):
+        _notify_write(self._write_listeners, operation, self._id)
+
+    def _column_values(self):
+        """
+        Returns values of the book as they are stored, every field but id
+        """
+        return {
+            'name': self._name,
+            'isbn': self._isbn,
+            'authors': json.dumps(self._authors),
+            'country': self._country,
+            'number_of_pages': self._number_of_pages,
+            'publisher': self._publisher,
+            'release_date': self._release_date
+        }
 
     @staticmethod
-    def _from_db_row(cpool, row):
-        book = DbBook(cpool, row[0])
-        book.name = row[1]
-        book.isbn = row[2]
-        book.authors = json.loads(row[3])
-        book.country = row[4]
-        book.number_of_pages = row[5]
-        book.publisher = row[6]
-        book.release_date = datetime.strftime(row[7], '%Y-%m-%d')
+    def _from_db_row(storage, row, fields=None):
+        if fields is not None:
+            return DbBook._from_partial_db_row(storage, row, fields)
+
+        # Values of a row are valid already, they are not checked again
+        book = DbBook(storage, row[0])
+        book._name = row[1]
+        book._isbn = row[2]
+        book._authors = json.loads(row[3])
+        book._country = row[4]
+        book._number_of_pages = row[5]
+        book._publisher = row[6]
+        book._release_date = row[7].isoformat() if row[7] is not None else None
+        return book
+
+    @staticmethod
+    def _from_partial_db_row(storage, row, fields):
+        """
+        Converts a row having only given fields. Columns which are not fetched are
+        not converted at all (e.g. authors json is not decoded).
+        """
+        book = DbBook(storage, row[0])
+        for field, value in zip(fields[1:], row[1:]):
+            if field == 'authors':
+                value = json.loads(value)
+            elif field == 'release_date' and value is not None:
+                value = value.isoformat()
+            setattr(book, '_' + field, value)
+        book._fields = fields
         return book
 
     def values(self):
+        if self._fields is not None:
+            values = self._all_values()
+            return {field: values[field] for field in self._fields}
+        return self._all_values()
+
+    def _all_values(self):
         return {
             'id': self._id,
             'name': self._name,
@@ -255,37 +551,88 @@ class DbBook:
             'release_date': self._release_date
         }
 
+    def json(self):
+        """
+        Returns values of the book as json encoded bytes
+        """
+        return jsoncodec.dumps(self.values())
+
     def __repr__(self):
         return str(self.values())
 
 
-class ConnectionPoolContext:
+def _notify_write(listeners, operation, id):
+    for listener in listeners:
+        try:
+            listener(operation, id)
+        except Exception as err:
+            logger.error('Write listener failed for %s of book %s due to error: %s', operation, id, err)
 
-    def __init__(self, cpool):
-        self._cpool = cpool
-        self._conn = None
 
-    def __enter__(self):
-        self._conn = self._cpool.getconn()
-        return self._conn
+class EncodedBookCache:
+    """
+    A bounded LRU cache of json encoded books by id and fields. An entry keeps the row it was
+    encoded from and it is used only when the same row is fetched again.
+    """
 
-    def __exit__(self, *args):
-        self._cpool.putconn(self._conn)
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
 
+    def get_or_encode(self, storage, row, fields=None):
+        if self._max_size <= 0:
+            return DbBook._from_db_row(storage, row, fields).json()
 
-class BookError(Exception):
+        key = (row[0], fields)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == row:
+                self._entries.move_to_end(key)
+                return entry[1]
 
-    def __init__(self, name, message='', error=None):
-        super().__init__()
-        self._name = name
-        self._message = message
-        self._error = error
+        encoded = DbBook._from_db_row(storage, row, fields).json()
+        with self._lock:
+            self._entries[key] = (row, encoded)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+        return encoded
 
-    def error(self):
-        return self._error
+    def __len__(self):
+        return len(self._entries)
 
-    def name(self):
-        return name
 
-    def message(self):
-        return self._message
+class ConnectionPoolContext:
+
+    def __init__(self, cpool, block=False):
+        self._cpool = cpool
+        # Wait for a connection of an exhausted pool even without a request deadline
+        self._block = block
+        self._conn = None
+
+    def __enter__(self):
+        check_deadline('acquiring a db connection')
+        with span('pool', 'Connection checkout'):
+            self._conn = self._cpool.getconn(block=True) if self._block else self._cpool.getconn()
+
+        left = remaining()
+        if left is not None:
+            # Statements of the transaction are cancelled by Postgres when the request deadline is exceeded
+            try:
+                cur = self._conn.cursor()
+                cur.execute('SET LOCAL statement_timeout = %s', (max(int(left * 1000), 1),))
+                cur.close()
+            except psycopg2.Error:
+                self.__exit__(*sys.exc_info())
+                raise
+        return self._conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Do not hand over a connection in a failed transaction to the next user
+        if exc_type is not None and not self._conn.closed:
+            try:
+                self._conn.rollback()
+            except psycopg2.Error as err:
+                logger.warning('Unable to rollback a failed transaction due to error: %s', err)
+        self._cpool.putconn(self._conn)
@@ -0,0 +1,230 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+import lifecycle
+from external_books import ExternalBookError
+from .errors import BookError
+from .schema import book_schema
+logger = logging.getLogger(__name__)
+
+
+class CatalogSync:
+    """
+    Updates the values of local books which drifted from the external catalog (Ice and Fire api).
+    A local book is matched with the catalog book having its isbn, or when there is none, with the
+    single catalog book having its name. Only the fields which differ are written, batch_size books
+    at once. A sync runs every interval seconds in a background thread started by warm_up().
+
+    When a lock (e.g. an AdvisoryLock) is given, only the process holding it syncs, so that
+    the catalog is fetched and books are written once rather than once per worker.
+    """
+
+    name = 'catalog_sync'
+
+    # Fields taken from the catalog. Name and isbn identify a book, they are never changed.
+    default_fields = ('authors', 'country', 'number_of_pages', 'publisher', 'release_date')
+
+    # Changed books listed by a report, the others are only counted
+    max_reported_changes = 100
+
+    def __init__(self, book_repo, catalog, interval=3600, initial_delay=60, fields=default_fields, batch_size=100,
+                 clock=time.perf_counter, lock=None):
+        self._book_repo = book_repo
+        self._lock = lock
+        self._catalog = catalog
+        self._interval = interval
+        self._initial_delay = initial_delay
+        self._fields = tuple(fields)
+        self._batch_size = batch_size
+        self._clock = clock
+        self._running = threading.Lock()
+        self._report = None
+        self._error = None
+        self._state = 'cold'
+        self._pid = os.getpid()
+        self._thread = None
+        self._stopped = threading.Event()
+        lifecycle.register(self)
+
+    def run(self):
+        """
+        Syncs local books with the catalog and returns a report of what changed, and how long
+        each phase took
+        """
+        self._begin()
+        return self._run_begun()
+
+    def start(self):
+        """
+        Starts a sync in background, report() gives its report once it finishes. Raises
+        SYNC_IN_PROGRESS error right away when a sync is running or another process syncs.
+        """
+        self._begin()
+        threading.Thread(target=self._run_started, name='catalog-sync-run', daemon=True).start()
+
+    def _run_started(self):
+        try:
+            self._run_begun()
+        except BookError as err:
+            logger.error('Unable to sync books with the catalog due to error: %s', err.message())
+
+    def _begin(self):
+        if not self._running.acquire(blocking=False):
+            raise BookError('SYNC_IN_PROGRESS', 'Books are being synced with the catalog already')
+        if not self.leader():
+            self._running.release()
+            raise BookError('SYNC_IN_PROGRESS', 'Books are synced with the catalog by another process')
+
+    def _run_begun(self):
+        try:
+            report = self._sync()
+        except ExternalBookError as err:
+            self._error = err.message()
+            raise BookError('CATALOG_UNAVAILABLE', 'Unable to read the catalog due to error: {}'.format(
+                err.message()), err)
+        except BookError as err:
+            if self._holds_lock():
+                self._error = err.message()
+            raise
+        finally:
+            self._running.release()
+        self._report, self._error = report, None
+        return report
+
+    def _sync(self):
+        phases = {}
+        started = self._clock()
+        catalog_books, fetch_stats = self._catalog.fetch_books()
+        phases['fetch_ms'] = self._elapsed_ms(started)
+
+        start = self._clock()
+        local_books = [book.values() for book in self._book_repo.get_books(('name', 'isbn') + self._fields)]
+        phases['read_ms'] = self._elapsed_ms(start)
+
+        start = self._clock()
+        changes, matched, invalid = self.diff(local_books, [book.values() for book in catalog_books])
+        phases['diff_ms'] = self._elapsed_ms(start)
+
+        start = self._clock()
+        ids = []
+        batch = list(changes)
+        for offset in range(0, len(batch), self._batch_size):
+            ids.extend(self._book_repo.update_each({id: {field: values['to'] for field, values in changes[id].items()}
+                                                    for id in batch[offset:offset + self._batch_size]}))
+        phases['apply_ms'] = self._elapsed_ms(start)
+
+        books_by_id = {book['id']: book for book in local_books}
+        report = {
+            'finished_at': datetime.now(timezone.utc).isoformat(),
+            'total_ms': self._elapsed_ms(started),
+            'phases': phases,
+            'catalog_books': len(catalog_books),
+            'requests': fetch_stats['requests'],
+            'not_modified': fetch_stats['not_modified'],
+            'local_books': len(local_books),
+            'matched': matched,
+            'invalid': invalid,
+            'updated': len(ids),
+            'changes': [{'id': id, 'isbn': books_by_id[id]['isbn'], 'fields': changes[id]}
+                        for id in ids[:self.max_reported_changes]]
+        }
+        logger.info('Synced %d local books with %d catalog books in %.1f ms (%s): %d matched, %d updated, '
+                    '%d invalid, %d of %d catalog pages not modified', len(local_books), len(catalog_books),
+                    report['total_ms'], phases, matched, len(ids), invalid, fetch_stats['not_modified'],
+                    fetch_stats['requests'])
+        return report
+
+    def diff(self, local_books, catalog_books):
+        """
+        Compares local books with catalog books (both dicts of values). Returns changes by id of
+        local books ({id: {field: {'from': .., 'to': ..}}}), the number of matched local books and
+        the number of catalog books whose values are not valid for a local book.
+        """
+        by_isbn = {book['isbn']: book for book in catalog_books}
+        by_name = {}
+        for book in catalog_books:
+            by_name.setdefault(self._name_key(book['name']), []).append(book)
+
+        changes, matched, invalid = {}, 0, 0
+        for book in local_books:
+            match = by_isbn.get(book['isbn'])
+            if match is None:
+                named = by_name.get(self._name_key(book['name']), ())
+                match = named[0] if len(named) == 1 else None
+            if match is None:
+                continue
+            matched += 1
+
+            changed = {field: match[field] for field in self._fields if match[field] != book[field]}
+            if not changed:
+                continue
+            errors = book_schema.errors(changed, partial=True)
+            if errors:
+                invalid += 1
+                logger.warning('Catalog book with isbn: %s has invalid values: %s', match['isbn'], errors)
+                continue
+            changes[book['id']] = {field: {'from': book[field], 'to': value} for field, value in changed.items()}
+        return changes, matched, invalid
+
+    @staticmethod
+    def _name_key(name):
+        return ' '.join(name.split()).lower() if name else name
+
+    def _elapsed_ms(self, start):
+        return round((self._clock() - start) * 1000, 3)
+
+    def leader(self):
+        """
+        Returns True when this process syncs, acquiring the lock when no other process holds it
+        """
+        return self._lock is None or self._lock.acquire()
+
+    def _holds_lock(self):
+        return self._lock is None or self._lock.held()
+
+    def report(self):
+        """
+        Returns the report of the last sync, the error of the last failed sync after it, whether
+        a sync is running, and whether this process is the one syncing (the others have no report)
+        """
+        return {'last_sync': self._report, 'error': self._error, 'running': self._running.locked(),
+                'leader': self._holds_lock()}
+
+    def warm_up(self):
+        """
+        Starts syncing in background, the first sync runs after initial_delay seconds
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._schedule, name='catalog-sync', daemon=True)
+            self._thread.start()
+        self._state = 'ready'
+
+    def _schedule(self):
+        delay = self._initial_delay
+        while not self._stopped.wait(delay):
+            delay = self._interval
+            try:
+                self.run()
+            except BookError as err:
+                if not self._holds_lock():
+                    logger.debug('Skipped sync of books with the catalog: %s', err.message())
+                    continue
+                logger.error('Unable to sync books with the catalog due to error: %s', err.message())
+
+    def state(self):
+        return self._state, None
+
+    def reset_after_fork(self):
+        if self._pid != os.getpid():
+            # The syncing thread is not running in the child, it is started by warm up
+            self._pid = os.getpid()
+            self._running = threading.Lock()
+            self._stopped = threading.Event()
+            self._thread = None
+            self._state = 'cold'
+
+    def close(self):
+        self._stopped.set()
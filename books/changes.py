@@ -0,0 +1,227 @@
+import json
+import logging
+import os
+import select
+import threading
+import time
+from collections import deque
+import psycopg2
+import psycopg2.extensions
+import lifecycle
+from .book import ConnectionPoolContext, BookError
+logger = logging.getLogger(__name__)
+
+
+class ChangeFeed:
+    """
+    Fans out changes of books to any number of subscribers in this process through a single
+    'LISTEN' connection. Changes are recorded into 'book_changes' table and notified by a
+    trigger on 'books' table, so that a subscriber can resume from the last sequence it saw.
+
+    Recent changes are buffered in memory by arrival position. Sequences are assigned at
+    insert time while notifications arrive in commit order, hence subscribers follow the
+    buffer by position rather than by sequence.
+    """
+
+    # LISTEN connections inherited from a parent process
+    _inherited = []
+
+    def __init__(self, cpool, connection_config, channel='book_changes', buffer_size=1000):
+        self._cpool = cpool
+        # A LISTEN connection is dedicated, hence pool settings do not apply to it
+        self._connection_config = {key: value for key, value in connection_config.items()
+                                   if key not in ('minconn', 'maxconn')}
+        self._channel = channel
+        self._buffer = deque(maxlen=buffer_size)
+        self._position = 0
+        self._last_seq = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._conn = None
+        self._stopped = False
+        lifecycle.register(self)
+
+    def start(self):
+        """
+        Starts listening in background, unless it is already listening in this process
+        """
+        with self._condition:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._stopped = False
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._listen, name='book-change-feed', daemon=True)
+            self._thread.start()
+
+    def _listen(self):
+        backoff = 1
+        while not self._stopped:
+            try:
+                self._conn = psycopg2.connect(**self._connection_config)
+                self._conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                cur = self._conn.cursor()
+                cur.execute('LISTEN {}'.format(self._channel))
+                # Changes committed while not listening are read from the table
+                if self._last_seq:
+                    cur.execute('SELECT seq, book_id, operation FROM book_changes WHERE seq > %s ORDER BY seq',
+                                (self._last_seq,))
+                    for row in cur.fetchall():
+                        self.publish({'seq': row[0], 'id': row[1], 'op': row[2]})
+                backoff = 1
+                logger.info('Listening for book changes on channel: %s', self._channel)
+
+                while not self._stopped:
+                    if select.select([self._conn], [], [], 5) == ([], [], []):
+                        continue
+                    self._conn.poll()
+                    while self._conn.notifies:
+                        notify = self._conn.notifies.pop(0)
+                        self.publish(json.loads(notify.payload))
+            except (psycopg2.Error, OSError, ValueError) as err:
+                logger.error('Book change feed is interrupted due to error: %s. Reconnecting in %d sec',
+                             err, backoff)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+            finally:
+                if self._conn is not None and not self._conn.closed:
+                    self._conn.close()
+
+    def publish(self, event):
+        with self._condition:
+            self._position += 1
+            self._buffer.append((self._position, event))
+            self._last_seq = max(self._last_seq, event['seq'])
+            self._condition.notify_all()
+
+    def position(self):
+        with self._condition:
+            return self._position
+
+    def wait_for_events(self, position, timeout):
+        """
+        Waits up to timeout seconds for events after given buffer position.
+        Returns (events, new position, missed). Missed is True when events after the position
+        are no longer buffered.
+        """
+        with self._condition:
+            if self._position <= position:
+                self._condition.wait(timeout)
+            if self._buffer and self._buffer[0][0] > position + 1:
+                return [], self._position, True
+            events = [event for event_position, event in self._buffer if event_position > position]
+            return events, self._position, False
+
+    def changes_since(self, seq, limit=1000, gaps=(), block=False):
+        """
+        Reads recorded changes after given sequence from the table, and the changes having given
+        sequences (gaps), e.g. the ones which were not committed yet when later ones were read.
+        A blocking caller waits for a connection of an exhausted pool, e.g. a stream which has
+        no request deadline.
+        """
+        try:
+            with ConnectionPoolContext(self._cpool, block) as conn:
+                cur = conn.cursor()
+                if gaps:
+                    cur.execute('SELECT seq, book_id, operation FROM book_changes WHERE seq > %s OR seq = ANY(%s) '
+                                'ORDER BY seq LIMIT %s', (seq, list(gaps), limit))
+                else:
+                    cur.execute('SELECT seq, book_id, operation FROM book_changes WHERE seq > %s ORDER BY seq '
+                                'LIMIT %s', (seq, limit))
+                rows = cur.fetchall()
+                conn.commit()
+                cur.close()
+        except psycopg2.Error as err:
+            raise BookError('GET_CHANGES_ERROR', 'Unable to fetch book changes due to error: {}'.format(err.pgerror),
+                            err)
+        return [{'seq': row[0], 'id': row[1], 'op': row[2]} for row in rows]
+
+    def last_seq(self):
+        try:
+            with ConnectionPoolContext(self._cpool) as conn:
+                cur = conn.cursor()
+                cur.execute('SELECT coalesce(max(seq), 0) FROM book_changes')
+                seq = cur.fetchone()[0]
+                conn.commit()
+                cur.close()
+                return seq
+        except psycopg2.Error as err:
+            raise BookError('GET_CHANGES_ERROR', 'Unable to fetch book changes due to error: {}'.format(err.pgerror),
+                            err)
+
+    def subscribe(self, since=None, heartbeat=15, batch_size=1000, gap_timeout=60.0):
+        """
+        Generates changes after given sequence (or from now on), and None as a heartbeat
+        when nothing changed for 'heartbeat' seconds. Changes are read from the table page by
+        page ('batch_size' of them) when resuming and when falling behind the buffer. Sequences
+        skipped by the changes seen so far (gaps, e.g. of transactions which were not committed
+        yet) are read again then, until they are seen or 'gap_timeout' seconds passed.
+        """
+        self.start()
+        position = self.position()
+        delivered = set()
+        # Missed sequence -> monotonic time it was first missed at
+        gaps = {}
+
+        def deliver(event):
+            # Returns True when the event is seen for the first time
+            nonlocal since
+            seq = event['seq']
+            gaps.pop(seq, None)
+            if seq in delivered:
+                return False
+            delivered.add(seq)
+            if since is not None and seq > since + 1:
+                # Transactions in flight are few, a longer run of missing sequences was purged or rolled back
+                missed_at = time.monotonic()
+                gaps.update((missed, missed_at) for missed in range(max(since + 1, seq - batch_size), seq)
+                            if missed not in delivered)
+            since = seq if since is None else max(since, seq)
+            return True
+
+        def catch_up():
+            while True:
+                # Streams outlive their request deadline, they wait for a connection rather than end
+                events = self.changes_since(since, batch_size, sorted(gaps), block=True)
+                for event in events:
+                    if deliver(event):
+                        yield event
+                if len(events) < batch_size:
+                    break
+            # A missed sequence is given up after gap_timeout, e.g. it was taken by a rolled back transaction
+            now = time.monotonic()
+            for seq in [seq for seq, missed_at in gaps.items() if now - missed_at > gap_timeout]:
+                del gaps[seq]
+
+        if since is not None:
+            yield from catch_up()
+
+        while True:
+            events, position, missed = self.wait_for_events(position, heartbeat)
+            if missed and since is not None:
+                # Fell behind the buffer, catch up from the table
+                events = catch_up()
+            else:
+                events = (event for event in events if deliver(event))
+            idle = True
+            for event in events:
+                idle = False
+                yield event
+            if idle:
+                yield None
+            if len(delivered) > 10000:
+                delivered.clear()
+
+    def reset_after_fork(self):
+        if self._pid is not None and self._pid != os.getpid():
+            # The listening thread is not running in the child, it is started on first subscription.
+            # The inherited connection is kept referenced, garbage collecting it would close the
+            # parent's session.
+            self._condition = threading.Condition()
+            self._thread = None
+            if self._conn is not None:
+                ChangeFeed._inherited.append(self._conn)
+                self._conn = None
+
+    def close(self):
+        self._stopped = True
@@ -0,0 +1,21 @@
+class BookError(Exception):
+
+    def __init__(self, name, message='', error=None, details=None):
+        super().__init__()
+        self._name = name
+        self._message = message
+        self._error = error
+        # Errors by field, e.g. of an invalid book
+        self._details = details
+
+    def error(self):
+        return self._error
+
+    def name(self):
+        return self._name
+
+    def message(self):
+        return self._message
+
+    def details(self):
+        return self._details
@@ -0,0 +1,75 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from .book import BookError
+
+
+class IdempotencyStore:
+    """
+    Remembers responses of requests by their Idempotency-Key for 'ttl' seconds, so that a retried
+    request gets the original response instead of being processed again. Not more than 'max_keys'
+    keys are kept, least recently used ones are dropped first.
+
+    Keys are kept per process. Retries reaching another process are still safe for creating books,
+    as they end up in the same isbn.
+    """
+
+    def __init__(self, max_keys=10000, ttl=86400, clock=time.monotonic):
+        self._max_keys = max_keys
+        self._ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(body):
+        return hashlib.sha1(body).hexdigest()
+
+    def begin(self, key, fingerprint):
+        """
+        Starts processing a request with given key. Returns the remembered response when the key
+        was processed already, otherwise None and the request must be completed or aborted.
+        """
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= now:
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                self._entries[key] = (fingerprint, now + self._ttl, None)
+                self._evict()
+                return None
+
+            self._entries.move_to_end(key)
+            if entry[0] != fingerprint:
+                raise BookError('IDEMPOTENCY_KEY_REUSED',
+                                'Idempotency-Key: {} was used for a different request'.format(key))
+            if entry[2] is None:
+                raise BookError('IDEMPOTENCY_IN_PROGRESS',
+                                'A request with Idempotency-Key: {} is in progress'.format(key))
+            return entry[2]
+
+    def complete(self, key, response):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (entry[0], entry[1], response)
+
+    def abort(self, key):
+        """
+        Forgets a request which failed, so that it can be retried
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is None:
+                del self._entries[key]
+
+    def _evict(self):
+        while len(self._entries) > self._max_keys:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,130 @@
+from urllib.parse import urlencode
+from .book import BookRepo, BookError, parse_number
+
+# Query parameters of book listing which are options rather than filters
+list_options = ('fields', 'ids', 'sort', 'limit', 'facets')
+
+# Query parameters of bulk updates / deletes which are options rather than filters
+bulk_options = ('dry_run', 'max_affected')
+
+
+def parse_list_params(args, option_names=list_options):
+    """
+    Splits query parameters of book listing into filters and options, and normalizes them:
+    names are lower cased, values are stripped, release_date becomes a year, fields are
+    ordered like table columns, duplicate ids are dropped, spaces are dropped from sort and
+    facets are ordered like BookRepo.facet_dimensions.
+    Returns (filters, options).
+    """
+    filters = {}
+    options = {}
+    for name in args.keys():
+        values = args.getlist(name)
+        key = name.strip().lower()
+        if len(values) != 1 or key in filters or key in options:
+            raise BookError('FILTER_ERROR', 'Query parameter: {} is given more than once'.format(key))
+
+        value = values[0].strip()
+        if key in option_names:
+            options[key] = value
+        else:
+            filters[key] = value
+
+    if 'release_date' in filters:
+        filters['release_date'] = parse_year(filters['release_date'])
+
+    if 'fields' in options:
+        fields = BookRepo.parse_fields(options['fields'])
+        if fields is None:
+            del options['fields']
+        else:
+            options['fields'] = ','.join(fields)
+
+    if 'sort' in options:
+        sort = BookRepo.parse_sort(options['sort'])
+        if sort is None:
+            del options['sort']
+        else:
+            options['sort'] = ','.join(('-' if descending else '') + field for field, descending in sort)
+
+    if 'limit' in options:
+        limit = parse_number(options['limit'])
+        if limit is None:
+            raise BookError('FILTER_ERROR', 'limit must be a number, but got: {}'.format(options['limit']))
+        options['limit'] = str(limit)
+
+    if 'facets' in options:
+        facets = BookRepo.parse_facets(options['facets'])
+        if facets is None:
+            del options['facets']
+        else:
+            options['facets'] = ','.join(facets)
+
+    if 'ids' in options:
+        if filters:
+            raise BookError('FILTER_ERROR', 'ids can not be combined with filters: {}'.format(sorted(filters)))
+        if 'sort' in options or 'limit' in options:
+            raise BookError('FILTER_ERROR', 'Books fetched by ids are in the order of ids, sort and limit '
+                                            'can not be given')
+        if 'facets' in options:
+            raise BookError('FILTER_ERROR', 'Books fetched by ids can not be counted by facets')
+        options['ids'] = ','.join(str(id) for id in BookRepo.parse_ids(options['ids']))
+
+    return filters, options
+
+
+def parse_bulk_params(args, max_affected):
+    """
+    Splits query parameters of bulk updates / deletes into filters and options. max_affected
+    option can lower given max_affected, but not raise it. Returns (filters, options).
+    """
+    filters, options = parse_list_params(args, bulk_options)
+    options['dry_run'] = options.get('dry_run', 'false').lower() in ('true', '1', 'yes')
+
+    given = options.get('max_affected', str(max_affected))
+    limit = parse_number(given)
+    if limit is None:
+        raise BookError('FILTER_ERROR', 'max_affected must be a number, but got: {}'.format(given))
+    options['max_affected'] = min(limit, max_affected)
+    return filters, options
+
+
+def parse_body_filters(body):
+    """
+    Validates filters given in json body of book listing. They are passed to BookRepo next to
+    the options, hence must be an object of supported filters only. Returns the filters normalized
+    like query parameters: release_date becomes a year.
+    """
+    if not isinstance(body, dict):
+        raise BookError('FILTER_ERROR', 'Filters must be a json object, but got: {}'.format(body))
+    unsupported = [key for key in body if key not in BookRepo.supported_filters]
+    if unsupported:
+        raise BookError('FILTER_ERROR', 'Given filters: {} are not supported'.format(unsupported))
+
+    filters = dict(body)
+    for name, value in filters.items():
+        if name != 'release_date' and not isinstance(value, str):
+            raise BookError('FILTER_ERROR', '{} filter must be a string, but got: {}'.format(name, value))
+    if 'release_date' in filters:
+        filters['release_date'] = parse_year(filters['release_date'])
+    return filters
+
+
+def parse_year(value):
+    # A bool is an int in python, but not in json
+    if type(value) is int:
+        return value
+    year = parse_number(value) if isinstance(value, str) else None
+    if year is None:
+        raise BookError('FILTER_ERROR', 'release_date filter must be a year, but got: {}'.format(value))
+    return year
+
+
+def canonical_query(filters, options):
+    """
+    Returns a query string which is the same for every equivalent listing request,
+    so that http caches store one entry per distinct listing.
+    """
+    params = dict(filters)
+    params.update(options)
+    return urlencode(sorted(params.items()))
@@ -0,0 +1,134 @@
+import logging
+import os
+import threading
+import time
+import psycopg2
+from psycopg2 import pool
+import lifecycle
+from deadlines import DeadlineExceeded, remaining
+logger = logging.getLogger(__name__)
+
+
+class ForkSafeConnectionPool:
+    """
+    A ThreadedConnectionPool which is created lazily and never shared between processes.
+    The pool (and its 'minconn' connections) is opened either on first use or by warm_up().
+    A forked process gets its own pool, while connections inherited from the parent are left
+    untouched (closing them would terminate the parent's db sessions).
+
+    When all connections are in use, a request having a deadline waits for a connection until
+    its deadline, and a blocking caller (e.g. the group commit writer) waits until one is put
+    back. Other callers fail right away with PoolError.
+    """
+
+    # Pools inherited from a parent process. They are referenced until exit, so that garbage
+    # collection never closes connections which belong to the parent.
+    _inherited = []
+
+    def __init__(self, config, name='db'):
+        self._config = config
+        self._name = name
+        self._lock = threading.Lock()
+        # Notified when a connection is put back
+        self._available = threading.Condition()
+        self._pid = None
+        self._pool = None
+        self._state = 'cold'
+        self._error = None
+        lifecycle.register(self)
+
+    @property
+    def name(self):
+        return self._name
+
+    def _current(self):
+        cpool = self._pool
+        if cpool is not None and self._pid == os.getpid():
+            return cpool
+
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = pool.ThreadedConnectionPool(**self._config)
+                self._pid = os.getpid()
+                self._state = 'ready'
+                logger.info('Created connection pool: %s for process %d', self._name, self._pid)
+            return self._pool
+
+    def getconn(self, key=None, block=False):
+        cpool = self._current()
+        wait = remaining()
+        if wait is None and not block:
+            return cpool.getconn(key)
+
+        until = time.monotonic() + wait if wait is not None else None
+        with self._available:
+            while True:
+                try:
+                    return cpool.getconn(key)
+                except pool.PoolError:
+                    if cpool.closed:
+                        raise
+                    if until is None:
+                        self._available.wait()
+                        continue
+                    left = until - time.monotonic()
+                    if left <= 0:
+                        raise DeadlineExceeded('DB_POOL_TIMEOUT', 'No connection of db pool: {} is available '
+                                                                  'within the request deadline'.format(self._name))
+                    self._available.wait(left)
+
+    def putconn(self, conn, key=None, close=False):
+        self._current().putconn(conn, key, close)
+        with self._available:
+            self._available.notify()
+
+    def closeall(self):
+        self.close()
+
+    def warm_up(self):
+        """
+        Opens the pool and checks a connection, so that first requests need not wait for it
+        """
+        self._state = 'warming'
+        try:
+            cpool = self._current()
+            conn = cpool.getconn()
+            try:
+                conn.cursor().execute('SELECT 1')
+                conn.rollback()
+            finally:
+                cpool.putconn(conn)
+            self._state, self._error = 'ready', None
+        except psycopg2.Error as err:
+            self._state, self._error = 'failed', str(err).strip()
+            logger.error('Unable to warm up connection pool: %s due to error: %s', self._name, self._error)
+
+    def state(self):
+        """
+        Returns one of 'cold', 'warming', 'ready' or 'failed', and the error of last warm up
+        """
+        if self._pid != os.getpid() and self._state == 'ready':
+            return 'cold', None
+        return self._state, self._error
+
+    def reset_after_fork(self):
+        if self._pid is None or self._pid == os.getpid():
+            return
+        # The lock may have been held by another thread of the parent while forking
+        self._lock = threading.Lock()
+        self._available = threading.Condition()
+        self._state, self._error = 'cold', None
+        if self._pool is not None:
+            ForkSafeConnectionPool._inherited.append(self._pool)
+            self._pool = None
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.closeall()
+                logger.info('Closed connection pool: %s of process %d', self._name, self._pid)
+            self._pool = None
+            self._state = 'cold'
+        # Callers waiting for a connection fail with the closed pool
+        with self._available:
+            self._available.notify_all()
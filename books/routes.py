@@ -1,48 +1,241 @@
 import logging
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, redirect, current_app
 from urllib.parse import unquote
 
 from psycopg2 import pool
-from .book import BookRepo
+from psycopg2.extensions import QueryCanceledError
+import admin
+import admission
+import jsoncodec
+from external_books import ExternalCatalog
+from .book import BookRepo, BookError, parse_number
+from .schema import book_schema
+from .stats import BookStatsRepo
+from .changes import ChangeFeed
+from .idempotency import IdempotencyStore
+from .slow_queries import SlowQueryLog, QueryExplainer
+from .catalog_sync import CatalogSync
+from .advisory_lock import AdvisoryLock
+from .writer import GroupCommitWriter
+from .pool import ForkSafeConnectionPool
+from .storage import PostgresStorage, SqliteStorage, MemoryStorage, ReadModelStorage
+from .params import parse_list_params, parse_bulk_params, parse_body_filters, canonical_query
 logger = logging.getLogger(__name__)
 
 
 def createBlueprint(config):
-    cpool = pool.ThreadedConnectionPool(**config['connection_pool'])
-    if not cpool:
-        raise ValueError('Unable to create a connection pool.')
-
-    book_repo = BookRepo(cpool)
-    book_routes = BookRoutes(book_repo)
+    slow_query_log = create_slow_query_log(config)
+    storage, cpool = create_storage(config, slow_query_log)
+    change_feed = None
+    changes_config = config.get('changes', {})
+    if cpool is not None:
+        change_feed = ChangeFeed(cpool, config['connection_pool'], changes_config.get('channel', 'book_changes'),
+                                 changes_config.get('buffer_size', 1000))
+    read_model = config.get('read_model', {})
+    if read_model.get('enabled', False):
+        # Changes made by other processes are read from 'book_changes' table of Postgres
+        storage = ReadModelStorage(storage, change_feed, read_model.get('refresh_interval', 1.0),
+                                   read_model.get('max_staleness', 5.0), read_model.get('gap_timeout', 60.0))
+    book_repo = BookRepo(storage, config.get('encoded_cache_size', 10000), config.get('max_ids', 100),
+                         config.get('max_limit', 1000))
+    idempotency_config = config.get('idempotency', {})
+    idempotency_store = IdempotencyStore(idempotency_config.get('max_keys', 10000),
+                                         idempotency_config.get('ttl', 86400))
+    book_routes = BookRoutes(book_repo, config.get('http_cache', {}), idempotency_store,
+                             config.get('bulk', {}).get('max_affected', 1000))
 
     blueprint = Blueprint('books_api', __name__)
+    blueprint.register_error_handler(BookError, handle_book_error)
     blueprint.add_url_rule('/books', view_func=book_routes.get_books, methods=['GET'])
     blueprint.add_url_rule('/books', view_func=book_routes.create_book, methods=['POST'])
+    blueprint.add_url_rule('/books', view_func=book_routes.update_books, methods=['PATCH'])
+    blueprint.add_url_rule('/books', view_func=book_routes.delete_books, methods=['DELETE'])
     blueprint.add_url_rule('/books/<int:id>', view_func=book_routes.get_book, methods=['GET'])
+    blueprint.add_url_rule('/books/isbn/<isbn>', view_func=book_routes.get_book_by_isbn, methods=['GET'])
     blueprint.add_url_rule('/books/<int:id>', view_func=book_routes.update_book, methods=['PATCH'])
     blueprint.add_url_rule('/books/<int:id>/update', view_func=book_routes.update_book, methods=['POST'])
     blueprint.add_url_rule('/books/<int:id>', view_func=book_routes.delete_book, methods=['DELETE'])
     blueprint.add_url_rule('/books/<int:id>/delete', view_func=book_routes.delete_book, methods=['POST'])
+
+    catalog_sync = create_catalog_sync(config, book_repo, config['connection_pool'] if cpool is not None else None)
+    if catalog_sync is not None:
+        catalog_sync_routes = CatalogSyncRoutes(catalog_sync, config['catalog_sync'].get('admin_token'))
+        blueprint.add_url_rule('/admin/catalog-sync', view_func=catalog_sync_routes.get_catalog_sync, methods=['GET'])
+        blueprint.add_url_rule('/admin/catalog-sync', view_func=catalog_sync_routes.run_catalog_sync,
+                               methods=['POST'])
+
+    if cpool is not None:
+        # Stats view and change feed are served by Postgres only
+        book_stats_repo = BookStatsRepo(cpool, config.get('stats', {}).get('refresh_delay', 1.0))
+        book_repo.add_write_listener(book_stats_repo.on_book_write)
+        book_stats_routes = BookStatsRoutes(book_stats_repo)
+        book_changes_routes = BookChangesRoutes(change_feed, changes_config)
+        blueprint.add_url_rule('/books/changes', view_func=book_changes_routes.get_changes, methods=['GET'])
+        blueprint.add_url_rule('/books/stats', view_func=book_stats_routes.get_stats, methods=['GET'])
+        blueprint.add_url_rule('/books/stats/<dimension>', view_func=book_stats_routes.get_stats_by,
+                               methods=['GET'])
+        if slow_query_log is not None:
+            slow_query_routes = SlowQueryRoutes(slow_query_log, config['slow_queries'].get('admin_token'))
+            blueprint.add_url_rule('/admin/slow-queries', view_func=slow_query_routes.get_slow_queries,
+                                   methods=['GET'])
     return blueprint
 
 
+def create_slow_query_log(config):
+    """
+    Creates the log of slow statements configured by 'slow_queries' of books api config, or None when
+    it is disabled
+    """
+    slow_queries = config.get('slow_queries', {})
+    if not slow_queries.get('enabled', False):
+        return None
+    explainer = None
+    if slow_queries.get('explain_sample_rate', 0.1) > 0:
+        explainer = QueryExplainer(config['connection_pool'], slow_queries.get('explain_timeout_ms', 5000))
+    return SlowQueryLog(slow_queries.get('threshold_ms', 100), slow_queries.get('max_shapes', 100), explainer,
+                        slow_queries.get('explain_top', 10), slow_queries.get('explain_sample_rate', 0.1),
+                        slow_queries.get('explain_interval', 300))
+
+
+def create_catalog_sync(config, book_repo, connection_config=None):
+    """
+    Creates the sync of books with the external catalog configured by 'catalog_sync' of books api
+    config, or None when it is disabled. With a Postgres connection config, only the process
+    holding an advisory lock syncs.
+    """
+    catalog_sync = config.get('catalog_sync', {})
+    if not catalog_sync.get('enabled', False):
+        return None
+    catalog = ExternalCatalog(catalog_sync, page_size=catalog_sync.get('page_size', 50),
+                              max_workers=catalog_sync.get('max_workers', 4),
+                              rate_limit=catalog_sync.get('rate_limit', 5.0), timeout=catalog_sync.get('timeout', 10.0))
+    lock = AdvisoryLock(connection_config, 'booksapi.catalog_sync') if connection_config is not None else None
+    return CatalogSync(book_repo, catalog, catalog_sync.get('interval', 3600), catalog_sync.get('initial_delay', 60),
+                       catalog_sync.get('fields', CatalogSync.default_fields), catalog_sync.get('batch_size', 100),
+                       lock=lock)
+
+
+def create_storage(config, slow_query_log=None):
+    """
+    Creates the storage of books configured by 'storage' of books api config.
+    Returns (storage, connection pool or None when it is not Postgres).
+    Statements of Postgres are timed into given slow query log.
+    """
+    storage_config = config.get('storage', {})
+    backend = storage_config.get('backend', 'postgres')
+    if backend == 'postgres':
+        # Connections are opened on first use or warm up, not while creating the app
+        cpool = ForkSafeConnectionPool(config['connection_pool'], 'books_db')
+        group_commit = config.get('group_commit', {})
+        writer = None
+        if group_commit.get('enabled', False):
+            writer = GroupCommitWriter(cpool, group_commit.get('max_batch', 50),
+                                       group_commit.get('max_delay_ms', 0) / 1000)
+        return PostgresStorage(cpool, writer, slow_query_log), cpool
+
+    if backend == 'sqlite':
+        sqlite_config = storage_config.get('sqlite', {})
+        return SqliteStorage(sqlite_config.get('path', 'booksapi.db'), sqlite_config.get('busy_timeout_ms', 5000),
+                             sqlite_config.get('synchronous', 'NORMAL')), None
+
+    if backend == 'memory':
+        return MemoryStorage(), None
+
+    raise ValueError('Unsupported storage backend: {}'.format(backend))
+
+
+# Http status codes of book errors caused by a bad request. Every other error is a server error.
+error_status_codes = {
+    'FILTER_ERROR': 400,
+    'FIELD_ERROR': 400,
+    'INVALID_PROPERTY': 400,
+    'PARTIAL_BOOK': 400,
+    'DIMENSION_ERROR': 400,
+    'BOOK_NOT_FOUND': 404,
+    'DUPLICATE_ISBN': 409,
+    'IDEMPOTENCY_IN_PROGRESS': 409,
+    'IDEMPOTENCY_KEY_REUSED': 422,
+    'TOO_MANY_BOOKS': 409,
+    'SYNC_IN_PROGRESS': 409,
+    'CATALOG_UNAVAILABLE': 502
+}
+
+
+def handle_book_error(err):
+    if isinstance(err.error(), QueryCanceledError):
+        # Cancelled by statement_timeout, which is the time left until the request deadline
+        logger.warning('%s: %s', err.name(), err.message())
+        return {
+            'code': 504,
+            'name': 'DB_STATEMENT_TIMEOUT',
+            'description': 'A db statement was cancelled as the request deadline is exceeded'
+        }, 504
+    if isinstance(err.error(), pool.PoolError):
+        # All connections are in use, the request may succeed a bit later
+        return {
+            'code': 503,
+            'name': 'SERVICE_OVERLOADED',
+            'description': 'No db connection is available, please retry later'
+        }, 503, {'Retry-After': '1'}
+
+    status_code = error_status_codes.get(err.name(), 500)
+    if status_code == 500:
+        logger.error('%s: %s', err.name(), err.message())
+    body = {
+        'code': status_code,
+        'name': err.name(),
+        'description': err.message()
+    }
+    if err.details() is not None:
+        body['errors'] = err.details()
+    return body, status_code
+
+
 class BookRoutes:
 
-    def __init__(self, book_repo):
+    def __init__(self, book_repo, http_cache=None, idempotency_store=None, max_affected=1000):
         self._book_repo = book_repo
+        self._http_cache = http_cache or {}
+        self._idempotency_store = idempotency_store
+        self._max_affected = max_affected
 
     def create_book(self):
         """
-        Creates a new book
+        Creates a new book. A request carrying an Idempotency-Key header is processed once,
+        its retries get the same response.
         """
+        key = request.headers.get('Idempotency-Key')
+        if key is None or self._idempotency_store is None:
+            return self._create_book()
+
+        if not key.strip() or len(key) > 255:
+            raise BookError('INVALID_PROPERTY', 'Idempotency-Key must have 1 to 255 characters')
+        replay = self._idempotency_store.begin(key, IdempotencyStore.fingerprint(request.get_data()))
+        if replay is not None:
+            logger.info('Replaying the response of Idempotency-Key: %s', key)
+            return replay, 200, {'Idempotent-Replayed': 'true'}
+
+        try:
+            response = self._create_book()
+        except Exception:
+            self._idempotency_store.abort(key)
+            raise
+        self._idempotency_store.complete(key, response)
+        return response
+
+    def _create_book(self):
         book_info = request.get_json()
         if not book_info:
             raise ValueError('No json found in the request')
+        # A bad request fails before a db connection is borrowed
+        book_info = book_schema.validate(book_info)
 
         book = self._book_repo.get_empty_book()
         book.set_values(**book_info)
-        book.save()
-        logger.info('Created a new book with id: %d', book.id)
+        if book.save():
+            logger.info('Created a new book with id: %d', book.id)
+        else:
+            logger.info('Found the same book with id: %d', book.id)
         return {
             'status_code': 201,
             'status': 'success',
@@ -50,31 +243,99 @@ class BookRoutes:
         }
 
     def get_book(self, id):
-        book = self._book_repo.get_book(id)
+        book = self._book_repo.get_book(id, request.args.get('fields'))
         logger.info('Found a book with id: %s', id)
-        return {
+        return self._cacheable({
             'status_code': 200,
             'status': 'success',
             'data': book.values()
-        }
+        })
 
-    def get_books(self):
-        filters = request.get_json()
-        if not filters:
-            filters = {}
-        logger.debug('Get all books matching with filters: %s', filters)
-        books = self._book_repo.get_books(**filters)
-        logger.info('Found %d books for given filters: %s', len(books), filters)
-        return {
+    def get_book_by_isbn(self, isbn):
+        book = self._book_repo.get_book_by_isbn(isbn, request.args.get('fields'))
+        if book is None:
+            raise BookError('BOOK_NOT_FOUND', 'No book is found with isbn: {}'.format(isbn))
+        logger.info('Found a book with isbn: %s', isbn)
+        return self._cacheable({
             'status_code': 200,
             'status': 'success',
-            'data': [book.values() for book in books]
-        }
+            'data': book.values()
+        })
+
+    def get_books(self):
+        """
+        Lists books matching with filters given as query parameters, e.g.
+        /books?publisher=Bantam Books&release_date=1996. Filters given in json body are still
+        supported, but such responses are not cacheable as the url does not identify them.
+        Books are sorted with sort=-release_date,name (descending when prefixed with '-') and
+        only the first of them are fetched with limit=10. All matching books are counted by
+        country, publisher and / or release_year with facets=country,release_year.
+        Books are fetched by ids instead, in the given order, with /books?ids=3,1,2.
+        """
+        filters, options = parse_list_params(request.args)
+        canonical = canonical_query(filters, options)
+        body_filters = request.get_json()
+        if body_filters:
+            filters.update(parse_body_filters(body_filters))
+        elif self._http_cache.get('redirect_to_canonical', False) and \
+                request.query_string.decode('utf-8') != canonical:
+            return redirect('{}?{}'.format(request.path, canonical) if canonical else request.path, 301)
+
+        if 'ids' in options:
+            if body_filters:
+                raise BookError('FILTER_ERROR', 'ids can not be combined with filters: {}'.format(body_filters))
+            books, missing_ids = self._book_repo.get_books_by_ids_encoded(options['ids'], options.get('fields'))
+            logger.info('Found %d books for given ids, missing ids: %s', len(books), missing_ids)
+            payload = {
+                'status_code': 200,
+                'status': 'success',
+                'data': jsoncodec.Fragments(books),
+                'missing_ids': missing_ids
+            }
+        elif 'facets' in options:
+            logger.debug('Get all books matching with filters: %s, and their facets: %s', filters, options['facets'])
+            books, facets = self._book_repo.get_books_with_facets_encoded(
+                options['facets'], options.get('fields'), options.get('sort'), options.get('limit'), **filters)
+            logger.info('Found %d books for given filters: %s', len(books), filters)
+            payload = {
+                'status_code': 200,
+                'status': 'success',
+                'data': jsoncodec.Fragments(books),
+                'facets': facets
+            }
+        else:
+            logger.debug('Get all books matching with filters: %s', filters)
+            books = self._book_repo.get_books_encoded(options.get('fields'), options.get('sort'), options.get('limit'),
+                                                      **filters)
+            logger.info('Found %d books for given filters: %s', len(books), filters)
+            payload = {
+                'status_code': 200,
+                'status': 'success',
+                'data': jsoncodec.Fragments(books)
+            }
+        if body_filters:
+            return payload, 200, {'Cache-Control': 'no-store'}
+
+        response = self._cacheable(payload)
+        response.headers['Content-Location'] = '{}?{}'.format(request.path, canonical) if canonical else request.path
+        return response
+
+    def _cacheable(self, payload):
+        """
+        Makes a response which http caches can store and revalidate with a (weak) etag
+        """
+        response = current_app.make_response(payload)
+        response.headers['Cache-Control'] = self._http_cache.get('cache_control', 'no-cache')
+        for header in self._http_cache.get('vary', []):
+            response.vary.add(header)
+        response.add_etag(weak=True)
+        return response.make_conditional(request)
 
     def update_book(self, id):
         book_info = request.get_json()
         if not book_info:
             raise ValueError('No json found in the request')
+        book_info = book_schema.validate(book_info, partial=True)
         book = self._book_repo.get_book(id)
         book.set_values(**book_info)
         book.save()
@@ -96,3 +357,198 @@ class BookRoutes:
             'message': 'The book {} was updated successfully'.format(book.name),
             'data': []
         }
+
+    def update_books(self):
+        """
+        Updates values given in json body of all books matching with filters given as query
+        parameters, e.g. PATCH /books?publisher=Bantam Books. With dry_run=true, only tells
+        which books would be updated.
+        """
+        values = request.get_json()
+        if not values:
+            raise ValueError('No json found in the request')
+        filters, options = parse_bulk_params(request.args, self._max_affected)
+        ids = self._book_repo.update_books(values, options['dry_run'], options['max_affected'], **filters)
+        logger.info('%s %d books matching with filters: %s', 'Would update' if options['dry_run'] else 'Updated',
+                    len(ids), filters)
+        return self._bulk_response(ids, options['dry_run'])
+
+    def delete_books(self):
+        """
+        Deletes all books matching with filters given as query parameters, e.g.
+        DELETE /books?publisher=Bantam Books. With dry_run=true, only tells which books would
+        be deleted.
+        """
+        filters, options = parse_bulk_params(request.args, self._max_affected)
+        ids = self._book_repo.delete_books(options['dry_run'], options['max_affected'], **filters)
+        logger.info('%s %d books matching with filters: %s', 'Would delete' if options['dry_run'] else 'Deleted',
+                    len(ids), filters)
+        return self._bulk_response(ids, options['dry_run'])
+
+    def _bulk_response(self, ids, dry_run):
+        return {
+            'status_code': 200,
+            'status': 'success',
+            'dry_run': dry_run,
+            'count': len(ids),
+            'data': ids
+        }
+
+
+class BookStatsRoutes:
+    """
+    Serves aggregated counts of books, so that clients need not fetch all books to count them.
+    """
+
+    def __init__(self, book_stats_repo):
+        self._book_stats_repo = book_stats_repo
+
+    def get_stats(self):
+        return {
+            'status_code': 200,
+            'status': 'success',
+            'data': self._book_stats_repo.get_stats()
+        }
+
+    def get_stats_by(self, dimension):
+        return {
+            'status_code': 200,
+            'status': 'success',
+            'data': self._book_stats_repo.get_stats_by(dimension)
+        }
+
+
+class BookChangesRoutes:
+    """
+    Pushes changes of books to clients, either as a stream of server sent events
+    (Accept: text/event-stream) or by long polling. A client resumes after the last
+    sequence it saw, given as Last-Event-ID header or 'since' query parameter.
+    """
+
+    def __init__(self, change_feed, config=None):
+        self._change_feed = change_feed
+        self._config = config or {}
+
+    def get_changes(self):
+        since = request.args.get('since', request.headers.get('Last-Event-ID'))
+        if since is not None:
+            given, since = since, parse_number(since)
+            if since is None:
+                raise BookError('FILTER_ERROR', 'since must be a sequence number, but got: {}'.format(given))
+
+        if request.accept_mimetypes.best == 'text/event-stream':
+            return self._stream(since)
+        return self._poll(since)
+
+    def _stream(self, since):
+        heartbeat = self._config.get('heartbeat', 15)
+        events = self._change_feed.subscribe(since, heartbeat)
+        # The body is generated after teardown, the stream keeps its admission slot until it ends
+        release_slot = admission.take_slot()
+
+        def generate():
+            try:
+                # Tells the client how long to wait before reconnecting
+                yield 'retry: {}\n\n'.format(self._config.get('retry_ms', 3000))
+                for event in events:
+                    if event is None:
+                        yield ': keep-alive\n\n'
+                        continue
+                    yield 'id: {}\nevent: book_change\ndata: {}\n\n'.format(
+                        event['seq'], jsoncodec.dumps(event).decode('utf-8'))
+            finally:
+                release_slot()
+
+        response = Response(generate(), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        # A stream which is closed before it is started never runs the finally block above
+        response.call_on_close(release_slot)
+        return response
+
+    def _poll(self, since):
+        """
+        Returns changes after 'since', waiting up to 'wait' seconds when there are none yet.
+        Without 'since', returns the latest sequence to resume from.
+        """
+        if since is None:
+            return {
+                'status_code': 200,
+                'status': 'success',
+                'last_seq': self._change_feed.last_seq(),
+                'data': []
+            }
+
+        given = request.args.get('wait', '0')
+        wait = parse_number(given)
+        if wait is None:
+            raise BookError('FILTER_ERROR', 'wait must be a number of seconds, but got: {}'.format(given))
+        wait = min(wait, self._config.get('max_wait', 30))
+
+        events = self._change_feed.changes_since(since)
+        if not events and wait:
+            self._change_feed.start()
+            position = self._change_feed.position()
+            events = self._change_feed.changes_since(since)
+            if not events:
+                self._change_feed.wait_for_events(position, wait)
+                events = self._change_feed.changes_since(since)
+        return {
+            'status_code': 200,
+            'status': 'success',
+            'last_seq': events[-1]['seq'] if events else since,
+            'data': events
+        }
+
+
+class SlowQueryRoutes:
+    """
+    Admin end point listing the slowest query shapes with their plans
+    """
+
+    def __init__(self, slow_query_log, admin_token):
+        self._slow_query_log = slow_query_log
+        self._admin_token = admin_token
+
+    def authorize(self):
+        admin.authorize(self._admin_token)
+
+    def get_slow_queries(self):
+        self.authorize()
+        limit = parse_number(request.args.get('limit', '20'))
+        if limit is None or limit < 1:
+            raise BookError('FILTER_ERROR', 'limit must be a positive integer')
+        return {
+            'status_code': 200,
+            'status': 'success',
+            'data': self._slow_query_log.slowest(limit)
+        }
+
+
+class CatalogSyncRoutes:
+    """
+    Admin end points reporting the last sync of books with the external catalog, and starting one
+    """
+
+    def __init__(self, catalog_sync, admin_token):
+        self._catalog_sync = catalog_sync
+        self._admin_token = admin_token
+
+    def authorize(self):
+        admin.authorize(self._admin_token)
+
+    def get_catalog_sync(self):
+        self.authorize()
+        return {
+            'status_code': 200,
+            'status': 'success',
+            'data': self._catalog_sync.report()
+        }
+
+    def run_catalog_sync(self):
+        self.authorize()
+        self._catalog_sync.start()
+        return {
+            'status_code': 202,
+            'status': 'success',
+            'data': self._catalog_sync.report()
+        }, 202
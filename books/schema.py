@@ -0,0 +1,170 @@
+import json
+import re
+from datetime import date
+from .errors import BookError
+
+_date_pattern = re.compile(r'\d{4}-\d{2}-\d{2}\Z')
+
+
+class Field:
+    """
+    Rules of a field of a payload. A value of None is accepted only when the field is nullable.
+    """
+
+    def __init__(self, type, required=False, nullable=False, blank=True, max_length=None, minimum=None,
+                 items=None, format=None, max_json_length=None):
+        self.type = type
+        self.required = required
+        self.nullable = nullable
+        self.blank = blank
+        self.max_length = max_length
+        self.minimum = minimum
+        # Type of list items
+        self.items = items
+        # 'date' for a yyyy-mm-dd string
+        self.format = format
+        # Maximum length of the value stored as json, e.g. a list in a varchar column
+        self.max_json_length = max_json_length
+
+
+def compile_field(name, field):
+    """
+    Returns a function which returns the error message of an invalid value of the field, or None.
+    Messages are formatted here, so that checking a value costs only the rules of its field.
+    """
+    rules = []
+    if field.type is int:
+        # A bool is an int in python, but not in json
+        rules.append((lambda value: type(value) is int, '{} is not an integer'.format(name)))
+    elif field.type is list:
+        items = field.items or object
+        rules.append((lambda value: type(value) is list and all(isinstance(item, items) for item in value),
+                      '{} is not a list of {}'.format(name, items.__name__)))
+    else:
+        rules.append((lambda value: isinstance(value, field.type), '{} is not a {}'.format(name, field.type.__name__)))
+    if not field.blank:
+        rules.append((lambda value: len(value.strip()) > 0, '{} is blank'.format(name)))
+    if field.max_length is not None:
+        max_length = field.max_length
+        rules.append((lambda value: len(value) <= max_length,
+                      '{} is longer than {} characters'.format(name, max_length)))
+    if field.minimum is not None:
+        minimum = field.minimum
+        rules.append((lambda value: value >= minimum, '{} is less than {}'.format(name, minimum)))
+    if field.format == 'date':
+        rules.append((_is_date, '{} is not a date'.format(name)))
+    if field.max_json_length is not None:
+        max_json_length = field.max_json_length
+        rules.append((lambda value: len(json.dumps(value)) <= max_json_length,
+                      '{} are longer than {} characters as json'.format(name, max_json_length)))
+
+    missing = None if field.nullable else '{} is {}'.format(name, 'required' if field.blank else 'blank')
+
+    def check(value):
+        if value is None:
+            return missing
+        for rule, message in rules:
+            if not rule(value):
+                return message
+        return None
+
+    return check
+
+
+def _is_date(value):
+    if not _date_pattern.match(value):
+        return False
+    try:
+        date.fromisoformat(value)
+        return True
+    except ValueError:
+        return False
+
+
+class Schema:
+    """
+    Validates payloads by fields compiled once. Errors of all fields of a payload (or of all payloads
+    of an array) are collected in a single pass. Unknown fields are errors, except the ignored ones.
+    """
+
+    def __init__(self, fields, ignored=()):
+        self._fields = fields
+        self._ignored = frozenset(ignored)
+        self._checks = {name: compile_field(name, field) for name, field in fields.items()}
+        self._required = tuple(name for name, field in fields.items() if field.required)
+
+    @property
+    def fields(self):
+        return tuple(self._fields)
+
+    def check(self, name, value):
+        """
+        Raises INVALID_PROPERTY error when given value of a field is invalid
+        """
+        message = self._checks[name](value)
+        if message is not None:
+            raise BookError('INVALID_PROPERTY', message, details={name: message})
+
+    def errors(self, payload, partial=False):
+        """
+        Returns error messages by field of a payload. Required fields may be missing from a partial
+        payload, e.g. of an update.
+        """
+        if not isinstance(payload, dict):
+            return {'': 'book is not a json object'}
+
+        errors = {}
+        checks = self._checks
+        for name, value in payload.items():
+            check = checks.get(name)
+            if check is None:
+                if name not in self._ignored:
+                    errors[name] = '{} is not a field of a book'.format(name)
+                continue
+            message = check(value)
+            if message is not None:
+                errors[name] = message
+        if not partial:
+            for name in self._required:
+                if name not in payload:
+                    errors[name] = '{} is required'.format(name)
+        return errors
+
+    def validate(self, payload, partial=False):
+        """
+        Returns values of known fields of a payload, or raises INVALID_PROPERTY error having
+        messages of all invalid fields
+        """
+        errors = self.errors(payload, partial)
+        if errors:
+            raise BookError('INVALID_PROPERTY', 'Invalid book: {}'.format(', '.join(errors.values())), details=errors)
+        return {name: value for name, value in payload.items() if name not in self._ignored}
+
+    def validate_many(self, payloads, partial=False):
+        """
+        Validates an array of payloads. Errors are keyed by '[index].field'.
+        """
+        if not isinstance(payloads, list):
+            raise BookError('INVALID_PROPERTY', 'books are not a json array')
+
+        errors = {}
+        for index, payload in enumerate(payloads):
+            for name, message in self.errors(payload, partial).items():
+                errors['[{}].{}'.format(index, name)] = message
+        if errors:
+            messages = ['{} {}'.format(key.split('.')[0], message) for key, message in errors.items()]
+            raise BookError('INVALID_PROPERTY', 'Invalid books: {}'.format(', '.join(messages)), details=errors)
+        return [{name: value for name, value in payload.items() if name not in self._ignored} for payload in payloads]
+
+
+# Lengths are the ones of 'books' table columns. Id is given back by clients with the other values
+# they read, it is never written.
+book_schema = Schema({
+    'name': Field(str, required=True, blank=False, max_length=100),
+    'isbn': Field(str, required=True, blank=False, max_length=50),
+    'authors': Field(list, items=str, max_json_length=100),
+    'country': Field(str, max_length=50),
+    'number_of_pages': Field(int, nullable=True, minimum=0),
+    'publisher': Field(str, nullable=True, max_length=100),
+    'release_date': Field(str, nullable=True, format='date')
+}, ignored=('id',))
@@ -0,0 +1,216 @@
+import heapq
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import psycopg2
+import lifecycle
+logger = logging.getLogger(__name__)
+
+
+def query_shape(statement):
+    """
+    Returns the shape of a statement: values are given as parameters already, hence statements
+    differ only by whitespace and the filters / fields they have
+    """
+    return ' '.join(statement.split())
+
+
+# Keywords of statements which write, or lock rows, when they are executed by EXPLAIN ANALYZE
+_WRITE_KEYWORDS = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE|TRUNCATE|INTO|SHARE|CREATE|ALTER|DROP|COPY|CALL|DO)\b',
+                             re.IGNORECASE)
+
+
+def is_read_only(statement):
+    """
+    Returns True when a statement only reads, e.g. a SELECT or a WITH ... SELECT having no data
+    modifying part, hence it can be executed to explain it
+    """
+    words = statement.split(None, 1)
+    return bool(words) and words[0].upper() in ('SELECT', 'WITH') and not _WRITE_KEYWORDS.search(statement)
+
+
+def param_types(params):
+    return [type(param).__name__ for param in params or ()]
+
+
+class SlowQueryLog:
+    """
+    Logs statements slower than threshold_ms, and keeps their durations by query shape. Plans of
+    the explain_top slowest shapes (by total duration) are captured by the explainer, for a sample
+    of their slow executions, at most once per explain_interval seconds per shape.
+    """
+
+    def __init__(self, threshold_ms=100, max_shapes=100, explainer=None, explain_top=10, explain_sample_rate=0.1,
+                 explain_interval=300, clock=time.monotonic, sample=random.random):
+        self._threshold = threshold_ms / 1000
+        self._max_shapes = max_shapes
+        self._explainer = explainer
+        self._explain_top = explain_top
+        self._explain_sample_rate = explain_sample_rate
+        self._explain_interval = explain_interval
+        self._clock = clock
+        self._sample = sample
+        self._shapes = {}
+        self._lock = threading.Lock()
+
+    def record(self, statement, params, duration):
+        """
+        Records an execution of a statement which took duration seconds
+        """
+        if duration < self._threshold:
+            return
+
+        shape = query_shape(statement)
+        types = param_types(params)
+        duration_ms = duration * 1000
+        logger.warning('Slow query took %.1f ms: %s, parameter types: %s', duration_ms, shape, types)
+
+        with self._lock:
+            stats = self._shapes.get(shape)
+            if stats is None:
+                if len(self._shapes) >= self._max_shapes:
+                    # The shape costing least so far makes room for the new one
+                    del self._shapes[min(self._shapes, key=lambda key: self._shapes[key]['total_ms'])]
+                stats = self._shapes[shape] = {
+                    'shape': shape, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'param_types': types,
+                    'plan': None, 'plan_error': None, 'explained_at': None
+                }
+            stats['count'] += 1
+            stats['total_ms'] += duration_ms
+            stats['max_ms'] = max(stats['max_ms'], duration_ms)
+            stats['param_types'] = types
+            explain = self._should_explain(stats)
+            if explain:
+                stats['explained_at'] = self._clock()
+
+        if explain and not self._explainer.submit(statement, params, lambda plan, error: self._set_plan(
+                shape, plan, error)):
+            with self._lock:
+                stats['explained_at'] = None
+
+    def _should_explain(self, stats):
+        if self._explainer is None:
+            return False
+        if stats['explained_at'] is not None and self._clock() - stats['explained_at'] < self._explain_interval:
+            return False
+        if self._sample() >= self._explain_sample_rate:
+            return False
+        top = heapq.nlargest(self._explain_top, self._shapes.values(), key=lambda other: other['total_ms'])
+        return any(other is stats for other in top)
+
+    def _set_plan(self, shape, plan, error):
+        with self._lock:
+            stats = self._shapes.get(shape)
+            if stats is not None:
+                stats['plan'], stats['plan_error'] = plan, error
+
+    def slowest(self, limit=20):
+        """
+        Returns the slowest query shapes by their total duration, with their last captured plans
+        """
+        with self._lock:
+            shapes = heapq.nlargest(limit, self._shapes.values(), key=lambda stats: stats['total_ms'])
+            return [{
+                'shape': stats['shape'],
+                'count': stats['count'],
+                'total_ms': round(stats['total_ms'], 3),
+                'mean_ms': round(stats['total_ms'] / stats['count'], 3),
+                'max_ms': round(stats['max_ms'], 3),
+                'param_types': stats['param_types'],
+                'plan': stats['plan'],
+                'plan_error': stats['plan_error']
+            } for stats in shapes]
+
+
+class QueryExplainer:
+    """
+    Captures plans of statements with EXPLAIN on a dedicated connection in a background thread,
+    so that neither requests nor the pool wait for it. EXPLAIN ANALYZE runs a statement again,
+    hence only queries are analyzed (other statements are only explained), every explain is
+    rolled back and it is cancelled after timeout_ms.
+    """
+
+    # Connections inherited from a parent process
+    _inherited = []
+
+    def __init__(self, connection_config, timeout_ms=5000, max_pending=10):
+        # A dedicated connection, hence pool settings do not apply to it
+        self._connection_config = {key: value for key, value in connection_config.items()
+                                   if key not in ('minconn', 'maxconn')}
+        self._timeout_ms = timeout_ms
+        self._pending = queue.Queue(max_pending)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._conn = None
+        lifecycle.register(self)
+
+    def submit(self, statement, params, callback):
+        """
+        Queues a statement to be explained, callback(plan, error) is called with its plan.
+        Returns False when too many statements are queued already.
+        """
+        self._start()
+        try:
+            self._pending.put_nowait((statement, params, callback))
+            return True
+        except queue.Full:
+            return False
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='query-explainer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            job = self._pending.get()
+            if job is None:
+                return
+            statement, params, callback = job
+            try:
+                plan = self.explain(statement, params)
+                callback(plan, None)
+            except psycopg2.Error as err:
+                logger.error('Unable to explain query: %s due to error: %s', query_shape(statement), err)
+                callback(None, str(err).strip())
+
+    def explain(self, statement, params):
+        if self._conn is None or self._conn.closed:
+            self._conn = psycopg2.connect(**self._connection_config)
+        options = 'ANALYZE, BUFFERS, FORMAT JSON' if is_read_only(statement) else 'FORMAT JSON'
+        cur = self._conn.cursor()
+        try:
+            cur.execute('SET LOCAL statement_timeout = %s', (self._timeout_ms,))
+            cur.execute('EXPLAIN ({}) {}'.format(options, statement), params)
+            return cur.fetchone()[0]
+        finally:
+            if not self._conn.closed:
+                self._conn.rollback()
+            cur.close()
+
+    def reset_after_fork(self):
+        if self._pid is not None and self._pid != os.getpid():
+            # The explaining thread is not running in the child, it is started on first submit
+            self._lock = threading.Lock()
+            self._thread = None
+            self._pending = queue.Queue(self._pending.maxsize)
+            if self._conn is not None:
+                QueryExplainer._inherited.append(self._conn)
+                self._conn = None
+
+    def close(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            try:
+                self._pending.put_nowait(None)
+            except queue.Full:
+                pass
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
@@ -0,0 +1,112 @@
+import logging
+import threading
+import time
+import psycopg2
+from tracing import span
+from .book import ConnectionPoolContext, BookError
+logger = logging.getLogger(__name__)
+
+
+class BookStatsRepo:
+    """
+    Serves grouped counts of books from 'book_stats' materialized view, which holds
+    number of books and pages per (country, publisher, release_year).
+    The view is refreshed concurrently in background after books are written.
+    """
+
+    dimensions = ('country', 'publisher', 'release_year')
+
+    def __init__(self, cpool, refresh_delay=1.0):
+        self._cpool = cpool
+        self._refresher = StatsRefresher(self.refresh, refresh_delay)
+
+    def on_book_write(self, operation, id):
+        """
+        Write listener of BookRepo
+        """
+        self._refresher.schedule()
+
+    def get_stats(self):
+        """
+        Returns total books and pages, and the same grouped by every dimension
+        """
+        stats = {'total': self._fetch(self._get_total_query())[0]}
+        for dimension in self.dimensions:
+            stats['by_' + dimension] = self.get_stats_by(dimension)
+        return stats
+
+    def get_stats_by(self, dimension):
+        if dimension not in self.dimensions:
+            raise BookError('DIMENSION_ERROR', 'Given dimension: {} is not supported. Supported dimensions are: {}'
+                            .format(dimension, ', '.join(self.dimensions)))
+        return self._fetch(self._get_stats_query(dimension), dimension)
+
+    def _get_total_query(self):
+        return 'SELECT coalesce(sum(books), 0), coalesce(sum(pages), 0) FROM book_stats'
+
+    def _get_stats_query(self, dimension):
+        # Dimension is one of whitelisted column names, hence it is safe to format it into the query
+        return ('SELECT {0}, sum(books), sum(pages) FROM book_stats GROUP BY {0} ORDER BY sum(books) DESC, {0}'
+                .format(dimension))
+
+    def _fetch(self, query, dimension=None):
+        try:
+            with ConnectionPoolContext(self._cpool) as conn:
+                cur = conn.cursor()
+                logger.debug('Executing query: %s', query)
+                with span('sql', 'Query execution'):
+                    cur.execute(query)
+                    rows = cur.fetchall()
+                conn.commit()
+                cur.close()
+        except psycopg2.Error as err:
+            raise BookError('GET_STATS_ERROR', 'Unable to fetch book stats due to error: {}'.format(err.pgerror), err)
+
+        if dimension is None:
+            return [{'books': int(row[0]), 'pages': int(row[1])} for row in rows]
+        return [{dimension: row[0], 'books': int(row[1]), 'pages': int(row[2])} for row in rows]
+
+    def refresh(self):
+        """
+        Refreshes the view without blocking readers of it
+        """
+        try:
+            with ConnectionPoolContext(self._cpool) as conn:
+                cur = conn.cursor()
+                cur.execute('REFRESH MATERIALIZED VIEW CONCURRENTLY book_stats')
+                conn.commit()
+                cur.close()
+        except psycopg2.Error as err:
+            raise BookError('REFRESH_STATS_ERROR', 'Unable to refresh book stats due to error: {}'.format(
+                err.pgerror), err)
+
+
+class StatsRefresher:
+    """
+    Runs a refresh function in a background thread after it is scheduled.
+    Schedules arriving within 'delay' seconds (e.g. a burst of writes) are coalesced into
+    a single refresh, and a schedule arriving during a refresh causes one more refresh.
+    """
+
+    def __init__(self, refresh, delay):
+        self._refresh = refresh
+        self._delay = delay
+        self._pending = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def schedule(self):
+        self._pending.set()
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='book-stats-refresher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while self._pending.wait():
+            time.sleep(self._delay)
+            self._pending.clear()
+            try:
+                self._refresh()
+            except BookError as err:
+                logger.error('%s', err.message())
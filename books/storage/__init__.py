@@ -0,0 +1,5 @@
+from .base import BookStorage
+from .postgres import PostgresStorage
+from .sqlite import SqliteStorage
+from .memory import MemoryStorage
+from .read_model import ReadModelStorage, BookColumns
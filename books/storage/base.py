@@ -0,0 +1,135 @@
+import heapq
+from collections import Counter
+from abc import ABC, abstractmethod
+from ..book import BookRepo, BookError
+
+# Columns of a book which are written, every column but id
+value_fields = BookRepo.book_fields[1:]
+
+
+class BookStorage(ABC):
+    """
+    Stores rows of books for BookRepo. A row is a tuple of book fields (BookRepo.book_fields, or
+    the requested fields in the same order) where authors is a json string and release_date is
+    a date. Filters are name, country, publisher (equal to) and release_date (a year).
+    An order is a tuple of (field, descending), where NULL is larger than any value like in Postgres.
+    """
+
+    @abstractmethod
+    def select(self, filters, fields=None, order=None, limit=None):
+        """
+        Returns rows of books matching with filters, in given order, and not more than limit rows
+        """
+
+    @abstractmethod
+    def select_by(self, column, value, fields=None):
+        """
+        Returns the row of the book whose unique column ('id' or 'isbn') has given value, or None
+        """
+
+    @abstractmethod
+    def select_by_ids(self, ids, fields=None):
+        """
+        Returns rows of books having given ids, in any order
+        """
+
+    @abstractmethod
+    def insert(self, values):
+        """
+        Inserts a book of given values (a dict of value_fields). Nothing is inserted when a book
+        with the same isbn and values exists already. Returns (id, True when inserted).
+        """
+
+    @abstractmethod
+    def update(self, id, values):
+        """
+        Updates the book having given id with given values (a dict of value_fields)
+        """
+
+    @abstractmethod
+    def delete(self, id):
+        """
+        Deletes the book having given id
+        """
+
+    def update_many(self, changes):
+        """
+        Updates given values (a dict of some of value_fields) of each book by id ({id: values}) in a
+        batch. Returns sorted ids of the updated books, a book which is not found is skipped.
+        """
+        ids = []
+        for row in self.select_by_ids(list(changes)):
+            values = dict(zip(value_fields, row[1:]))
+            values.update(changes[row[0]])
+            self.update(row[0], values)
+            ids.append(row[0])
+        return sorted(ids)
+
+    @abstractmethod
+    def write_where(self, operation, filters, values=None, dry_run=False, max_affected=None):
+        """
+        Updates ('update' operation) given values of, or deletes ('delete' operation) all books
+        matching with filters at once. Returns sorted ids of the books which are written, or which
+        would be written on a dry run. Nothing is written when more than max_affected books match.
+        """
+
+    def select_with_facets(self, filters, facets, fields=None, order=None, limit=None):
+        """
+        Returns rows like select(), and the number of books matching with filters by each value of
+        given facets (BookRepo.facet_dimensions) as {facet: [(value, books)]}, in any order
+        """
+        rows = self.select(filters, fields, order, limit)
+        sources = tuple(field for field in BookRepo.book_fields if field in {facet_fields[facet] for facet in facets})
+        return rows, count_facets(self.select(filters, sources), sources, facets)
+
+    def close(self):
+        pass
+
+
+# Field of a book which each facet counts books by
+facet_fields = {'country': 'country', 'publisher': 'publisher', 'release_year': 'release_date'}
+
+
+def count_facets(rows, fields, facets):
+    """
+    Counts rows of given fields by each of given facets
+    """
+    counters = {facet: Counter() for facet in facets}
+    for row in rows:
+        values = dict(zip(fields, row))
+        for facet, counter in counters.items():
+            value = values[facet_fields[facet]]
+            counter[value.year if facet == 'release_year' and value is not None else value] += 1
+    return {facet: list(counter.items()) for facet, counter in counters.items()}
+
+
+def check_affected(operation, ids, filters, max_affected):
+    if max_affected is not None and len(ids) > max_affected:
+        raise BookError(
+            'TOO_MANY_BOOKS',
+            '{} books match with filters: {}, but not more than {} books can be {}d at once'.format(
+                len(ids), filters, max_affected, operation))
+
+
+def duplicate_isbn(isbn, error=None):
+    return BookError('DUPLICATE_ISBN', 'A book with isbn: {} exists already'.format(isbn), error)
+
+
+def sort_items(items, order, value, limit=None):
+    """
+    Sorts items (e.g. rows) in given order, where value(item, field) returns a field of an item.
+    The first 'limit' items are picked through a heap when all fields are sorted in the same direction.
+    """
+    if limit is not None and len({descending for field, descending in order}) == 1:
+        pick = heapq.nlargest if order[0][1] else heapq.nsmallest
+        return pick(limit, items, key=lambda item: tuple(_null_last(value(item, field)) for field, _ in order))
+
+    items = list(items)
+    # Sorting is stable, hence sorting by the last field first leaves items ordered by all fields
+    for field, descending in reversed(order):
+        items.sort(key=lambda item: _null_last(value(item, field)), reverse=descending)
+    return items[:limit] if limit is not None else items
+
+
+def _null_last(value):
+    return (1, 0) if value is None else (0, value)
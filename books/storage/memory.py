@@ -0,0 +1,129 @@
+import threading
+from datetime import date
+from ..book import BookRepo, BookError
+from .base import BookStorage, value_fields, check_affected, duplicate_isbn, sort_items
+
+# Columns which must have a value, like NOT NULL columns of 'books' table
+required_fields = ('name', 'isbn', 'authors', 'country')
+
+
+class MemoryStorage(BookStorage):
+    """
+    Keeps books in memory of the process, e.g. for tests, benchmarks and edge replicas which are
+    loaded on start. Books are neither shared between processes nor kept after exit.
+    """
+
+    def __init__(self):
+        self._rows = {}
+        self._ids_by_isbn = {}
+        self._next_id = 1
+        self._lock = threading.RLock()
+
+    def select(self, filters, fields=None, order=None, limit=None):
+        with self._lock:
+            rows = [row for row in self._rows.values() if self._matches(row, filters)]
+        if order:
+            rows = sort_items(rows, order, lambda row, field: row[BookRepo.book_fields.index(field)], limit)
+        elif limit is not None:
+            rows = rows[:limit]
+        return [self._project(row, fields) for row in rows]
+
+    def select_by(self, column, value, fields=None):
+        with self._lock:
+            id = value if column == 'id' else self._ids_by_isbn.get(value)
+            row = self._rows.get(id)
+            return self._project(row, fields) if row is not None else None
+
+    def select_by_ids(self, ids, fields=None):
+        with self._lock:
+            return [self._project(self._rows[id], fields) for id in ids if id in self._rows]
+
+    def _project(self, row, fields):
+        if fields is None:
+            return row
+        return tuple(row[BookRepo.book_fields.index(field)] for field in fields)
+
+    def _matches(self, row, filters):
+        for key, value in filters.items():
+            if key == 'release_date':
+                if row[7] is None or row[7].year != value:
+                    return False
+            elif row[BookRepo.book_fields.index(key)] != value:
+                return False
+        return True
+
+    def _row(self, id, values):
+        missing = [field for field in required_fields if values[field] is None]
+        if missing:
+            raise BookError('SAVE_BOOK_ERROR', 'Unable to save a book without: {}'.format(missing))
+        release_date = values['release_date']
+        if isinstance(release_date, str):
+            release_date = date.fromisoformat(release_date)
+        return (id,) + tuple(values[field] for field in value_fields[:-1]) + (release_date,)
+
+    def insert(self, values):
+        with self._lock:
+            id = self._ids_by_isbn.get(values['isbn'])
+            if id is not None:
+                # It is the same book when every other value is the same too
+                if self._rows[id] != self._row(id, values):
+                    raise duplicate_isbn(values['isbn'])
+                return id, False
+
+            id = self._next_id
+            self._rows[id] = self._row(id, values)
+            self._ids_by_isbn[values['isbn']] = id
+            self._next_id += 1
+            return id, True
+
+    def update(self, id, values):
+        with self._lock:
+            if id in self._rows:
+                self._replace(self._updated(self._rows[id], values))
+
+    def _updated(self, row, values):
+        """
+        Returns a row having given values, and the others from given row
+        """
+        all_values = dict(zip(value_fields, row[1:]))
+        all_values.update(values)
+        new_row = self._row(row[0], all_values)
+        owner = self._ids_by_isbn.get(new_row[2])
+        if owner is not None and owner != row[0]:
+            raise duplicate_isbn(new_row[2])
+        return new_row
+
+    def _replace(self, new_row):
+        """
+        Replaces a row with a new row having the same id, keeping the isbn index up to date
+        """
+        old_isbn = self._rows[new_row[0]][2]
+        if new_row[2] != old_isbn:
+            del self._ids_by_isbn[old_isbn]
+            self._ids_by_isbn[new_row[2]] = new_row[0]
+        self._rows[new_row[0]] = new_row
+
+    def delete(self, id):
+        with self._lock:
+            row = self._rows.pop(id, None)
+            if row is not None:
+                del self._ids_by_isbn[row[2]]
+
+    def write_where(self, operation, filters, values=None, dry_run=False, max_affected=None):
+        with self._lock:
+            ids = sorted(id for id, row in self._rows.items() if self._matches(row, filters))
+            if dry_run:
+                return ids
+            check_affected(operation, ids, filters, max_affected)
+
+            if operation == 'update':
+                if 'isbn' in values and len(ids) > 1:
+                    raise BookError('DUPLICATE_ISBN',
+                                    'Books matching with filters: {} can not have the same isbn'.format(filters))
+                # Every row is validated before any of them is written
+                for new_row in [self._updated(self._rows[id], values) for id in ids]:
+                    self._replace(new_row)
+            else:
+                for id in ids:
+                    self.delete(id)
+            return ids
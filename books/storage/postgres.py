@@ -0,0 +1,344 @@
+import logging
+import time
+import psycopg2
+from psycopg2 import errorcodes
+from tracing import span
+from ..book import BookRepo, BookError, ConnectionPoolContext
+from .base import BookStorage, value_fields, check_affected, duplicate_isbn
+logger = logging.getLogger(__name__)
+
+
+class PostgresStorage(BookStorage):
+    """
+    Stores books in 'books' table of Postgres. Writes of single books are committed in batches
+    when a GroupCommitWriter is given. Every statement is timed into the SlowQueryLog when given.
+    """
+
+    def __init__(self, cpool, writer=None, slow_query_log=None):
+        self._cpool = cpool
+        self._writer = writer
+        self._slow_query_log = slow_query_log
+
+    @property
+    def cpool(self):
+        return self._cpool
+
+    def select(self, filters, fields=None, order=None, limit=None):
+        try:
+            with ConnectionPoolContext(self._cpool) as conn:
+                query = self._get_all_books_query(filters, fields, order, limit)
+                logger.debug('Executing query: %s', query)
+                params = self._filter_params(filters) + ((limit,) if limit is not None else ())
+                cur = conn.cursor()
+                with span('sql', 'Query execution'):
+                    self._run(cur, query, params)
+                    rows = cur.fetchall()
+                cur.close()
+                return rows
+        except psycopg2.Error as err:
+            raise BookError(
+                'GET_BOOKS_ERROR',
+                'Unable to fetch books with filters: {} due to error: {}'.format(filters, err.pgerror),
+                err)
+
+    def select_with_facets(self, filters, facets, fields=None, order=None, limit=None):
+        try:
+            with ConnectionPoolContext(self._cpool) as conn:
+                query = self._get_faceted_books_query(filters, facets, fields, order, limit)
+                logger.debug('Executing query: %s', query)
+                params = self._filter_params(filters) + ((limit,) if limit is not None else ())
+                cur = conn.cursor()
+                with span('sql', 'Query execution'):
+                    self._run(cur, query, params)
+                    result = cur.fetchall()
+                cur.close()
+        except psycopg2.Error as err:
+            raise BookError(
+                'GET_BOOKS_ERROR',
+                'Unable to fetch books with filters: {} due to error: {}'.format(filters, err.pgerror),
+                err)
+
+        # A row of a book has no facet, a count of a facet value has no book
+        rows, counts = [], {facet: [] for facet in facets}
+        for facet, value, books, position, *row in result:
+            if facet is None:
+                rows.append(tuple(row))
+            else:
+                if facet == 'release_year' and value is not None:
+                    value = int(value)
+                counts[facet].append((value, books))
+        return rows, counts
+
+    def select_by(self, column, value, fields=None):
+        try:
+            with ConnectionPoolContext(self._cpool) as conn:
+                cur = conn.cursor()
+                query = 'SELECT {} FROM books WHERE {} = %s'.format(', '.join(fields or BookRepo.book_fields), column)
+                logger.debug('Executing query: %s', query)
+                with span('sql', 'Query execution'):
+                    self._run(cur, query, (value,))
+                    row = cur.fetchone()
+                cur.close()
+                return row
+        except psycopg2.Error as err:
+            raise BookError(
+                'GET_BOOK_ERROR',
+                'Unable to fetch a book due to error: {} {}'.format(err.pgerror, err.pgcode),
+                err)
+
+    def select_by_ids(self, ids, fields=None):
+        try:
+            with ConnectionPoolContext(self._cpool) as conn:
+                query = 'SELECT {} FROM books WHERE id = ANY(%s)'.format(', '.join(fields or BookRepo.book_fields))
+                logger.debug('Executing query: %s', query)
+                cur = conn.cursor()
+                with span('sql', 'Query execution'):
+                    self._run(cur, query, (list(ids),))
+                    rows = cur.fetchall()
+                cur.close()
+                return rows
+        except psycopg2.Error as err:
+            raise BookError(
+                'GET_BOOKS_ERROR',
+                'Unable to fetch books with ids: {} due to error: {}'.format(ids, err.pgerror),
+                err)
+
+    def _run(self, cur, statement, params):
+        if self._slow_query_log is None:
+            cur.execute(statement, params)
+            return
+        start = time.perf_counter()
+        try:
+            cur.execute(statement, params)
+        finally:
+            # Failed statements are recorded too, e.g. the ones cancelled by statement_timeout
+            self._slow_query_log.record(statement, params, time.perf_counter() - start)
+
+    def _get_all_books_query(self, filters, fields=None, order=None, limit=None):
+        query = 'SELECT {} FROM books'.format(', '.join(fields or BookRepo.book_fields)) + \
+            self._filter_condition(filters)
+        if order:
+            # Fields of an order are whitelisted (BookRepo.sortable_fields), hence safe to format
+            query += ' ORDER BY ' + ', '.join(field + (' DESC' if descending else '') for field, descending in order)
+        if limit is not None:
+            query += ' LIMIT %s'
+        return query
+
+    def _get_faceted_books_query(self, filters, facets, fields=None, order=None, limit=None):
+        """
+        Returns a query of the (sorted, limited) rows of books matching with filters followed by
+        counts of them by each facet. Matching books are read once, and are grouped by every facet
+        with GROUPING SETS.
+        """
+        fields = list(fields or BookRepo.book_fields)
+        columns = fields + [field for field, descending in order or () if field not in fields]
+        columns += [facet for facet in ('country', 'publisher') if facet in facets and facet not in columns]
+        if 'release_year' in facets:
+            columns.append("date_part('year', release_date)::int AS release_year")
+        order_by = ''
+        if order:
+            order_by = ' ORDER BY ' + ', '.join(field + (' DESC' if descending else '') for field, descending in order)
+
+        facet_of = ' '.join("WHEN GROUPING({0}) = 0 THEN '{0}'".format(facet) for facet in facets)
+        value_of = ' '.join('WHEN GROUPING({0}) = 0 THEN {0}::text'.format(facet) for facet in facets)
+        return (
+            'WITH matched AS (SELECT {} FROM books{}), '.format(', '.join(columns), self._filter_condition(filters)) +
+            'page AS (SELECT {}, row_number() OVER ({}) AS page_position FROM matched{}{}) '.format(
+                ', '.join(fields), order_by.strip(), order_by, ' LIMIT %s' if limit is not None else '') +
+            'SELECT NULL AS facet, NULL AS facet_value, NULL AS facet_books, page_position, {} FROM page '.format(
+                ', '.join(fields)) +
+            'UNION ALL SELECT CASE {} END, CASE {} END, count(*), NULL, {} FROM matched '.format(
+                facet_of, value_of, ', '.join('NULL' for field in fields)) +
+            'GROUP BY GROUPING SETS ({}) ORDER BY page_position'.format(
+                ', '.join('({})'.format(facet) for facet in facets)))
+
+    @staticmethod
+    def recommended_index(filters, order):
+        """
+        Returns CREATE INDEX statement of an index which serves a listing with given filters in given
+        order, e.g. the 10 newest books of a publisher, by a scan which stops after the first rows.
+        Columns filtered by equality come first and the order follows. An order having a single direction
+        is served by scanning an ascending index backwards. Returns None when the primary key serves the order.
+        """
+        # A release year is compared through date_part(), which an index of release_date does not serve
+        columns = sorted(key for key in filters if key != 'release_date')
+        order = [(field, descending) for field, descending in order or () if field not in columns]
+        if len({descending for field, descending in order}) == 1:
+            order = [(field, False) for field, descending in order]
+        if not order or (not columns and order == [('id', False)]):
+            return None
+
+        names = columns + [field for field, descending in order]
+        keys = columns + [field + (' DESC' if descending else '') for field, descending in order]
+        return 'CREATE INDEX CONCURRENTLY books_{}_idx ON books ({})'.format('_'.join(names), ', '.join(keys))
+
+    def _filter_condition(self, filters):
+        """
+        Returns WHERE clause of given filters, or an empty string when there are none.
+        Its parameters are given by _filter_params().
+        """
+        if not filters:
+            return ''
+
+        values = ['{}=%s'.format(key) for key in sorted(filters.keys()) if key != 'release_date']
+
+        if 'release_date' in filters:
+            values.append("date_part('year', release_date)=%s")
+
+        return ' WHERE ' + ' and '.join(values)
+
+    def _filter_params(self, filters):
+        params = [filters[key] for key in sorted(filters.keys()) if key != 'release_date']
+        if 'release_date' in filters:
+            params.append(filters['release_date'])
+        return tuple(params)
+
+    def insert(self, values):
+        try:
+            return self._execute(lambda cur: self._insert(cur, values))
+        except psycopg2.Error as err:
+            self._raise_save_error(err, values)
+
+    def update(self, id, values):
+        def update(cur):
+            self._run(cur, 'UPDATE books SET {} WHERE id = %s'.format(
+                ', '.join('{} = %s'.format(field) for field in value_fields)),
+                tuple(values[field] for field in value_fields) + (id,))
+            logger.debug('book record has been updated with id:%d', id)
+
+        try:
+            self._execute(update)
+        except psycopg2.Error as err:
+            self._raise_save_error(err, values)
+
+    def update_many(self, changes):
+        # Books changing the same columns are updated by a single statement, their values given as arrays
+        batches = {}
+        for id, values in changes.items():
+            batches.setdefault(tuple(field for field in value_fields if field in values), []).append(id)
+
+        def update(cur):
+            ids = []
+            for columns, batch in batches.items():
+                self._run(cur, self._get_update_many_statement(columns),
+                          (batch,) + tuple([changes[id][column] for id in batch] for column in columns))
+                ids.extend(row[0] for row in cur.fetchall())
+            return sorted(ids)
+
+        try:
+            return self._execute(update)
+        except psycopg2.Error as err:
+            raise BookError(
+                'UPDATE_BOOKS_ERROR',
+                'Unable to update books due to error: {} {}'.format(err.pgerror, err.pgcode),
+                err)
+
+    # Types of columns of 'books' table, which arrays of their values are cast to
+    column_types = {
+        'name': 'varchar', 'isbn': 'varchar', 'authors': 'varchar', 'country': 'varchar', 'number_of_pages': 'int',
+        'publisher': 'varchar', 'release_date': 'date'
+    }
+
+    def _get_update_many_statement(self, columns):
+        return 'UPDATE books SET {} FROM unnest(%s::int[], {}) AS changes (id, {}) WHERE books.id = changes.id ' \
+            'RETURNING books.id'.format(
+                ', '.join('{0} = changes.{0}'.format(column) for column in columns),
+                ', '.join('%s::{}[]'.format(self.column_types[column]) for column in columns),
+                ', '.join(columns))
+
+    def delete(self, id):
+        try:
+            self._execute(lambda cur: self._run(cur, 'DELETE FROM books WHERE id = %s', (id,)))
+        except psycopg2.Error as err:
+            raise BookError(
+                'DELETE_BOOK_ERROR',
+                'Unable to delete a book due to error: {} {}'.format(err.pgerror, err.pgcode),
+                err)
+
+    def _execute(self, write):
+        """
+        Runs write(cursor) and commits it, either in its own transaction or in a batch of
+        the group commit writer
+        """
+        if self._writer is not None:
+            with span('sql', 'Group commit'):
+                return self._writer.submit(write)
+
+        with ConnectionPoolContext(self._cpool) as conn:
+            cur = conn.cursor()
+            with span('sql', 'Query execution'):
+                result = write(cur)
+                conn.commit()
+            cur.close()
+            return result
+
+    def _insert(self, cur, values):
+        self._run(
+            cur,
+            'INSERT INTO books ({}) VALUES({}) ON CONFLICT (isbn) DO NOTHING RETURNING id'.format(
+                ', '.join(value_fields), ', '.join(['%s'] * len(value_fields))),
+            tuple(values[field] for field in value_fields))
+        row = cur.fetchone()
+        if row:
+            logger.debug('New book record has been created with id: %d', row[0])
+            return row[0], True
+
+        # The isbn exists already, it is the same book when every other value is the same too
+        self._run(
+            cur,
+            'SELECT id, (name, authors, country, number_of_pages, publisher, release_date) '
+            'IS NOT DISTINCT FROM (%s, %s, %s, %s::int, %s, %s::date) FROM books WHERE isbn = %s',
+            (values['name'], values['authors'], values['country'], values['number_of_pages'],
+             values['publisher'], values['release_date'], values['isbn']))
+        row = cur.fetchone()
+        if not row or not row[1]:
+            raise duplicate_isbn(values['isbn'])
+        logger.debug('Book record exists already with id: %d', row[0])
+        return row[0], False
+
+    def _raise_save_error(self, err, values):
+        if err.pgcode == errorcodes.UNIQUE_VIOLATION:
+            raise duplicate_isbn(values['isbn'], err)
+        raise BookError(
+            'SAVE_BOOK_ERROR',
+            'Unable to save a book due to error: {} {}'.format(err.pgerror, err.pgcode),
+            err)
+
+    def write_where(self, operation, filters, values=None, dry_run=False, max_affected=None):
+        if operation == 'update':
+            columns = [field for field in value_fields if field in values]
+            statement = 'UPDATE books SET {}{} RETURNING id'.format(
+                ', '.join('{} = %s'.format(column) for column in columns), self._filter_condition(filters))
+            params = tuple(values[column] for column in columns) + self._filter_params(filters)
+        else:
+            statement = 'DELETE FROM books{} RETURNING id'.format(self._filter_condition(filters))
+            params = self._filter_params(filters)
+
+        try:
+            with ConnectionPoolContext(self._cpool) as conn:
+                cur = conn.cursor()
+                with span('sql', 'Query execution'):
+                    if dry_run:
+                        self._run(cur, 'SELECT id FROM books' + self._filter_condition(filters),
+                                  self._filter_params(filters))
+                    else:
+                        logger.debug('Executing statement: %s', statement)
+                        self._run(cur, statement, params)
+                    ids = sorted(row[0] for row in cur.fetchall())
+                    if not dry_run:
+                        # Leaving the context with an error rolls back the statement
+                        check_affected(operation, ids, filters, max_affected)
+                    if dry_run:
+                        conn.rollback()
+                    else:
+                        conn.commit()
+                cur.close()
+                return ids
+        except psycopg2.Error as err:
+            if err.pgcode == errorcodes.UNIQUE_VIOLATION:
+                raise BookError('DUPLICATE_ISBN', 'Books matching with filters: {} can not have the same isbn'.format(
+                    filters), err)
+            raise BookError(
+                '{}_BOOKS_ERROR'.format(operation.upper()),
+                'Unable to {} books with filters: {} due to error: {}'.format(operation, filters, err.pgerror),
+                err)
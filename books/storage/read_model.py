@@ -0,0 +1,422 @@
+import logging
+import os
+import threading
+import time
+from array import array
+from collections import Counter
+from datetime import date
+import lifecycle
+from tracing import span
+from ..book import BookRepo, BookError
+from .base import BookStorage, sort_items
+logger = logging.getLogger(__name__)
+
+
+class BookColumns:
+    """
+    Rows of books kept column by column. Ids and release dates (as ordinals, 0 when there is none)
+    are kept in typed arrays, country and publisher as codes of their distinct values, and other
+    values in lists. The position of a deleted row is reused by a later row.
+
+    Hash indexes map a name, country, publisher and release year to the positions of rows having it,
+    so that filters are answered by intersecting those positions.
+    """
+
+    indexed_fields = ('name', 'country', 'publisher', 'release_date')
+    # Few distinct values repeat across many books
+    coded_fields = ('country', 'publisher')
+    listed_fields = ('name', 'isbn', 'authors', 'number_of_pages')
+
+    def __init__(self):
+        self._ids = array('q')
+        self._release_dates = array('l')
+        self._codes = {field: array('l') for field in self.coded_fields}
+        self._distinct_values = {field: [] for field in self.coded_fields}
+        self._code_of = {field: {} for field in self.coded_fields}
+        self._lists = {field: [] for field in self.listed_fields}
+        self._positions = {}
+        self._positions_by_isbn = {}
+        self._free = []
+        self._indexes = {field: {} for field in self.indexed_fields}
+
+    def __len__(self):
+        return len(self._positions)
+
+    def upsert(self, row):
+        """
+        Adds a row of all book fields, or replaces the row having the same id
+        """
+        id = row[0]
+        position = self._positions.get(id)
+        if position is None:
+            position = self._allocate()
+            self._positions[id] = position
+            self._ids[position] = id
+        else:
+            self._unindex(position)
+
+        values = dict(zip(BookRepo.book_fields, row))
+        self._release_dates[position] = values['release_date'].toordinal() if values['release_date'] else 0
+        for field in self.coded_fields:
+            self._codes[field][position] = self._code(field, values[field])
+        for field in self.listed_fields:
+            self._lists[field][position] = values[field]
+        self._index(position)
+
+    def delete(self, id):
+        position = self._positions.pop(id, None)
+        if position is None:
+            return
+        self._unindex(position)
+        self._ids[position] = 0
+        for field in self.listed_fields:
+            self._lists[field][position] = None
+        self._free.append(position)
+
+    def _allocate(self):
+        if self._free:
+            return self._free.pop()
+        self._ids.append(0)
+        self._release_dates.append(0)
+        for field in self.coded_fields:
+            self._codes[field].append(0)
+        for field in self.listed_fields:
+            self._lists[field].append(None)
+        return len(self._ids) - 1
+
+    def _code(self, field, value):
+        code = self._code_of[field].get(value)
+        if code is None:
+            code = len(self._distinct_values[field])
+            self._distinct_values[field].append(value)
+            self._code_of[field][value] = code
+        return code
+
+    def _index_key(self, field, position):
+        if field == 'release_date':
+            ordinal = self._release_dates[position]
+            return date.fromordinal(ordinal).year if ordinal else None
+        return self.value(field, position)
+
+    def _index(self, position):
+        for field in self.indexed_fields:
+            self._indexes[field].setdefault(self._index_key(field, position), set()).add(position)
+        self._positions_by_isbn[self._lists['isbn'][position]] = position
+
+    def _unindex(self, position):
+        for field in self.indexed_fields:
+            key = self._index_key(field, position)
+            postings = self._indexes[field][key]
+            postings.discard(position)
+            if not postings:
+                del self._indexes[field][key]
+        del self._positions_by_isbn[self._lists['isbn'][position]]
+
+    def positions(self, filters):
+        """
+        Returns positions of rows matching with filters (a year for release_date), in position order
+        """
+        if not filters:
+            return sorted(self._positions.values())
+
+        postings = sorted((self._indexes[field].get(value, ()) for field, value in filters.items()), key=len)
+        matching = set(postings[0])
+        for other in postings[1:]:
+            if not matching:
+                break
+            matching.intersection_update(other)
+        return sorted(matching)
+
+    def position_of(self, column, value):
+        if column == 'isbn':
+            return self._positions_by_isbn.get(value)
+        return self._positions.get(value)
+
+    def value(self, field, position):
+        if field == 'id':
+            return self._ids[position]
+        if field == 'release_date':
+            ordinal = self._release_dates[position]
+            return date.fromordinal(ordinal) if ordinal else None
+        if field in self.coded_fields:
+            return self._distinct_values[field][self._codes[field][position]]
+        return self._lists[field][position]
+
+    def row(self, position, fields=None):
+        return tuple(self.value(field, position) for field in fields or BookRepo.book_fields)
+
+    def rows(self, positions, fields=None):
+        """
+        Returns rows at given positions, assembled column by column
+        """
+        return list(zip(*(self._column(field, positions) for field in fields or BookRepo.book_fields)))
+
+    def count(self, facet, positions):
+        """
+        Counts rows at given positions by each value of a facet (BookRepo.facet_dimensions),
+        returns [(value, count)]
+        """
+        if facet == 'release_year':
+            ordinals = self._release_dates
+            counts = Counter(ordinals[position] for position in positions)
+            years = Counter()
+            for ordinal, count in counts.items():
+                years[date.fromordinal(ordinal).year if ordinal else None] += count
+            return list(years.items())
+        values, codes = self._distinct_values[facet], self._codes[facet]
+        counts = Counter(codes[position] for position in positions)
+        return [(values[code], count) for code, count in counts.items()]
+
+    def _column(self, field, positions):
+        if field == 'id':
+            ids = self._ids
+            return [ids[position] for position in positions]
+        if field == 'release_date':
+            # Few distinct dates repeat across many books
+            dates = {0: None}
+            ordinals = self._release_dates
+            return [dates[ordinal] if ordinal in dates else dates.setdefault(ordinal, date.fromordinal(ordinal))
+                    for ordinal in (ordinals[position] for position in positions)]
+        if field in self.coded_fields:
+            values, codes = self._distinct_values[field], self._codes[field]
+            return [values[codes[position]] for position in positions]
+        values = self._lists[field]
+        return [values[position] for position in positions]
+
+
+class ReadModelStorage(BookStorage):
+    """
+    Serves reads of books from a columnar copy (BookColumns) of another storage and passes writes
+    through to it. The copy is loaded by warm_up() and kept fresh by applying the changes recorded
+    in 'book_changes' table, which are polled every refresh_interval seconds, and the writes of this
+    process right after they are made.
+
+    Reads are served by the storage itself while the copy is not loaded, or when the copy has not
+    caught up with recorded changes within max_staleness seconds. Without a change source only the
+    writes of this process are applied, hence the storage must not be written by other processes.
+    """
+
+    name = 'books_read_model'
+
+    def __init__(self, storage, change_source=None, refresh_interval=1.0, max_staleness=5.0, gap_timeout=60.0,
+                 batch_size=1000, clock=time.monotonic):
+        self._storage = storage
+        self._change_source = change_source
+        self._refresh_interval = refresh_interval
+        self._max_staleness = max_staleness
+        self._gap_timeout = gap_timeout
+        self._batch_size = batch_size
+        self._clock = clock
+        self._columns = None
+        self._loading = None
+        # Guards the columns, reads of rows are cheap compared to a round trip to the storage
+        self._lock = threading.RLock()
+        # Serializes fetching and applying rows, so that an older fetch never overwrites a newer one
+        self._apply_lock = threading.Lock()
+        self._seq = 0
+        # Sequence -> time it was missed. A sequence is missed when a later one is read before
+        # the transaction recording it commits (or it was rolled back).
+        self._gaps = {}
+        self._fresh_at = None
+        self._state = 'cold'
+        self._error = None
+        self._pid = os.getpid()
+        self._thread = None
+        self._stopped = threading.Event()
+        lifecycle.register(self)
+
+    @property
+    def storage(self):
+        return self._storage
+
+    def select(self, filters, fields=None, order=None, limit=None):
+        columns = self._fresh_columns()
+        if columns is None:
+            return self._storage.select(filters, fields, order, limit)
+        with span('index', 'Read model lookup'), self._lock:
+            return columns.rows(self._page(columns, columns.positions(filters), order, limit), fields)
+
+    def select_with_facets(self, filters, facets, fields=None, order=None, limit=None):
+        columns = self._fresh_columns()
+        if columns is None:
+            return self._storage.select_with_facets(filters, facets, fields, order, limit)
+        with span('index', 'Read model lookup'), self._lock:
+            positions = columns.positions(filters)
+            counts = {facet: columns.count(facet, positions) for facet in facets}
+            return columns.rows(self._page(columns, positions, order, limit), fields), counts
+
+    @staticmethod
+    def _page(columns, positions, order, limit):
+        if order:
+            return sort_items(positions, order, lambda position, field: columns.value(field, position), limit)
+        return positions[:limit] if limit is not None else positions
+
+    def select_by(self, column, value, fields=None):
+        columns = self._fresh_columns()
+        if columns is None:
+            return self._storage.select_by(column, value, fields)
+        with span('index', 'Read model lookup'), self._lock:
+            position = columns.position_of(column, value)
+            return columns.row(position, fields) if position is not None else None
+
+    def select_by_ids(self, ids, fields=None):
+        columns = self._fresh_columns()
+        if columns is None:
+            return self._storage.select_by_ids(ids, fields)
+        with span('index', 'Read model lookup'), self._lock:
+            positions = [columns.position_of('id', id) for id in ids]
+            return columns.rows([position for position in positions if position is not None], fields)
+
+    def _fresh_columns(self):
+        """
+        Returns the columns when they can serve reads, or None
+        """
+        columns = self._columns
+        if columns is None or self._pid != os.getpid():
+            return None
+        if self._change_source is not None and self._clock() - self._fresh_at > self._max_staleness:
+            logger.warning('Book read model is stale since %.1f sec, reading from storage',
+                           self._clock() - self._fresh_at)
+            return None
+        return columns
+
+    def insert(self, values):
+        id, inserted = self._storage.insert(values)
+        self._apply([id])
+        return id, inserted
+
+    def update(self, id, values):
+        self._storage.update(id, values)
+        self._apply([id])
+
+    def update_many(self, changes):
+        ids = self._storage.update_many(changes)
+        self._apply(ids)
+        return ids
+
+    def delete(self, id):
+        self._storage.delete(id)
+        self._apply([id])
+
+    def write_where(self, operation, filters, values=None, dry_run=False, max_affected=None):
+        ids = self._storage.write_where(operation, filters, values, dry_run, max_affected)
+        if not dry_run:
+            self._apply(ids)
+        return ids
+
+    def _apply(self, ids):
+        """
+        Fetches current rows of given ids from the storage into the columns. A book which is not
+        found has been deleted.
+        """
+        if not ids:
+            return
+        with self._apply_lock:
+            columns = self._loading or self._columns
+            if columns is None:
+                return
+            ids = list(set(ids))
+            for start in range(0, len(ids), self._batch_size):
+                batch = ids[start:start + self._batch_size]
+                rows = self._storage.select_by_ids(batch)
+                with self._lock:
+                    for row in rows:
+                        columns.upsert(row)
+                    for id in set(batch) - {row[0] for row in rows}:
+                        columns.delete(id)
+
+    def load(self):
+        """
+        Loads all books into new columns, and catches up with changes recorded meanwhile
+        """
+        started = self._clock()
+        seq = self._change_source.last_seq() if self._change_source is not None else 0
+        columns = BookColumns()
+        # Writes of this process wait for the load, then they are applied to the new columns
+        with span('index', 'Read model load'), self._apply_lock:
+            self._loading = columns
+            self._seq, self._gaps = seq, {}
+            for row in self._storage.select({}):
+                columns.upsert(row)
+
+        try:
+            self._fresh_at = started
+            if self._change_source is not None:
+                self.catch_up()
+            self._columns = columns
+        finally:
+            self._loading = None
+        logger.info('Loaded %d books into read model in %.3f sec', len(columns), self._clock() - started)
+
+    def catch_up(self):
+        """
+        Applies changes recorded after the last applied sequence, and the missed ones
+        """
+        started = self._clock()
+        while True:
+            changes = self._change_source.changes_since(self._seq, self._batch_size, sorted(self._gaps))
+            self._apply([change['id'] for change in changes])
+            for change in changes:
+                self._gaps.pop(change['seq'], None)
+                if change['seq'] > self._seq:
+                    self._gaps.update((seq, started) for seq in range(self._seq + 1, change['seq']))
+                    self._seq = change['seq']
+            if len(changes) < self._batch_size:
+                break
+
+        # A missed sequence is given up after gap_timeout, e.g. it was taken by a rolled back transaction
+        for seq in [seq for seq, missed_at in self._gaps.items() if started - missed_at > self._gap_timeout]:
+            del self._gaps[seq]
+        self._fresh_at = started
+
+    def warm_up(self):
+        """
+        Loads the books (when the app starts, see lifecycle.start()) and starts catching up with
+        changes in background. A model which fails to load is loaded again in background.
+        """
+        self._state = 'warming'
+        self._try_load()
+        if (self._columns is None or self._change_source is not None) and \
+                (self._thread is None or not self._thread.is_alive()):
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._refresh, name='book-read-model', daemon=True)
+            self._thread.start()
+
+    def _try_load(self):
+        try:
+            self.load()
+            self._state, self._error = 'ready', None
+        except BookError as err:
+            self._state, self._error = 'failed', err.message()
+            logger.error('Unable to load book read model due to error: %s', self._error)
+
+    def _refresh(self):
+        while not self._stopped.wait(self._refresh_interval):
+            if self._columns is None:
+                # Reads are served by the storage until the model is loaded
+                self._try_load()
+                continue
+            if self._change_source is None:
+                return
+            try:
+                self.catch_up()
+            except BookError as err:
+                # Reads fall back to the storage once the model is stale
+                logger.error('Unable to catch up book read model due to error: %s', err.message())
+
+    def state(self):
+        return self._state, self._error
+
+    def reset_after_fork(self):
+        if self._pid != os.getpid():
+            # The refreshing thread is not running in the child, the model is loaded again by warm up
+            self._pid = os.getpid()
+            self._lock = threading.RLock()
+            self._apply_lock = threading.Lock()
+            self._columns = None
+            self._loading = None
+            self._thread = None
+            self._state, self._error = 'cold', None
+
+    def close(self):
+        self._stopped.set()
@@ -0,0 +1,251 @@
+import logging
+import os
+import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+from datetime import date
+import lifecycle
+from tracing import span
+from ..book import BookRepo, BookError
+from .base import BookStorage, value_fields, check_affected, duplicate_isbn
+logger = logging.getLogger(__name__)
+
+schema = [
+    '''CREATE TABLE IF NOT EXISTS books (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name VARCHAR(100) NOT NULL,
+        isbn VARCHAR(50) NOT NULL,
+        authors VARCHAR(100) NOT NULL,
+        country VARCHAR(50) NOT NULL,
+        number_of_pages INT DEFAULT 0,
+        publisher VARCHAR(100),
+        release_date DATE
+    )''',
+    'CREATE UNIQUE INDEX IF NOT EXISTS books_isbn_key ON books (isbn)'
+]
+
+
+class _ThreadConnection:
+    """
+    Holds the connection of a thread in its thread locals, the connection is closed when the holder
+    is collected with them
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+
+class SqliteStorage(BookStorage):
+    """
+    Stores books in an embedded SQLite db file, in WAL mode so that readers are not blocked by
+    a writer. Every thread uses its own connection, closed when the thread ends (a threaded server may
+    start a thread per request), and the table is created when it does not exist.
+    Writers of several processes are serialized by SQLite, they wait up to busy_timeout_ms for each other.
+    """
+
+    # Connections inherited from a parent process, referenced so that they are never closed by the child
+    _inherited = []
+
+    def __init__(self, path, busy_timeout_ms=5000, synchronous='NORMAL'):
+        self._path = path
+        self._busy_timeout_ms = busy_timeout_ms
+        self._synchronous = synchronous
+        self._local = threading.local()
+        # Reentrant, a connection may be released by garbage collection while the lock is held
+        self._lock = threading.RLock()
+        self._connections = set()
+        self._pid = os.getpid()
+
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        for statement in schema:
+            conn.execute(statement)
+        lifecycle.register(self)
+
+    def _connection(self):
+        holder = getattr(self._local, 'holder', None)
+        if holder is not None:
+            return holder.conn
+
+        # Transactions are begun explicitly, see _transaction()
+        conn = sqlite3.connect(self._path, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA busy_timeout={:d}'.format(self._busy_timeout_ms))
+        conn.execute('PRAGMA synchronous={}'.format(self._synchronous))
+        holder = self._local.holder = _ThreadConnection(conn)
+        with self._lock:
+            self._connections.add(conn)
+        weakref.finalize(holder, self._release, conn, os.getpid())
+        return conn
+
+    def _release(self, conn, pid):
+        if pid != os.getpid():
+            # Connections of the parent are not closed by the child
+            return
+        with self._lock:
+            if conn not in self._connections:
+                # Closed already
+                return
+            self._connections.discard(conn)
+        conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        # Takes the write lock up front, so that the transaction never fails to upgrade its lock
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def select(self, filters, fields=None, order=None, limit=None):
+        condition, params = self._filter_condition(filters)
+        query = 'SELECT {} FROM books{}{}'.format(', '.join(fields or BookRepo.book_fields), condition,
+                                                  self._order_clause(order))
+        if limit is not None:
+            query += ' LIMIT ?'
+            params += (limit,)
+        return self._query('GET_BOOKS_ERROR', query, params, fields)
+
+    def _order_clause(self, order):
+        if not order:
+            return ''
+        # NULLs are ordered like in Postgres, larger than any value
+        return ' ORDER BY ' + ', '.join('{} DESC NULLS FIRST'.format(field) if descending else
+                                        '{} ASC NULLS LAST'.format(field) for field, descending in order)
+
+    def select_by(self, column, value, fields=None):
+        query = 'SELECT {} FROM books WHERE {} = ?'.format(', '.join(fields or BookRepo.book_fields), column)
+        rows = self._query('GET_BOOK_ERROR', query, (value,), fields)
+        return rows[0] if rows else None
+
+    def select_by_ids(self, ids, fields=None):
+        query = 'SELECT {} FROM books WHERE id IN ({})'.format(', '.join(fields or BookRepo.book_fields),
+                                                               ', '.join(['?'] * len(ids)))
+        return self._query('GET_BOOKS_ERROR', query, tuple(ids), fields)
+
+    def _query(self, error_name, query, params, fields):
+        logger.debug('Executing query: %s', query)
+        try:
+            with span('sql', 'Query execution'):
+                rows = self._connection().execute(query, params).fetchall()
+        except sqlite3.Error as err:
+            raise BookError(error_name, 'Unable to fetch books due to error: {}'.format(err), err)
+
+        fields = fields or BookRepo.book_fields
+        if 'release_date' not in fields:
+            return rows
+        # Dates are stored as text
+        position = fields.index('release_date')
+        return [row[:position] + (date.fromisoformat(row[position]) if row[position] else None,) + row[position + 1:]
+                for row in rows]
+
+    def _filter_condition(self, filters):
+        if not filters:
+            return '', ()
+
+        values = ['{}=?'.format(key) for key in sorted(filters.keys()) if key != 'release_date']
+        params = [filters[key] for key in sorted(filters.keys()) if key != 'release_date']
+        if 'release_date' in filters:
+            values.append("CAST(strftime('%Y', release_date) AS INTEGER)=?")
+            params.append(filters['release_date'])
+        return ' WHERE ' + ' and '.join(values), tuple(params)
+
+    def insert(self, values):
+        params = tuple(values[field] for field in value_fields)
+        try:
+            with span('sql', 'Query execution'), self._transaction() as conn:
+                cur = conn.execute('INSERT INTO books ({}) VALUES({}) ON CONFLICT (isbn) DO NOTHING'.format(
+                    ', '.join(value_fields), ', '.join(['?'] * len(value_fields))), params)
+                if cur.rowcount == 1:
+                    return cur.lastrowid, True
+
+                # The isbn exists already, it is the same book when every other value is the same too
+                row = conn.execute('SELECT id, {} FROM books WHERE isbn = ?'.format(', '.join(value_fields)),
+                                   (values['isbn'],)).fetchone()
+                if row is None or row[1:] != params:
+                    raise duplicate_isbn(values['isbn'])
+                return row[0], False
+        except sqlite3.Error as err:
+            self._raise_save_error(err, values)
+
+    def update(self, id, values):
+        try:
+            with span('sql', 'Query execution'), self._transaction() as conn:
+                conn.execute('UPDATE books SET {} WHERE id = ?'.format(
+                    ', '.join('{} = ?'.format(field) for field in value_fields)),
+                    tuple(values[field] for field in value_fields) + (id,))
+        except sqlite3.Error as err:
+            self._raise_save_error(err, values)
+
+    def update_many(self, changes):
+        ids = []
+        try:
+            with span('sql', 'Query execution'), self._transaction() as conn:
+                for id, values in changes.items():
+                    columns = [field for field in value_fields if field in values]
+                    cur = conn.execute('UPDATE books SET {} WHERE id = ?'.format(
+                        ', '.join('{} = ?'.format(column) for column in columns)),
+                        tuple(values[column] for column in columns) + (id,))
+                    if cur.rowcount == 1:
+                        ids.append(id)
+        except sqlite3.Error as err:
+            raise BookError('UPDATE_BOOKS_ERROR', 'Unable to update books due to error: {}'.format(err), err)
+        return sorted(ids)
+
+    def delete(self, id):
+        try:
+            with span('sql', 'Query execution'), self._transaction() as conn:
+                conn.execute('DELETE FROM books WHERE id = ?', (id,))
+        except sqlite3.Error as err:
+            raise BookError('DELETE_BOOK_ERROR', 'Unable to delete a book due to error: {}'.format(err), err)
+
+    def _raise_save_error(self, err, values):
+        if isinstance(err, sqlite3.IntegrityError) and 'UNIQUE' in str(err):
+            raise duplicate_isbn(values['isbn'], err)
+        raise BookError('SAVE_BOOK_ERROR', 'Unable to save a book due to error: {}'.format(err), err)
+
+    def write_where(self, operation, filters, values=None, dry_run=False, max_affected=None):
+        condition, params = self._filter_condition(filters)
+        try:
+            with span('sql', 'Query execution'), self._transaction() as conn:
+                ids = sorted(row[0] for row in conn.execute('SELECT id FROM books' + condition, params))
+                if dry_run:
+                    return ids
+                check_affected(operation, ids, filters, max_affected)
+
+                if operation == 'update':
+                    columns = [field for field in value_fields if field in values]
+                    conn.execute('UPDATE books SET {}{}'.format(
+                        ', '.join('{} = ?'.format(column) for column in columns), condition),
+                        tuple(values[column] for column in columns) + params)
+                else:
+                    conn.execute('DELETE FROM books' + condition, params)
+                return ids
+        except sqlite3.Error as err:
+            if isinstance(err, sqlite3.IntegrityError) and 'UNIQUE' in str(err):
+                raise BookError('DUPLICATE_ISBN', 'Books matching with filters: {} can not have the same isbn'.format(
+                    filters), err)
+            raise BookError(
+                '{}_BOOKS_ERROR'.format(operation.upper()),
+                'Unable to {} books with filters: {} due to error: {}'.format(operation, filters, err),
+                err)
+
+    def reset_after_fork(self):
+        if self._pid != os.getpid():
+            # Connections of the parent must not be used by the child
+            SqliteStorage._inherited.extend(self._connections)
+            self._pid = os.getpid()
+            self._lock = threading.RLock()
+            self._local = threading.local()
+            self._connections = set()
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = set()
+        self._local = threading.local()
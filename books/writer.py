@@ -0,0 +1,158 @@
+import logging
+import os
+import queue
+import threading
+import time
+import psycopg2
+import lifecycle
+from deadlines import DeadlineExceeded, remaining
+from .book import ConnectionPoolContext
+logger = logging.getLogger(__name__)
+
+
+class _Write:
+
+    def __init__(self, write):
+        self.write = write
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        # Guards state: 'queued', then 'started' by the writer or 'cancelled' by its caller
+        self.lock = threading.Lock()
+        self.state = 'queued'
+
+    def start(self):
+        with self.lock:
+            if self.state == 'cancelled':
+                return False
+            self.state = 'started'
+            return True
+
+    def cancel(self):
+        with self.lock:
+            if self.state == 'started':
+                return False
+            self.state = 'cancelled'
+            return True
+
+
+class GroupCommitWriter:
+    """
+    Runs writes of concurrent callers in a background thread, committing a batch of them in a
+    single transaction (a single fsync and a single connection). A batch holds the writes queued
+    while the previous batch was committed, up to 'max_batch' of them, waiting up to 'max_delay'
+    seconds for more writes when it is not full.
+
+    Every write runs within its own savepoint, so that a failed write does not fail the others.
+    A caller is blocked until its write is committed and gets its own result or error, or until
+    its request deadline, when its write is dropped unless the writer has started it already.
+    The writer waits for a pooled connection when all of them are in use.
+    """
+
+    def __init__(self, cpool, max_batch=50, max_delay=0.0):
+        self._cpool = cpool
+        self._max_batch = max_batch
+        self._max_delay = max_delay
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        lifecycle.register(self)
+
+    def submit(self, write):
+        """
+        Runs write(cursor) in the next batch and returns its result, or raises its error
+        (or the error of committing the batch). Raises DB_WRITE_TIMEOUT error when the write
+        is not started within the request deadline.
+        """
+        self._start()
+        item = _Write(write)
+        self._queue.put(item)
+        if not item.done.wait(remaining()):
+            if item.cancel():
+                raise DeadlineExceeded('DB_WRITE_TIMEOUT', 'Write is not committed within the request deadline')
+            # The write runs in a batch already, it may be committed
+            item.done.wait()
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def _start(self):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='book-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = self._next_batch(item)
+            if batch[-1] is None:
+                self._flush(batch[:-1])
+                return
+            self._flush(batch)
+
+    def _next_batch(self, item):
+        batch = [item]
+        deadline = time.monotonic() + self._max_delay
+        while len(batch) < self._max_batch:
+            try:
+                timeout = deadline - time.monotonic()
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            if item is None:
+                break
+        return batch
+
+    def _flush(self, batch):
+        try:
+            with ConnectionPoolContext(self._cpool, block=True) as conn:
+                batch = [item for item in batch if item.start()]
+                cur = conn.cursor()
+                for item in batch:
+                    cur.execute('SAVEPOINT write')
+                    try:
+                        item.result = item.write(cur)
+                    except Exception as err:
+                        cur.execute('ROLLBACK TO SAVEPOINT write')
+                        item.error = err
+                    else:
+                        cur.execute('RELEASE SAVEPOINT write')
+                conn.commit()
+                cur.close()
+            logger.debug('Committed a batch of %d writes', len(batch))
+        except psycopg2.Error as err:
+            logger.error('Unable to commit a batch of %d writes due to error: %s', len(batch), err)
+            for item in batch:
+                if item.error is None:
+                    item.result, item.error = None, err
+        except Exception as err:
+            for item in batch:
+                if item.error is None:
+                    item.result, item.error = None, err
+        finally:
+            for item in batch:
+                item.done.set()
+
+    def reset_after_fork(self):
+        if self._pid is not None and self._pid != os.getpid():
+            # Writes queued in the parent are not committed by the child
+            self._lock = threading.Lock()
+            self._queue = queue.Queue()
+            self._thread = None
+
+    def close(self):
+        """
+        Commits queued writes and stops the writer
+        """
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(5)
+        self._thread = None
@@ -0,0 +1 @@
+from .compressor import Compressor, CompressedBodyCache, negotiate, available_encodings, init_app
@@ -0,0 +1,212 @@
+import hashlib
+import logging
+import threading
+import zlib
+from collections import OrderedDict
+from flask import request
+from tracing import span
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class GzipEncoder:
+    name = 'gzip'
+
+    def __init__(self, level):
+        self._level = level
+
+    def compress(self, data):
+        compressobj = zlib.compressobj(self._level, zlib.DEFLATED, 31)
+        return compressobj.compress(data) + compressobj.flush()
+
+    def stream(self, chunks):
+        compressobj = zlib.compressobj(self._level, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            # Sync flush makes every chunk reach the client as soon as it is produced
+            yield compressobj.compress(_to_bytes(chunk)) + compressobj.flush(zlib.Z_SYNC_FLUSH)
+        yield compressobj.flush()
+
+
+class BrotliEncoder:
+    name = 'br'
+
+    def __init__(self, level):
+        self._level = level
+
+    def compress(self, data):
+        return brotli.compress(data, quality=self._level)
+
+    def stream(self, chunks):
+        compressor = brotli.Compressor(quality=self._level)
+        for chunk in chunks:
+            yield compressor.process(_to_bytes(chunk)) + compressor.flush()
+        yield compressor.finish()
+
+
+class ZstdEncoder:
+    name = 'zstd'
+
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def stream(self, chunks):
+        compressobj = self._compressor.compressobj()
+        for chunk in chunks:
+            yield compressobj.compress(_to_bytes(chunk)) + compressobj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        yield compressobj.flush()
+
+
+def _to_bytes(chunk):
+    return chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+
+
+def available_encodings(levels):
+    """
+    Returns encoders of all installed algorithms, ordered by server preference
+    """
+    encoders = OrderedDict()
+    if zstandard is not None:
+        encoders['zstd'] = ZstdEncoder(levels.get('zstd', 3))
+    if brotli is not None:
+        encoders['br'] = BrotliEncoder(levels.get('br', 5))
+    encoders['gzip'] = GzipEncoder(levels.get('gzip', 6))
+    return encoders
+
+
+def negotiate(accept_encoding, available):
+    """
+    Picks an encoding from 'Accept-Encoding' header value. Among encodings having the same
+    quality, the one appearing first in 'available' is preferred. Returns None when the
+    response should not be encoded.
+    """
+    if not accept_encoding:
+        return None
+
+    qualities = {}
+    for item in accept_encoding.split(','):
+        parts = item.strip().split(';')
+        coding = parts[0].strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in parts[1:]:
+            key, _, value = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding] = quality
+
+    best, best_quality = None, 0.0
+    for coding in available:
+        quality = qualities.get(coding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+class CompressedBodyCache:
+    """
+    A bounded LRU cache of compressed bodies by (body digest, encoding), so that the same
+    body is compressed only once per encoding.
+    """
+
+    def __init__(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compress(self, body, encoder):
+        if self._max_bytes <= 0:
+            return encoder.compress(body)
+
+        key = (hashlib.sha1(body).digest(), len(body), encoder.name)
+        with self._lock:
+            compressed = self._entries.get(key)
+            if compressed is not None:
+                self._entries.move_to_end(key)
+                return compressed
+
+        compressed = encoder.compress(body)
+        if len(compressed) > self._max_bytes:
+            return compressed
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = compressed
+                self._size += len(compressed)
+            while self._size > self._max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+        return compressed
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class Compressor:
+    """
+    Compresses responses with an encoding negotiated through 'Accept-Encoding' header.
+    Streamed responses are compressed chunk by chunk as they are generated.
+    """
+
+    def __init__(self, config):
+        self._min_size = config.get('min_size', 1024)
+        self._mimetypes = set(config.get('mimetypes', ['application/json']))
+        self._encoders = available_encodings(config.get('levels', {}))
+        self._cache = CompressedBodyCache(config.get('cache_max_bytes', 32 * 1024 * 1024))
+
+    def after_request(self, response):
+        if not self._is_compressible(response):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate(request.headers.get('Accept-Encoding', ''), self._encoders.keys())
+        if encoding is None:
+            return response
+
+        encoder = self._encoders[encoding]
+        if response.is_streamed:
+            response.response = encoder.stream(response.response)
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            if len(body) < self._min_size:
+                return response
+            with span('compress', 'Response compression'):
+                response.set_data(self._cache.get_or_compress(body, encoder))
+
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    def _is_compressible(self, response):
+        if response.status_code < 200 or response.status_code in (204, 304):
+            return False
+        if response.direct_passthrough or 'Content-Encoding' in response.headers:
+            return False
+        if 'no-transform' in response.headers.get('Cache-Control', ''):
+            return False
+        return response.mimetype in self._mimetypes
+
+
+def init_app(app, config):
+    if not config.get('enabled', True):
+        return None
+
+    compressor = Compressor(config)
+    app.after_request(compressor.after_request)
+    return compressor
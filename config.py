@@ -2,9 +2,22 @@ log = dict(
     file_name='bookapi.log'
 )
 external_books_api = dict(
-    ice_and_fire_api_base_url='https://anapioficeandfire.com/api'
+    ice_and_fire_api_base_url='https://anapioficeandfire.com/api',
+    # Seconds to connect to and to wait for a response of the api, shortened to the request deadline
+    connect_timeout=3.05,
+    read_timeout=10.0
 )
 books_api = dict(
+    # Where books are stored: 'postgres' (connection_pool), 'sqlite' (an embedded db file in WAL mode)
+    # or 'memory' (per process, lost on exit). Stats and change feed are served by postgres only.
+    storage=dict(
+        backend='postgres',
+        sqlite=dict(
+            path='booksapi.db',
+            busy_timeout_ms=5000,
+            synchronous='NORMAL'
+        )
+    ),
     connection_pool=dict(
         minconn=1,
         maxconn=5,
@@ -13,5 +26,185 @@ books_api = dict(
         password='postgres',
         host='127.0.0.1',
         port='5432'
+    ),
+    # Number of json encoded books kept in memory to serve unchanged rows of book listings
+    encoded_cache_size=10000,
+    # Maximum number of books fetched at once by ids (/books?ids=1,2,3)
+    max_ids=100,
+    # Maximum number of books a listing can be limited to (/books?sort=-release_date&limit=10)
+    max_limit=1000,
+    # Headers of book (listing) responses, which let reverse proxies / CDNs cache them
+    http_cache=dict(
+        cache_control='public, max-age=30',
+        vary=['Accept-Encoding'],
+        # Redirect listing requests to their canonical url (sorted, lower cased parameters),
+        # so that caches keep a single entry per distinct listing
+        redirect_to_canonical=False
+    ),
+    # Responses of book creations remembered by Idempotency-Key header, for ttl seconds
+    idempotency=dict(
+        max_keys=10000,
+        ttl=86400
+    ),
+    # Bulk updates / deletes by filters fail without writing anything when they match more books.
+    # A request can lower it with max_affected query parameter.
+    bulk=dict(
+        max_affected=1000
+    ),
+    # Writes of books (create, update, delete) committed in batches by a background writer, so that
+    # a burst of writes costs a single transaction. A request still waits until its write is committed.
+    group_commit=dict(
+        enabled=False,
+        max_batch=50,
+        # Milliseconds a batch waits for more writes, 0 to commit the writes which are already queued
+        max_delay_ms=0
+    ),
+    stats=dict(
+        # Seconds to wait after a write before refreshing book_stats view. Writes within this
+        # delay are covered by a single refresh.
+        refresh_delay=1.0
+    ),
+    # Change feed (/books/changes), fed by NOTIFYs of book_changes trigger on a single
+    # LISTEN connection per process
+    changes=dict(
+        channel='book_changes',
+        # Number of recent changes kept in memory for subscribers which fall behind
+        buffer_size=1000,
+        # Seconds between keep-alive comments of an idle event stream
+        heartbeat=15,
+        # Milliseconds clients wait before reconnecting a dropped event stream
+        retry_ms=3000,
+        # Maximum seconds a long polling request waits for changes
+        max_wait=30
+    ),
+    # Books kept in memory column by column, with hash indexes on name, country, publisher and
+    # release year, to serve reads without a round trip to the storage. It is loaded on warm up.
+    read_model=dict(
+        enabled=False,
+        # Seconds between polls of book_changes table for changes made by other processes
+        refresh_interval=1.0,
+        # Reads are served by the storage when the model could not catch up within these seconds
+        max_staleness=5.0,
+        # Seconds to wait for a missing sequence of book_changes (an uncommitted change)
+        gap_timeout=60.0
+    ),
+    # Statements of Postgres storage slower than threshold_ms are logged and kept by their shape,
+    # which /api/v1/admin/slow-queries lists with plans captured by a sampled EXPLAIN (ANALYZE, BUFFERS)
+    # on a dedicated connection
+    slow_queries=dict(
+        enabled=False,
+        threshold_ms=100,
+        # Number of distinct query shapes kept
+        max_shapes=100,
+        # Plans are captured for this many slowest shapes, 0 sample rate to never capture them
+        explain_top=10,
+        explain_sample_rate=0.1,
+        # Seconds before a plan of the same shape is captured again
+        explain_interval=300,
+        # EXPLAIN ANALYZE runs the query again, it is cancelled after these milliseconds
+        explain_timeout_ms=5000,
+        # Required in 'X-Admin-Token' header by the admin end point
+        admin_token=None
+    ),
+    # Values of local books which differ from the Ice and Fire api are updated in background, by the
+    # single process holding an advisory lock with Postgres storage (by every process otherwise).
+    # Catalog pages are revalidated with their ETag, so that an unchanged catalog costs 304s.
+    catalog_sync=dict(
+        enabled=False,
+        ice_and_fire_api_base_url='https://anapioficeandfire.com/api',
+        # Seconds between syncs, and before the first sync after a process starts
+        interval=3600,
+        initial_delay=60,
+        # Fields taken from the catalog, books are matched by isbn (or name) which are never changed
+        fields=['authors', 'country', 'number_of_pages', 'publisher', 'release_date'],
+        page_size=50,
+        # Catalog pages fetched concurrently, not more than rate_limit requests per second
+        max_workers=4,
+        rate_limit=5.0,
+        # Seconds to wait for a response of the api
+        timeout=10.0,
+        # Books updated per statement
+        batch_size=100,
+        # Required in 'X-Admin-Token' header by /api/v1/admin/catalog-sync
+        admin_token=None
     )
 )
+tracing = dict(
+    request_id_header='X-Request-ID',
+    server_timing=True,
+    log_records=False
+)
+profiling = dict(
+    # Profiling end points and hooks are installed only when enabled
+    enabled=False,
+    # Required in 'X-Admin-Token' header by admin end points and as value of profiling header
+    admin_token=None,
+    header='X-Profile',
+    # Fraction of requests profiled without any header
+    sample_rate=0.0,
+    output_dir='profiles',
+    sampler_interval=0.005,
+    sampler_max_seconds=60
+)
+traffic_capture = dict(
+    # Sampled requests are recorded into a jsonl file, which can be replayed by 'python -m traffic.replay'
+    enabled=False,
+    file_name='captures/traffic.jsonl',
+    sample_rate=1.0,
+    # Values of these keys in query / json body are recorded as '***'
+    redact_keys=['password', 'token', 'api_key'],
+    max_body_bytes=65536
+)
+json_codec = dict(
+    # 'auto' uses orjson when it is installed and falls back to stdlib json otherwise
+    backend='auto'
+)
+compression = dict(
+    enabled=True,
+    # Responses smaller than this (in bytes) are sent as they are
+    min_size=1024,
+    # br and zstd are used only when brotli / zstandard packages are installed
+    levels=dict(gzip=6, br=5, zstd=3),
+    mimetypes=['application/json', 'text/plain'],
+    # Compressed bodies are cached by body digest and encoding, up to this many bytes
+    cache_max_bytes=32 * 1024 * 1024
+)
+admission = dict(
+    enabled=True,
+    # Seconds (Retry-After) clients are asked to wait when their request is rejected
+    retry_after=1,
+    # Requests beyond max_concurrency wait in a queue (reads ahead of writes), and they are
+    # rejected with 503 when the queue is full or they can not start within queue_timeout seconds
+    groups=dict(
+        # Not more than connection pool's maxconn, so that admitted requests always get a connection
+        books_db=dict(max_concurrency=5, max_queue=50, queue_timeout=2.0),
+        external_api=dict(max_concurrency=20, max_queue=50, queue_timeout=2.0),
+        # Long polls wait without holding a db connection, hence they are limited separately
+        book_changes=dict(max_concurrency=100, max_queue=0, queue_timeout=0)
+    ),
+    # Endpoint or blueprint name -> group
+    routes={
+        'books_api.get_changes': 'book_changes',
+        'books_api': 'books_db',
+        'external_books_api': 'external_api'
+    }
+)
+deadlines = dict(
+    # Every request gets a deadline, which bounds its wait for a db connection (pool), its statements
+    # (statement_timeout) and its calls of Ice and Fire api. Requests exceeding it fail with 504.
+    enabled=True,
+    # Seconds given to a request whose route has no deadline of its own
+    default=10.0,
+    # A client can ask for another deadline in milliseconds with this header, up to max seconds
+    # (below gunicorn's worker timeout)
+    header='X-Request-Timeout-Ms',
+    max=25.0,
+    # Endpoint or blueprint name -> seconds, None for no deadline
+    routes={
+        # Long polls and event streams bound their waits by themselves
+        'books_api.get_changes': None,
+        'books_api': 5.0,
+        'external_books_api': 8.0,
+        'health': 2.0
+    }
+)
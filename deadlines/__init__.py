@@ -0,0 +1,2 @@
+from .deadline import DeadlineExceeded, start_deadline, end_deadline, remaining, check_deadline, timeout
+from .middleware import init_app
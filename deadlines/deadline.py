@@ -0,0 +1,66 @@
+import time
+from contextvars import ContextVar
+
+# Monotonic time by which the current request must be answered, None when it has no deadline
+_deadline = ContextVar('deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when the deadline of a request is exceeded before (or while) it waits for a resource.
+    Name tells where it was exceeded, e.g. 'DB_POOL_TIMEOUT'.
+    """
+
+    def __init__(self, name, message):
+        super().__init__(message)
+        self._name = name
+        self._message = message
+
+    def name(self):
+        return self._name
+
+    def message(self):
+        return self._message
+
+
+def start_deadline(seconds):
+    """
+    Sets the deadline of the current request, seconds from now (None for no deadline). Returns
+    a token to end it with.
+    """
+    return _deadline.set(time.monotonic() + seconds if seconds is not None else None)
+
+
+def end_deadline(token):
+    _deadline.reset(token)
+
+
+def remaining():
+    """
+    Returns seconds left until the deadline of the current request (0 when it is exceeded), or None
+    when there is no deadline, e.g. outside of a request
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0.0)
+
+
+def check_deadline(stage):
+    """
+    Raises DEADLINE_EXCEEDED error when the deadline of the current request is exceeded before
+    the given stage (e.g. 'calling Ice and Fire api') starts
+    """
+    if remaining() == 0:
+        raise DeadlineExceeded('DEADLINE_EXCEEDED', 'Request deadline is exceeded before {}'.format(stage))
+
+
+def timeout(default=None):
+    """
+    Returns the smaller of the default timeout (seconds) and the time left until the deadline,
+    or the default when there is no deadline
+    """
+    left = remaining()
+    if left is None:
+        return default
+    return left if default is None else min(default, left)
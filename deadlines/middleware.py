@@ -0,0 +1,72 @@
+import logging
+import re
+from flask import g, request
+from .deadline import DeadlineExceeded, start_deadline, end_deadline
+logger = logging.getLogger(__name__)
+
+
+def init_app(app, config):
+    """
+    Gives every request a deadline, which db connection checkouts, statements and calls of upstream
+    apis are bounded by. Routes are mapped (by endpoint, or by blueprint name) to seconds, and a
+    client can ask for a shorter or longer deadline (up to max) with the deadline header in milliseconds.
+    Requests exceeding their deadline fail with 504.
+    """
+    if not config.get('enabled', True):
+        return None
+
+    deadlines = Deadlines(config)
+    app.before_request(deadlines.before_request)
+    app.teardown_request(deadlines.teardown_request)
+    app.register_error_handler(DeadlineExceeded, handle_deadline_exceeded)
+    return deadlines
+
+
+class Deadlines:
+
+    def __init__(self, config):
+        self._default = config.get('default', 10.0)
+        self._max = config.get('max', 30.0)
+        self._header = config.get('header', 'X-Request-Timeout-Ms')
+        self._routes = config.get('routes', {})
+
+    def deadline_of(self, endpoint):
+        """
+        Returns seconds of the deadline of the route of given endpoint, None for no deadline
+        """
+        if endpoint in self._routes:
+            return self._routes[endpoint]
+        blueprint = endpoint.split('.', 1)[0] if endpoint else None
+        return self._routes.get(blueprint, self._default)
+
+    def before_request(self):
+        seconds = self.deadline_of(request.endpoint)
+        if seconds is None:
+            return None
+
+        given = request.headers.get(self._header, '').strip()
+        if given:
+            # Only ascii digits, str.isdigit() accepts e.g. superscripts which int() does not
+            if not re.fullmatch(r'[0-9]+', given) or int(given) == 0:
+                return {
+                    'code': 400,
+                    'name': 'INVALID_DEADLINE',
+                    'description': '{} must be a positive number of milliseconds'.format(self._header)
+                }, 400
+            seconds = min(int(given) / 1000, self._max)
+        g.deadline_token = start_deadline(seconds)
+        return None
+
+    def teardown_request(self, exc):
+        token = g.pop('deadline_token', None)
+        if token is not None:
+            end_deadline(token)
+
+
+def handle_deadline_exceeded(err):
+    logger.warning('%s %s failed: %s', request.method, request.path, err.message())
+    return {
+        'code': 504,
+        'name': err.name(),
+        'description': err.message()
+    }, 504
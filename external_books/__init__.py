@@ -1,2 +1,2 @@
 from .routes import createBlueprint
-from .external_book import ExternalBookRepo, ExternalBook, ExternalBookError
+from .external_book import ExternalBookRepo, ExternalBook, ExternalBookError, ExternalCatalog
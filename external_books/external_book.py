@@ -1,13 +1,32 @@
 import requests
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from urllib.parse import urlparse, parse_qs
 import logging
+import lifecycle
+from deadlines import check_deadline, timeout
+from tracing import span, current_request_id
 logger = logging.getLogger(__name__)
 
 
 class ExternalBookRepo:
+    """
+    Finds books of the Ice and Fire api. Connecting to and reading from the api are bounded by the
+    configured timeouts, and by the time left until the request deadline. The read timeout bounds
+    every read of the socket, hence the response is streamed and the whole call is bounded too.
+    """
 
-    def __init__(self, config):
+    chunk_size = 8192
+
+    def __init__(self, config, session=None):
         self._config = config
+        self._session = session or HttpSession()
+        self._connect_timeout = config.get('connect_timeout', 3.05)
+        self._read_timeout = config.get('read_timeout', 10.0)
 
     def find_books_by_name(self, name):
         if name is None or len(name.strip()) == 0:
@@ -19,24 +38,194 @@ class ExternalBookRepo:
             # if we don't pass the header, we may access updated version of the api which
             # may break ( if it has any change in url / response)
             headers = {'Accept': 'application/vnd.anapioficeandfire+json; version=1'}
-            res = requests.get(
-                '{}/books'.format(self._config['ice_and_fire_api_base_url']),
-                params=params,
-                headers=headers)
-
-            if res.status_code != 200:
-                raise ExternalBookError('UNABLE_TO_FETCH_BOOK', None,
-                                        'Unable to fetch book with name: {} as it returns status: {}'.format(
-                                            name, res.status_code))
+            request_id = current_request_id()
+            if request_id:
+                headers['X-Request-ID'] = request_id
+            check_deadline('calling Ice and Fire api')
+            budget = timeout(self._connect_timeout + self._read_timeout)
+            deadline = time.monotonic() + budget
+            with span('upstream', 'Ice and Fire api'):
+                res = self._session.get(
+                    '{}/books'.format(self._config['ice_and_fire_api_base_url']),
+                    params=params,
+                    headers=headers,
+                    timeout=(timeout(self._connect_timeout), timeout(self._read_timeout)),
+                    stream=True)
+                try:
+                    if res.status_code != 200:
+                        raise ExternalBookError('UNABLE_TO_FETCH_BOOK', None,
+                                                'Unable to fetch book with name: {} as it returns status: {}'.format(
+                                                    name, res.status_code))
+                    body = self._read_body(res, deadline, budget)
+                finally:
+                    res.close()
 
-            books = res.json()
+            books = json.loads(body)
             if len(books) == 0:
                 return None
 
             return ExternalBook._from_api(books[0])
+        except requests.exceptions.Timeout as err:
+            raise ExternalBookError('UPSTREAM_TIMEOUT', err,
+                                    'Ice and Fire api did not respond to book name: {} in time'.format(name))
         except requests.exceptions.RequestException as err:
             raise ExternalBookError('ICE_AND_FIRE_API_EXCEPTION', err)
 
+    def _read_body(self, res, deadline, budget):
+        """
+        Returns the body of a streamed response, raising a timeout when it is not read until the
+        deadline, e.g. when the api trickles bytes slower than the read timeout
+        """
+        chunks = []
+        for chunk in res.iter_content(self.chunk_size):
+            if time.monotonic() > deadline:
+                raise requests.exceptions.ReadTimeout('Response is not read in {:.2f} seconds'.format(budget))
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+
+class ExternalCatalog:
+    """
+    Reads all books of the Ice and Fire api page by page. Pages after the first one are fetched
+    concurrently by max_workers threads, not faster than rate_limit requests per second. Every page
+    is revalidated with the ETag / Last-Modified of its last response, so that an unchanged page
+    costs a 304 without a body.
+    """
+
+    headers = {'Accept': 'application/vnd.anapioficeandfire+json; version=1'}
+
+    def __init__(self, config, session=None, page_size=50, max_workers=4, rate_limit=5.0, timeout=10.0):
+        self._config = config
+        self._session = session or HttpSession()
+        self._page_size = page_size
+        self._max_workers = max_workers
+        self._rate_limiter = RateLimiter(rate_limit)
+        self._timeout = timeout
+        # Page -> (validators, books, last page) of its last 200 response
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def fetch_books(self):
+        """
+        Returns all books of the catalog, and counts of requests and of pages which were not modified
+        """
+        stats = {'requests': 0, 'not_modified': 0}
+        books, last_page = self._fetch_page(1, stats)
+        if last_page > 1:
+            with ThreadPoolExecutor(min(self._max_workers, last_page - 1), 'external-catalog') as executor:
+                for page_books, _ in executor.map(lambda page: self._fetch_page(page, stats), range(2, last_page + 1)):
+                    books.extend(page_books)
+        return [ExternalBook._from_api(book) for book in books], stats
+
+    def _fetch_page(self, page, stats):
+        """
+        Returns books of a page, and the number of the last page
+        """
+        with self._lock:
+            validators, cached, last_page = self._pages.get(page, ({}, None, page))
+        headers = dict(self.headers)
+        if cached is not None:
+            if 'ETag' in validators:
+                headers['If-None-Match'] = validators['ETag']
+            if 'Last-Modified' in validators:
+                headers['If-Modified-Since'] = validators['Last-Modified']
+
+        self._rate_limiter.acquire()
+        try:
+            with span('upstream', 'Ice and Fire api'):
+                res = self._session.get('{}/books'.format(self._config['ice_and_fire_api_base_url']),
+                                        params={'page': page, 'pageSize': self._page_size}, headers=headers,
+                                        timeout=self._timeout)
+        except requests.exceptions.RequestException as err:
+            raise ExternalBookError('ICE_AND_FIRE_API_EXCEPTION', err,
+                                    'Unable to fetch page: {} of books due to error: {}'.format(page, err))
+
+        with self._lock:
+            stats['requests'] += 1
+            if res.status_code == 304 and cached is not None:
+                stats['not_modified'] += 1
+                # A 304 need not repeat the Link header
+                books, last_page = cached, self._last_page(res, last_page)
+            elif res.status_code == 200:
+                books, last_page = res.json(), self._last_page(res, page)
+                validators = {name: res.headers[name] for name in ('ETag', 'Last-Modified') if name in res.headers}
+                self._pages[page] = (validators, books, last_page)
+            else:
+                raise ExternalBookError('UNABLE_TO_FETCH_BOOK', None,
+                                        'Unable to fetch page: {} of books as it returns status: {}'.format(
+                                            page, res.status_code))
+        return list(books), last_page
+
+    @staticmethod
+    def _last_page(res, default):
+        """
+        Returns the number of the last page given by 'last' link of a response, or the default
+        """
+        last = res.links.get('last', {}).get('url') if res.links else None
+        if last is None:
+            return default
+        pages = parse_qs(urlparse(last).query).get('page')
+        return int(pages[0]) if pages and pages[0].isdigit() else default
+
+
+class RateLimiter:
+    """
+    Spaces calls of acquire() (from any thread) at least 1 / rate seconds apart
+    """
+
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self._interval = 1.0 / rate if rate else 0.0
+        self._clock = clock
+        self._sleep = sleep
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = self._clock()
+            wait = self._next - now
+            self._next = max(now, self._next) + self._interval
+        if wait > 0:
+            self._sleep(wait)
+
+
+class HttpSession:
+    """
+    A requests session (keeping connections to the api alive) per process.
+    A forked process creates its own session instead of sharing sockets with its parent.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._session = None
+        lifecycle.register(self)
+
+    def _current(self):
+        session = self._session
+        if session is not None and self._pid == os.getpid():
+            return session
+
+        with self._lock:
+            if self._session is None or self._pid != os.getpid():
+                self._session = requests.Session()
+                self._pid = os.getpid()
+            return self._session
+
+    def get(self, url, **kwargs):
+        return self._current().get(url, **kwargs)
+
+    def reset_after_fork(self):
+        if self._pid is not None and self._pid != os.getpid():
+            self._lock = threading.Lock()
+            self._session = None
+
+    def close(self):
+        with self._lock:
+            if self._session is not None and self._pid == os.getpid():
+                self._session.close()
+            self._session = None
+
 
 class ExternalBook:
 
@@ -90,7 +279,7 @@ class ExternalBookError(Exception):
         return self._error
 
     def name(self):
-        return name
+        return self._name
 
     def message(self):
         return self._message
@@ -1,6 +1,8 @@
+import logging
 from flask import Blueprint, request, jsonify
 from urllib.parse import unquote
-from .external_book import ExternalBookRepo
+from .external_book import ExternalBookRepo, ExternalBookError
+logger = logging.getLogger(__name__)
 
 
 def createBlueprint(config):
@@ -11,10 +13,22 @@ def createBlueprint(config):
     external_book_repo = ExternalBookRepo(config)
     external_books_routes = ExternalBookRoutes(external_book_repo)
     blueprint = Blueprint('external_books_api', __name__)
+    blueprint.register_error_handler(ExternalBookError, handle_external_book_error)
     blueprint.add_url_rule('/', view_func=external_books_routes.get_external_book)
     return blueprint
 
 
+def handle_external_book_error(err):
+    # The api timed out or failed, this api itself is fine
+    status_code = 504 if err.name() == 'UPSTREAM_TIMEOUT' else 502
+    logger.error('%s: %s', err.name(), err.message() or err.error())
+    return {
+        'code': status_code,
+        'name': err.name(),
+        'description': err.message() or 'Unable to fetch books from Ice and Fire api'
+    }, status_code
+
+
 class ExternalBookRoutes:
     """
     Defines methods to handle all routes of external book api.
@@ -0,0 +1,69 @@
+"""
+Gunicorn config to run the app in production
+
+    > gunicorn -c gunicorn.conf.py app:app
+
+Every value can be overridden through environment variables prefixed with BOOKSAPI_.
+"""
+import multiprocessing
+import os
+import sys
+
+# Make the app modules importable, regardless of the directory gunicorn is started from
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import config as booksapi_config  # noqa: E402
+import lifecycle  # noqa: E402
+
+
+def _env(name, default, cast=str):
+    value = os.environ.get('BOOKSAPI_' + name)
+    return cast(value) if value is not None else default
+
+
+def _bool(value):
+    return value.lower() in ('1', 'true', 'yes')
+
+
+bind = _env('BIND', '0.0.0.0:5000')
+
+# Threaded workers: a worker per cpu core (and one more to cover a worker blocked on gc / io),
+# and as many threads per worker as db connections in its pool, so that threads don't queue up
+# waiting for a connection.
+worker_class = 'gthread'
+workers = _env('WORKERS', multiprocessing.cpu_count() + 1, int)
+threads = _env('THREADS', booksapi_config.books_api['connection_pool']['maxconn'], int)
+
+# Load the app once in master and fork workers from it, so that workers start fast and share
+# memory pages of imported modules (copy on write). Db pools and http sessions are created by
+# every worker after fork.
+preload_app = _env('PRELOAD_APP', True, _bool)
+lifecycle.set_preloading(preload_app)
+
+# On SIGTERM workers stop accepting connections and get this long to finish in flight requests
+graceful_timeout = _env('GRACEFUL_TIMEOUT', 30, int)
+timeout = _env('TIMEOUT', 30, int)
+keepalive = _env('KEEPALIVE', 5, int)
+
+# Recycle workers now and then to bound memory growth
+max_requests = _env('MAX_REQUESTS', 10000, int)
+max_requests_jitter = _env('MAX_REQUESTS_JITTER', 1000, int)
+
+accesslog = _env('ACCESS_LOG', '-')
+
+
+def when_ready(server):
+    # Resources opened by master while preloading the app are never used by workers
+    lifecycle.shutdown()
+
+
+def post_fork(server, worker):
+    lifecycle.after_fork()
+    # Open db pools in background while the worker starts serving. Without preload_app, the app is
+    # not loaded yet and warms up itself when it is created.
+    lifecycle.warm_up()
+
+
+def worker_exit(server, worker):
+    # Runs after in flight requests are drained
+    lifecycle.shutdown()
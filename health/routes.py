@@ -0,0 +1,37 @@
+from flask import Blueprint
+import lifecycle
+
+
+def createBlueprint():
+    """
+    Creates a Blueprint with liveness and readiness end points.
+    """
+    health_routes = HealthRoutes()
+    blueprint = Blueprint('health', __name__)
+    blueprint.add_url_rule('/live', view_func=health_routes.live)
+    blueprint.add_url_rule('/ready', view_func=health_routes.ready)
+    return blueprint
+
+
+class HealthRoutes:
+
+    def live(self):
+        return {
+            'status_code': 200,
+            'status': 'success'
+        }
+
+    def ready(self):
+        """
+        Reports warm up state of db pools. A pool which is not warmed up yet (or failed to)
+        is warmed up in background, so that a later probe can report it as ready.
+        """
+        ready, resources = lifecycle.readiness()
+        if not ready:
+            lifecycle.warm_up()
+        status_code = 200 if ready else 503
+        return {
+            'status_code': status_code,
+            'status': 'success' if ready else 'error',
+            'data': resources
+        }, status_code
@@ -0,0 +1 @@
+from .codec import dumps, loads, use, backend_name, Fragments
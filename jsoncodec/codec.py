@@ -0,0 +1,101 @@
+import json
+import logging
+from datetime import date
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj):
+    # Same as orjson, dates are encoded in ISO 8601 format
+    if isinstance(obj, date):
+        return obj.isoformat()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
+
+
+class StdlibBackend:
+    name = 'stdlib'
+
+    def dumps(self, obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonBackend:
+    name = 'orjson'
+
+    def dumps(self, obj):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+_backend = OrjsonBackend() if orjson else StdlibBackend()
+
+
+def use(name):
+    """
+    Selects json backend: 'orjson', 'stdlib' or 'auto' (orjson when it is installed)
+    """
+    global _backend
+    if name == 'auto':
+        _backend = OrjsonBackend() if orjson else StdlibBackend()
+    elif name == 'orjson':
+        if orjson is None:
+            raise ValueError('orjson json backend is selected, but orjson is not installed')
+        _backend = OrjsonBackend()
+    elif name == 'stdlib':
+        _backend = StdlibBackend()
+    else:
+        raise ValueError('Unknown json backend: {}'.format(name))
+    logger.debug('Using %s json backend', _backend.name)
+
+
+def backend_name():
+    return _backend.name
+
+
+class Fragments:
+    """
+    A list of already encoded json values (bytes). When a dict value is Fragments,
+    dumps() splices the encoded values into the output as they are, instead of
+    encoding them again.
+    """
+
+    def __init__(self, items):
+        self.items = items
+
+    def __len__(self):
+        return len(self.items)
+
+    def encode(self):
+        return b'[' + b','.join(self.items) + b']'
+
+
+def dumps(obj):
+    """
+    Encodes given object into json bytes
+    """
+    if isinstance(obj, dict):
+        spliced = [key for key, value in obj.items() if isinstance(value, Fragments)]
+        if spliced:
+            return _dumps_with_fragments(obj, spliced)
+    return _backend.dumps(obj)
+
+
+def _dumps_with_fragments(obj, spliced):
+    rest = {key: value for key, value in obj.items() if key not in spliced}
+    encoded = _backend.dumps(rest)
+    parts = [_backend.dumps(key) + b':' + obj[key].encode() for key in spliced]
+    separator = b',' if rest else b''
+    return encoded[:-1] + separator + b','.join(parts) + b'}'
+
+
+def loads(data):
+    return _backend.loads(data)
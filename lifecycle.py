@@ -0,0 +1,96 @@
+"""
+Tracks process wide resources (connection pools, http sessions) which must not be shared
+between processes, so that they can be recreated after a fork and closed on shutdown.
+
+A resource implements:
+    reset_after_fork(): forgets resources inherited from the parent process
+    close(): releases resources opened by the current process
+and optionally, when it can be opened ahead of first use:
+    name: name reported by readiness()
+    warm_up(): opens the resource
+    state(): returns ('cold' | 'warming' | 'ready' | 'failed', error)
+"""
+import logging
+import os
+import threading
+logger = logging.getLogger(__name__)
+
+_resources = []
+_lock = threading.Lock()
+# True in a server process which imports the app only to fork workers from it (gunicorn master
+# with preload_app), the workers warm up after fork instead
+_preloading = False
+
+
+def register(resource):
+    with _lock:
+        _resources.append(resource)
+    return resource
+
+
+def after_fork():
+    """
+    Called in a child process right after fork
+    """
+    for resource in list(_resources):
+        resource.reset_after_fork()
+
+
+def shutdown():
+    """
+    Closes all resources of the current process
+    """
+    for resource in list(_resources):
+        try:
+            resource.close()
+        except Exception as err:
+            logger.error('Unable to close %s due to error: %s', resource, err)
+
+
+def warm_up(background=True):
+    """
+    Warms up resources which are not ready yet, in a background thread by default
+    """
+    resources = [resource for resource in list(_resources)
+                 if hasattr(resource, 'warm_up') and resource.state()[0] in ('cold', 'failed')]
+    if not resources:
+        return
+
+    def run():
+        for resource in resources:
+            resource.warm_up()
+
+    if background:
+        threading.Thread(target=run, name='warm-up', daemon=True).start()
+    else:
+        run()
+
+
+def set_preloading(preloading):
+    global _preloading
+    _preloading = preloading
+
+
+def start():
+    """
+    Called when the app is created: warms up resources in background, unless the app is being
+    preloaded to fork workers from it
+    """
+    if not _preloading:
+        warm_up()
+
+
+def readiness():
+    """
+    Returns (True when all resources are ready, resource name -> {'state': .., 'error': ..})
+    """
+    states = {}
+    for resource in list(_resources):
+        if hasattr(resource, 'warm_up'):
+            state, error = resource.state()
+            states[resource.name] = {'state': state, 'error': error}
+    return all(state['state'] == 'ready' for state in states.values()), states
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=after_fork)
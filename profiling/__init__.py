@@ -0,0 +1,3 @@
+from .sampler import StackSampler
+from .request_profiler import RequestProfiler
+from .routes import createBlueprint, init_app
@@ -0,0 +1,61 @@
+import cProfile
+import logging
+import os
+import random
+import re
+import time
+import uuid
+from flask import g, request
+from tracing import current_request_id
+import admin
+logger = logging.getLogger(__name__)
+
+
+class RequestProfiler:
+    """
+    Runs selected requests under cProfile and dumps their stats into a directory.
+    A request is profiled either when it carries the profiling header with the admin token,
+    or when it is picked by the configured sample rate.
+    """
+
+    def __init__(self, config):
+        self._token = config.get('admin_token')
+        self._header = config.get('header', 'X-Profile')
+        self._sample_rate = config.get('sample_rate', 0.0)
+        self._output_dir = config.get('output_dir', 'profiles')
+
+    def should_profile(self):
+        value = request.headers.get(self._header)
+        if admin.is_admin_token(value, self._token):
+            return True
+        return self._sample_rate > 0 and random.random() < self._sample_rate
+
+    def before_request(self):
+        if not self.should_profile():
+            return
+        profiler = cProfile.Profile()
+        g.request_profiler = profiler
+        profiler.enable()
+
+    def after_request(self, response):
+        profiler = g.pop('request_profiler', None)
+        if profiler is None:
+            return response
+
+        profiler.disable()
+        try:
+            response.headers['X-Profile-File'] = os.path.basename(self._dump(profiler))
+        except OSError as err:
+            logger.error('Unable to dump profile stats due to error: %s', err)
+        return response
+
+    def _dump(self, profiler):
+        os.makedirs(self._output_dir, exist_ok=True)
+        path_name = re.sub(r'[^A-Za-z0-9]+', '_', request.path).strip('_') or 'root'
+        file_name = '{}-{}-{}-{}.pstats'.format(
+            time.strftime('%Y%m%d%H%M%S'), current_request_id() or uuid.uuid4().hex,
+            request.method.lower(), path_name)
+        path = os.path.join(self._output_dir, file_name)
+        profiler.dump_stats(path)
+        logger.info('Dumped profile stats of %s %s into %s', request.method, request.path, path)
+        return path
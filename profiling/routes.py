@@ -0,0 +1,58 @@
+from flask import Blueprint
+import admin
+from .sampler import StackSampler
+from .request_profiler import RequestProfiler
+
+
+def init_app(app, config):
+    """
+    Enables per request profiling and mounts the admin sampler end points.
+    Nothing is installed unless profiling is enabled in the config.
+    """
+    if not config.get('enabled', False):
+        return
+
+    request_profiler = RequestProfiler(config)
+    app.before_request(request_profiler.before_request)
+    app.after_request(request_profiler.after_request)
+    app.register_blueprint(createBlueprint(config), url_prefix='/admin/profiler')
+
+
+def createBlueprint(config):
+    sampler = StackSampler(config.get('sampler_interval', 0.005), config.get('sampler_max_seconds', 60))
+    profiler_routes = ProfilerRoutes(sampler, config.get('admin_token'))
+
+    blueprint = Blueprint('profiler_admin', __name__)
+    blueprint.before_request(profiler_routes.authorize)
+    blueprint.add_url_rule('/sampler/start', view_func=profiler_routes.start_sampler, methods=['POST'])
+    blueprint.add_url_rule('/sampler/stop', view_func=profiler_routes.stop_sampler, methods=['POST'])
+    return blueprint
+
+
+class ProfilerRoutes:
+    """
+    Admin end points to start / stop the statistical sampler.
+    """
+
+    def __init__(self, sampler, admin_token):
+        self._sampler = sampler
+        self._admin_token = admin_token
+
+    def authorize(self):
+        admin.authorize(self._admin_token)
+
+    def start_sampler(self):
+        started = self._sampler.start()
+        return {
+            'status_code': 200 if started else 409,
+            'status': 'success' if started else 'error',
+            'message': 'Sampler has been started' if started else 'Sampler is already running'
+        }, 200 if started else 409
+
+    def stop_sampler(self):
+        """
+        Stops the sampler and returns collapsed stacks, ready to be rendered as a flamegraph
+        """
+        collapsed = self._sampler.stop()
+        return collapsed, 200, {'Content-Type': 'text/plain; charset=utf-8',
+                                'X-Samples': str(self._sampler.samples)}
@@ -0,0 +1,86 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class StackSampler:
+    """
+    A statistical profiler which periodically samples the stacks of all threads.
+    The result is returned in collapsed stack format ('frame;frame;frame count' per line),
+    which can be fed into flamegraph.pl or speedscope as is.
+    """
+
+    def __init__(self, interval=0.005, max_seconds=60):
+        self._interval = interval
+        self._max_seconds = max_seconds
+        self._counts = Counter()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._samples = 0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return False
+            self._counts = Counter()
+            self._samples = 0
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """
+        Stops sampling and returns collected stacks in collapsed format
+        """
+        self._stop_event.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+        return self.collapsed()
+
+    def collapsed(self):
+        with self._lock:
+            counts = list(self._counts.items())
+        return ''.join('{} {}\n'.format(stack, count) for stack, count in sorted(counts))
+
+    @property
+    def samples(self):
+        return self._samples
+
+    def _run(self):
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + self._max_seconds
+        while not self._stop_event.wait(self._interval):
+            if time.monotonic() > deadline:
+                break
+            self.sample(own_id)
+
+    def sample(self, skip_thread_id=None):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        stacks = []
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == skip_thread_id:
+                continue
+            stacks.append(self._collapse(names.get(thread_id, str(thread_id)), frame))
+
+        with self._lock:
+            self._counts.update(stacks)
+            self._samples += 1
+
+    @staticmethod
+    def _collapse(thread_name, frame):
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+            frame = frame.f_back
+        frames.append(thread_name)
+        return ';'.join(reversed(frames))
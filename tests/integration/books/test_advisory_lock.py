@@ -0,0 +1,21 @@
+import config_qa
+from books.advisory_lock import AdvisoryLock
+
+
+class TestAdvisoryLock:
+
+    def test_held_by_a_single_session(self):
+        first = AdvisoryLock(config_qa.books_api['connection_pool'], 'booksapi.test')
+        second = AdvisoryLock(config_qa.books_api['connection_pool'], 'booksapi.test')
+        try:
+            assert first.acquire()
+            assert first.acquire()
+            assert not second.acquire()
+            assert not second.held()
+
+            # Taken over when its holder is closed
+            first.close()
+            assert second.acquire()
+        finally:
+            first.close()
+            second.close()
@@ -1,7 +1,10 @@
 import pytest
 import config_qa
 from psycopg2 import pool
-from books import BookRepo
+from books import BookRepo, BookStatsRepo, BookError
+from books.writer import GroupCommitWriter
+from books.storage import PostgresStorage
+import threading
 from datetime import datetime
 
 
@@ -19,7 +22,7 @@ class TestBook:
         if not cpool:
             raise ValueError('Unable to create a connection pool.')
 
-        return BookRepo(cpool)
+        return BookRepo(PostgresStorage(cpool))
 
     def test_create_book(self, book_repo):
         # Create a new book
@@ -44,7 +47,7 @@ class TestBook:
         # Update the book
         update_book_info = {
             'name': 'Water World',
-            'isbn': '123-11111',
+            'isbn': '123-' + self.current_time_str(),
             'authors': ['George William'],
             'country': 'United Kingdom',
             'number_of_pages': 123,
@@ -107,6 +110,122 @@ class TestBook:
         books = book_repo.get_books(publisher=new_book_infoset[0]['publisher'], country=new_book_infoset[0]['country'])
         assert len(books) >= 2
 
+    def test_get_books_with_fields(self, book_repo):
+        book_info = self.new_book_info()
+        new_book = book_repo.get_empty_book()
+        new_book.set_values(**book_info)
+        new_book.save()
+
+        books = book_repo.get_books(fields='name,isbn', name=book_info['name'])
+        assert len(books) == 1
+        assert books[0].values() == {'id': new_book.id, 'name': book_info['name'], 'isbn': book_info['isbn']}
+
+        book = book_repo.get_book(new_book.id, fields=['publisher'])
+        assert book.values() == {'id': new_book.id, 'publisher': book_info['publisher']}
+
+    def test_get_books_by_ids(self, book_repo):
+        new_books = []
+        for i in range(2):
+            new_book = book_repo.get_empty_book()
+            new_book.set_values(**self.new_book_info())
+            new_book.save()
+            new_books.append(new_book)
+
+        deleted_book = book_repo.get_empty_book()
+        deleted_book.set_values(**self.new_book_info())
+        deleted_book.save()
+        deleted_book.delete()
+
+        ids = [new_books[1].id, deleted_book.id, new_books[0].id]
+        books, missing_ids = book_repo.get_books_by_ids(ids)
+        assert [book.values() for book in books] == [new_books[1].values(), new_books[0].values()]
+        assert missing_ids == [deleted_book.id]
+
+    def test_update_and_delete_books_by_filters(self, book_repo):
+        publisher = 'Bulk Publisher ' + self.current_time_str()
+        new_books = []
+        for i in range(3):
+            book_info = self.new_book_info()
+            book_info['publisher'] = publisher
+            new_book = book_repo.get_empty_book()
+            new_book.set_values(**book_info)
+            new_book.save()
+            new_books.append(new_book)
+        ids = sorted(new_book.id for new_book in new_books)
+
+        assert book_repo.update_books({'country': 'India'}, publisher=publisher) == ids
+        assert {book.country for book in book_repo.get_books(publisher=publisher)} == {'India'}
+
+        with pytest.raises(BookError) as err:
+            book_repo.delete_books(max_affected=2, publisher=publisher)
+        assert err.value.name() == 'TOO_MANY_BOOKS'
+        assert book_repo.delete_books(dry_run=True, publisher=publisher) == ids
+        assert len(book_repo.get_books(publisher=publisher)) == 3
+
+        assert book_repo.delete_books(publisher=publisher) == ids
+        assert book_repo.get_books(publisher=publisher) == []
+
+    def test_create_same_book_again(self, book_repo):
+        book_info = self.new_book_info()
+        new_book = book_repo.get_empty_book()
+        new_book.set_values(**book_info)
+        assert new_book.save()
+
+        # A retried create finds the same book
+        same_book = book_repo.get_empty_book()
+        same_book.set_values(**book_info)
+        assert not same_book.save()
+        assert same_book.id == new_book.id
+
+        # A different book can not take the same isbn
+        other_book = book_repo.get_empty_book()
+        other_book.set_values(**dict(book_info, name='Another book'))
+        with pytest.raises(BookError) as err:
+            other_book.save()
+        assert err.value.name() == 'DUPLICATE_ISBN'
+
+    def test_get_book_by_isbn(self, book_repo):
+        book_info = self.new_book_info()
+        new_book = book_repo.get_empty_book()
+        new_book.set_values(**book_info)
+        new_book.save()
+
+        book = book_repo.get_book_by_isbn(book_info['isbn'], 'name')
+        assert book.values() == {'id': new_book.id, 'name': book_info['name']}
+        assert book_repo.get_book_by_isbn('no-such-isbn-' + self.current_time_str()) is None
+
+    def test_save_books_with_group_commit(self, book_repo):
+        writer = GroupCommitWriter(book_repo.storage.cpool, max_batch=10, max_delay=0.05)
+        batching_repo = BookRepo(PostgresStorage(book_repo.storage.cpool, writer))
+        new_books = [batching_repo.get_empty_book() for i in range(5)]
+        for new_book in new_books:
+            new_book.set_values(**self.new_book_info())
+
+        threads = [threading.Thread(target=new_book.save) for new_book in new_books]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.close()
+
+        books, missing_ids = book_repo.get_books_by_ids([new_book.id for new_book in new_books])
+        assert [book.values() for book in books] == [new_book.values() for new_book in new_books]
+        assert missing_ids == []
+
+    def test_get_stats(self, book_repo):
+        stats_repo = BookStatsRepo(book_repo.storage.cpool)
+        book_info = self.new_book_info()
+        book_info['country'] = 'Stats Country ' + self.current_time_str()
+        new_book = book_repo.get_empty_book()
+        new_book.set_values(**book_info)
+        new_book.save()
+
+        stats_repo.refresh()
+        by_country = [stats for stats in stats_repo.get_stats_by('country')
+                      if stats['country'] == book_info['country']]
+        assert by_country == [{'country': book_info['country'], 'books': 1, 'pages': 450}]
+        assert stats_repo.get_stats()['total']['books'] >= 1
+
     def new_book_info(self):
         ctime = self.current_time_str()
         book_info = {
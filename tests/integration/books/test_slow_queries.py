@@ -0,0 +1,18 @@
+import config_qa
+from books.slow_queries import QueryExplainer
+
+
+class TestQueryExplainer:
+
+    def test_explain_analyzes_queries_only(self):
+        explainer = QueryExplainer(config_qa.books_api['connection_pool'])
+        try:
+            plan = explainer.explain('SELECT id FROM books WHERE name = %s', ('A Game of thrones',))
+            assert 'Execution Time' in plan[0]
+            assert 'Plan' in plan[0]
+
+            # A write is explained without running it
+            plan = explainer.explain('DELETE FROM books WHERE id = %s', (-1,))
+            assert 'Execution Time' not in plan[0]
+        finally:
+            explainer.close()
@@ -0,0 +1,37 @@
+import pytest
+import config_qa
+from psycopg2 import pool
+from books import ChangeFeed
+from books.storage import PostgresStorage, ReadModelStorage
+from tests.unit.books.storage_contract import BookStorageContract
+
+
+@pytest.fixture(scope='module')
+def cpool():
+    cpool = pool.ThreadedConnectionPool(**config_qa.books_api['connection_pool'])
+    yield cpool
+    cpool.closeall()
+
+
+class TestPostgresStorage(BookStorageContract):
+
+    @pytest.fixture(scope='module')
+    def storage(self, cpool):
+        return PostgresStorage(cpool)
+
+
+class TestPostgresReadModel(BookStorageContract):
+
+    @pytest.fixture(scope='module')
+    def storage(self, cpool):
+        storage = ReadModelStorage(PostgresStorage(cpool), ChangeFeed(cpool, config_qa.books_api['connection_pool']))
+        storage.load()
+        return storage
+
+    def test_changes_of_other_processes_are_applied(self, book_repo, storage):
+        book = self.create_book(book_repo)
+        # Written behind the read model, as if by another process
+        storage.storage.update(book.id, dict(book._column_values(), country='India'))
+        assert book_repo.get_book(book.id).country == 'United States'
+        storage.catch_up()
+        assert book_repo.get_book(book.id).country == 'India'
@@ -0,0 +1,112 @@
+import threading
+import time
+from flask import Flask
+import admission
+import deadlines
+from admission import AdmissionController, Rejected
+import pytest
+
+
+class TestAdmissionController:
+
+    def test_admits_up_to_max_concurrency(self):
+        controller = AdmissionController(2, 0)
+        controller.acquire()
+        controller.acquire()
+        with pytest.raises(Rejected) as err:
+            controller.acquire()
+        assert err.value.reason == 'QUEUE_FULL'
+
+    def test_rejects_after_timeout(self):
+        controller = AdmissionController(1, 1)
+        controller.acquire()
+        start = time.monotonic()
+        with pytest.raises(Rejected) as err:
+            controller.acquire(timeout=0.05)
+        assert err.value.reason == 'QUEUE_TIMEOUT'
+        assert time.monotonic() - start < 1
+        assert controller.queued == 0
+
+    def test_queued_reads_are_admitted_before_writes(self):
+        controller = AdmissionController(1, 10)
+        controller.acquire()
+        admitted = []
+
+        def request(name, priority):
+            controller.acquire(priority, timeout=2)
+            admitted.append(name)
+            controller.release()
+
+        threads = [threading.Thread(target=request, args=('write', 1))]
+        threads[0].start()
+        while controller.queued < 1:
+            time.sleep(0.001)
+        threads.append(threading.Thread(target=request, args=('read', 0)))
+        threads[1].start()
+        while controller.queued < 2:
+            time.sleep(0.001)
+
+        controller.release()
+        for thread in threads:
+            thread.join()
+        assert admitted == ['read', 'write']
+        assert controller.active == 0
+
+
+class TestAdmissionMiddleware:
+
+    def test_rejects_with_503_and_retry_after(self):
+        app = Flask(__name__)
+        admission.init_app(app, {
+            'retry_after': 3,
+            'groups': {'db': {'max_concurrency': 1, 'max_queue': 0}},
+            'routes': {'slow': 'db'}
+        })
+        entered = threading.Event()
+        leave = threading.Event()
+
+        @app.route('/slow')
+        def slow():
+            entered.set()
+            leave.wait(2)
+            return {'status': 'success'}
+
+        responses = []
+        thread = threading.Thread(target=lambda: responses.append(app.test_client().get('/slow')))
+        thread.start()
+        entered.wait(2)
+
+        resp = app.test_client().get('/slow')
+        assert resp.status_code == 503
+        assert resp.headers['Retry-After'] == '3'
+        leave.set()
+        thread.join()
+        assert responses[0].status_code == 200
+        # The slot is released after the request
+        assert app.test_client().get('/slow').status_code == 200
+
+    def test_queue_wait_is_bounded_by_deadline(self):
+        app = Flask(__name__)
+        deadlines.init_app(app, {'default': 0.1})
+        admission.init_app(app, {
+            'groups': {'db': {'max_concurrency': 1, 'max_queue': 1, 'queue_timeout': 5.0}},
+            'routes': {'slow': 'db'}
+        })
+        entered = threading.Event()
+        leave = threading.Event()
+
+        @app.route('/slow')
+        def slow():
+            entered.set()
+            leave.wait(2)
+            return {'status': 'success'}
+
+        thread = threading.Thread(target=lambda: app.test_client().get('/slow'))
+        thread.start()
+        entered.wait(2)
+
+        start = time.monotonic()
+        assert app.test_client().get('/slow').status_code == 503
+        assert time.monotonic() - start < 1.0
+        leave.set()
+        thread.join()
@@ -0,0 +1,17 @@
+from benchmarks import report
+import pytest
+
+
+class TestReport:
+
+    @pytest.mark.parametrize('pct, expected', [(50, 5), (99, 10), (100, 10), (1, 1)])
+    def test_percentile(self, pct, expected):
+        assert report.percentile(list(range(10, 0, -1)), pct) == expected
+
+    def test_compare_reports_regressions(self):
+        baseline = {'results': {'list_books': {'p99_ms': 10.0, 'throughput_rps': 100.0, 'count': 10}}}
+        current = {'results': {'list_books': {'p99_ms': 10.5, 'throughput_rps': 80.0, 'count': 20}}}
+
+        rows = {(name, metric): regressed for name, metric, _, _, _, regressed in report.compare(baseline, current)}
+        # count is neither a cost nor a throughput, hence it is not compared
+        assert rows == {('list_books', 'p99_ms'): False, ('list_books', 'throughput_rps'): True}
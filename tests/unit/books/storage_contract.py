@@ -0,0 +1,195 @@
+from books import BookRepo, BookError
+import json
+import uuid
+import pytest
+
+
+class BookStorageContract:
+    """
+    Behaviour every storage of books must have. A test class of a storage derives from this
+    class and provides a 'storage' fixture. Values are unique per test, so that the tests can
+    run against a db having other books.
+    """
+
+    @pytest.fixture
+    def book_repo(self, storage):
+        return BookRepo(storage)
+
+    def new_book_info(self, **values):
+        book_info = {
+            'name': 'A Game of thrones',
+            'isbn': uuid.uuid4().hex,
+            'authors': ['John Doe'],
+            'country': 'United States',
+            'number_of_pages': 450,
+            'publisher': 'Publisher ' + uuid.uuid4().hex,
+            'release_date': '2019-01-01'
+        }
+        book_info.update(values)
+        return book_info
+
+    def create_book(self, book_repo, **values):
+        book = book_repo.get_empty_book()
+        book.set_values(**self.new_book_info(**values))
+        assert book.save()
+        return book
+
+    def test_create_and_get_book(self, book_repo):
+        book_info = self.new_book_info()
+        book = book_repo.get_empty_book()
+        book.set_values(**book_info)
+        assert book.save()
+        assert book.id > 0
+
+        assert book_repo.get_book(book.id).values() == dict(book_info, id=book.id)
+        assert book_repo.get_book(book.id, 'name,release_date').values() == {
+            'id': book.id, 'name': book_info['name'], 'release_date': book_info['release_date']}
+
+    def test_get_missing_book(self, book_repo):
+        book = self.create_book(book_repo)
+        book.delete()
+        assert book_repo.get_book(book.id) is None
+
+    def test_update_book(self, book_repo):
+        book = self.create_book(book_repo)
+        book.set_values(name='Water World', authors=['George William'], number_of_pages=123,
+                        release_date='2017-01-07')
+        assert book.save()
+        assert book_repo.get_book(book.id).values() == book.values()
+
+    def test_get_books_by_filters(self, book_repo):
+        publisher = 'Publisher ' + uuid.uuid4().hex
+        first = self.create_book(book_repo, publisher=publisher, release_date='1996-08-01')
+        second = self.create_book(book_repo, publisher=publisher, release_date='1998-11-02', country='India')
+        self.create_book(book_repo)
+
+        books = book_repo.get_books(publisher=publisher)
+        assert sorted(book.id for book in books) == [first.id, second.id]
+        assert [book.values() for book in book_repo.get_books(publisher=publisher, release_date=1996)] == \
+            [first.values()]
+        assert [book.values() for book in book_repo.get_books('name', publisher=publisher, country='India')] == \
+            [{'id': second.id, 'name': second.name}]
+
+    def test_get_sorted_books(self, book_repo):
+        publisher = 'Publisher ' + uuid.uuid4().hex
+        old = self.create_book(book_repo, publisher=publisher, release_date='1996-08-01', name='B')
+        new = self.create_book(book_repo, publisher=publisher, release_date='2011-07-12', name='A')
+        same_day = self.create_book(book_repo, publisher=publisher, release_date='2011-07-12', name='C')
+
+        books = book_repo.get_books(sort='-release_date', publisher=publisher)
+        assert [book.id for book in books] == [same_day.id, new.id, old.id]
+        books = book_repo.get_books('name', '-release_date,name', 2, publisher=publisher)
+        assert [book.values() for book in books] == [{'id': new.id, 'name': 'A'}, {'id': same_day.id, 'name': 'C'}]
+        assert [book.id for book in book_repo.get_books(sort='name', limit=1, publisher=publisher)] == [new.id]
+        assert [book.id for book in book_repo.get_books(limit=2, publisher=publisher)] == [old.id, new.id]
+
+    def test_get_books_with_facets(self, book_repo):
+        publisher = 'Publisher ' + uuid.uuid4().hex
+        old = self.create_book(book_repo, publisher=publisher, release_date='1996-08-01', country='India')
+        new = self.create_book(book_repo, publisher=publisher, release_date='2011-07-12', country='Nepal')
+        self.create_book(book_repo, publisher=publisher, release_date=None, country='Nepal')
+
+        books, facets = book_repo.get_books_with_facets_encoded('release_year, country', 'id', 'release_date', 2,
+                                                                publisher=publisher)
+        assert [json.loads(book) for book in books] == [{'id': old.id}, {'id': new.id}]
+        assert facets == {
+            'country': [{'country': 'Nepal', 'books': 2}, {'country': 'India', 'books': 1}],
+            'release_year': [{'release_year': 1996, 'books': 1}, {'release_year': 2011, 'books': 1},
+                             {'release_year': None, 'books': 1}]
+        }
+
+        books, facets = book_repo.get_books_with_facets_encoded('publisher', publisher=publisher, country='India')
+        assert [json.loads(book)['id'] for book in books] == [old.id]
+        assert facets == {'publisher': [{'publisher': publisher, 'books': 1}]}
+        assert book_repo.get_books_with_facets_encoded('country', name=uuid.uuid4().hex) == ([], {'country': []})
+
+    def test_update_each(self, book_repo):
+        first = self.create_book(book_repo)
+        second = self.create_book(book_repo, release_date=None)
+        missing = self.create_book(book_repo)
+        missing.delete()
+
+        ids = book_repo.update_each({
+            first.id: {'number_of_pages': 694, 'release_date': '1996-08-01'},
+            second.id: {'number_of_pages': 768, 'release_date': '1998-11-16'},
+            missing.id: {'publisher': 'Bantam Books'},
+        })
+        assert ids == [first.id, second.id]
+        assert book_repo.get_book(first.id).values() == dict(first.values(), number_of_pages=694,
+                                                             release_date='1996-08-01')
+        assert book_repo.get_book(second.id).values() == dict(second.values(), number_of_pages=768,
+                                                              release_date='1998-11-16')
+
+        assert book_repo.update_each({first.id: {'authors': ['George R. R. Martin']}}) == [first.id]
+        assert book_repo.get_book(first.id).authors == ['George R. R. Martin']
+        with pytest.raises(BookError) as err:
+            book_repo.update_each({first.id: {'number_of_pages': -1}})
+        assert err.value.name() == 'INVALID_PROPERTY'
+
+    def test_get_books_encoded(self, book_repo):
+        book = self.create_book(book_repo)
+        encoded = book_repo.get_books_encoded(None, publisher=book.publisher)
+        assert encoded == [book.json()]
+
+    def test_get_book_by_isbn(self, book_repo):
+        book = self.create_book(book_repo)
+        assert book_repo.get_book_by_isbn(book.isbn).values() == book.values()
+        assert book_repo.get_book_by_isbn(uuid.uuid4().hex) is None
+
+    def test_get_books_by_ids(self, book_repo):
+        first = self.create_book(book_repo)
+        second = self.create_book(book_repo)
+        deleted = self.create_book(book_repo)
+        deleted.delete()
+
+        books, missing_ids = book_repo.get_books_by_ids([second.id, deleted.id, first.id])
+        assert [book.values() for book in books] == [second.values(), first.values()]
+        assert missing_ids == [deleted.id]
+
+    def test_create_same_book_again(self, book_repo):
+        book = self.create_book(book_repo)
+        same_book = book_repo.get_empty_book()
+        same_book.set_values(**book.values())
+        assert not same_book.save()
+        assert same_book.id == book.id
+
+        other_book = book_repo.get_empty_book()
+        other_book.set_values(**dict(book.values(), name='Another book'))
+        with pytest.raises(BookError) as err:
+            other_book.save()
+        assert err.value.name() == 'DUPLICATE_ISBN'
+
+    def test_update_to_existing_isbn(self, book_repo):
+        first = self.create_book(book_repo)
+        second = self.create_book(book_repo)
+        second.isbn = first.isbn
+        with pytest.raises(BookError) as err:
+            second.save()
+        assert err.value.name() == 'DUPLICATE_ISBN'
+
+    def test_create_book_without_authors(self, book_repo):
+        book = book_repo.get_empty_book()
+        book.set_values(**self.new_book_info(authors=[]))
+        assert book.save()
+        assert book_repo.get_book(book.id).authors == []
+
+    def test_update_and_delete_books_by_filters(self, book_repo):
+        publisher = 'Publisher ' + uuid.uuid4().hex
+        ids = sorted(self.create_book(book_repo, publisher=publisher).id for i in range(3))
+
+        assert book_repo.update_books({'country': 'India'}, dry_run=True, publisher=publisher) == ids
+        assert {book.country for book in book_repo.get_books(publisher=publisher)} == {'United States'}
+        assert book_repo.update_books({'country': 'India'}, publisher=publisher) == ids
+        assert {book.country for book in book_repo.get_books(publisher=publisher)} == {'India'}
+
+        with pytest.raises(BookError) as err:
+            book_repo.update_books({'isbn': uuid.uuid4().hex}, publisher=publisher)
+        assert err.value.name() == 'DUPLICATE_ISBN'
+
+        with pytest.raises(BookError) as err:
+            book_repo.delete_books(max_affected=2, publisher=publisher)
+        assert err.value.name() == 'TOO_MANY_BOOKS'
+        assert len(book_repo.get_books(publisher=publisher)) == 3
+
+        assert book_repo.delete_books(publisher=publisher) == ids
+        assert book_repo.get_books(publisher=publisher) == []
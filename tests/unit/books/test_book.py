@@ -1,5 +1,7 @@
 from books import BookRepo, DbBook, BookError
+from books.book import EncodedBookCache
 from collections import OrderedDict
+import json
 from datetime import datetime, date
 import pytest
 
@@ -24,6 +26,17 @@ class TestDbBook:
         book = DbBook._from_db_row(None, row)
         assert book.values() == expected, 'Expected: {}, but got {}'.format(expected, book.values())
 
+    def test_from_partial_db_row(self):
+        """
+        Tests if a row having only some columns is converted into a book having only those fields
+        """
+        row = (1, 'A Game of thrones', '123-45678')
+        book = DbBook._from_db_row(None, row, ('id', 'name', 'isbn'))
+        assert book.values() == {'id': 1, 'name': 'A Game of thrones', 'isbn': '123-45678'}
+
+        with pytest.raises(BookError):
+            book.save()
+
     def test_set_values(self):
         """
         Tests if set_values() sets given values into appropriate fields.
@@ -85,3 +98,33 @@ class TestDbBook:
         with pytest.raises(BookError) as err:
             book = DbBook(None)
             book.set_values(**values)
+
+    def test_set_values_rejects_unknown_fields(self):
+        book = DbBook(None)
+        with pytest.raises(BookError) as err:
+            book.set_values(name='A Game of thrones', title='A Game of thrones')
+        assert err.value.details() == {'title': 'title is not a field of a book'}
+        assert book.name == ''
+
+
+class TestEncodedBookCache:
+
+    row = (1, 'A Game of thrones', '123-45678', '["John Doe"]', 'United States', 450, 'ORielly', date(2019, 1, 1))
+
+    def test_reuses_encoded_book_of_unchanged_row(self):
+        cache = EncodedBookCache(10)
+        encoded = cache.get_or_encode(None, self.row)
+        assert json.loads(encoded) == DbBook._from_db_row(None, self.row).values()
+        assert cache.get_or_encode(None, self.row) is encoded
+
+    def test_encodes_again_when_row_is_changed(self):
+        cache = EncodedBookCache(10)
+        cache.get_or_encode(None, self.row)
+        changed_row = self.row[:5] + (500,) + self.row[6:]
+        assert json.loads(cache.get_or_encode(None, changed_row))['number_of_pages'] == 500
+
+    def test_evicts_least_recently_used(self):
+        cache = EncodedBookCache(2)
+        for id in range(1, 4):
+            cache.get_or_encode(None, (id,) + self.row[1:])
+        assert len(cache) == 2
@@ -1,4 +1,6 @@
 from books import BookRepo, BookError
+from books.storage import PostgresStorage
+from deadlines import DeadlineExceeded, start_deadline, end_deadline
 
 import pytest
 
@@ -23,10 +25,84 @@ class TestBookRepo:
 
     @pytest.mark.parametrize('filters, expected', test_data)
     def test_get_all_books_query(self, filters, expected):
-        book_repo = BookRepo(None)
-        query = book_repo._get_all_books_query(filters)
+        query = PostgresStorage(None)._get_all_books_query(filters)
         assert query == expected
 
+    def test_get_sorted_books_query(self):
+        order = BookRepo.sort_order(BookRepo.parse_sort('-release_date'), 10)
+        query = PostgresStorage(None)._get_all_books_query({'publisher': 'Bantam Books'}, ('id', 'name'), order, 10)
+        assert query == 'SELECT id, name FROM books WHERE publisher=%s ORDER BY release_date DESC, id DESC LIMIT %s'
+
+    def test_get_faceted_books_query(self):
+        order = (('release_date', True), ('id', True))
+        query = PostgresStorage(None)._get_faceted_books_query(
+            {'publisher': 'Bantam Books'}, ('country', 'release_year'), ('id', 'name'), order, 10)
+        assert query == (
+            "WITH matched AS (SELECT id, name, release_date, country, date_part('year', release_date)::int AS "
+            "release_year FROM books WHERE publisher=%s), "
+            "page AS (SELECT id, name, row_number() OVER (ORDER BY release_date DESC, id DESC) AS page_position "
+            "FROM matched ORDER BY release_date DESC, id DESC LIMIT %s) "
+            "SELECT NULL AS facet, NULL AS facet_value, NULL AS facet_books, page_position, id, name FROM page "
+            "UNION ALL SELECT CASE WHEN GROUPING(country) = 0 THEN 'country' "
+            "WHEN GROUPING(release_year) = 0 THEN 'release_year' END, "
+            "CASE WHEN GROUPING(country) = 0 THEN country::text "
+            "WHEN GROUPING(release_year) = 0 THEN release_year::text END, count(*), NULL, NULL, NULL FROM matched "
+            "GROUP BY GROUPING SETS ((country), (release_year)) "
+            "ORDER BY page_position")
+
+    def test_update_many_statement(self):
+        statement = PostgresStorage(None)._get_update_many_statement(('number_of_pages', 'release_date'))
+        assert statement == (
+            'UPDATE books SET number_of_pages = changes.number_of_pages, release_date = changes.release_date '
+            'FROM unnest(%s::int[], %s::int[], %s::date[]) AS changes (id, number_of_pages, release_date) '
+            'WHERE books.id = changes.id RETURNING books.id')
+
+    def test_parse_facets(self):
+        assert BookRepo.parse_facets(None) is None
+        assert BookRepo.parse_facets(' release_year, country,country') == ('country', 'release_year')
+        with pytest.raises(BookError) as err:
+            BookRepo.parse_facets('name')
+        assert err.value.name() == 'FILTER_ERROR'
+
+    def test_parse_sort(self):
+        assert BookRepo.parse_sort(None) is None
+        assert BookRepo.parse_sort('-release_date, name') == (('release_date', True), ('name', False))
+        with pytest.raises(BookError) as err:
+            BookRepo.parse_sort('authors')
+        assert err.value.name() == 'FILTER_ERROR'
+
+    def test_sort_order_breaks_ties_by_id(self):
+        assert BookRepo.sort_order(None) is None
+        assert BookRepo.sort_order(None, 10) == (('id', False),)
+        assert BookRepo.sort_order((('name', False), ('release_date', True))) == \
+            (('name', False), ('release_date', True), ('id', True))
+        assert BookRepo.sort_order((('id', True), ('name', False))) == (('id', True), ('name', False))
+
+    def test_parse_limit(self):
+        book_repo = BookRepo(None, max_limit=100)
+        assert book_repo.parse_limit(None) is None
+        assert book_repo.parse_limit('10') == 10
+        for limit in ('0', '101', 'a', '\u00b2'):
+            with pytest.raises(BookError):
+                book_repo.parse_limit(limit)
+
+    test_recommended_index_data = [
+        ({'publisher': 'X'}, '-release_date',
+         'CREATE INDEX CONCURRENTLY books_publisher_release_date_id_idx ON books (publisher, release_date, id)'),
+        ({'publisher': 'X', 'country': 'India'}, '-release_date,name',
+         'CREATE INDEX CONCURRENTLY books_country_publisher_release_date_name_id_idx ON books '
+         '(country, publisher, release_date DESC, name, id)'),
+        ({'release_date': 1996}, 'name', 'CREATE INDEX CONCURRENTLY books_name_id_idx ON books (name, id)'),
+        ({'publisher': 'X'}, 'publisher', 'CREATE INDEX CONCURRENTLY books_publisher_id_idx ON books (publisher, id)'),
+        ({}, '-id', None),
+        ({}, None, None),
+    ]
+
+    @pytest.mark.parametrize('filters, sort, expected', test_recommended_index_data)
+    def test_recommended_index(self, filters, sort, expected):
+        order = BookRepo.sort_order(BookRepo.parse_sort(sort))
+        assert PostgresStorage.recommended_index(filters, order) == expected
+
     
     unsupported_filters_data = [
        { 'number_of_pages': 450},
@@ -37,4 +113,167 @@ class TestBookRepo:
     def test_get_books_for_unsupported_filter(self, filters):
         with pytest.raises(BookError) as err:
             book_repo = BookRepo(None)
-            book_repo.get_books(**filters)
\ No newline at end of file
+            book_repo.get_books(**filters)
+
+
+class TestBookRepoFields:
+
+    test_data = [
+        (None, None),
+        ('', None),
+        ('name,isbn', ('id', 'name', 'isbn')),
+        (['isbn', ' id', 'name'], ('id', 'name', 'isbn')),
+        ('id,name,isbn,authors,country,number_of_pages,publisher,release_date', None),
+    ]
+
+    @pytest.mark.parametrize('fields, expected', test_data)
+    def test_parse_fields(self, fields, expected):
+        assert BookRepo(None).parse_fields(fields) == expected
+
+    def test_parse_unknown_fields(self):
+        with pytest.raises(BookError) as err:
+            BookRepo(None).parse_fields('name,password')
+        assert err.value.name() == 'FIELD_ERROR'
+
+    def test_get_all_books_query_with_fields(self):
+        query = PostgresStorage(None)._get_all_books_query({'publisher': 'Bantam'}, ('id', 'name', 'isbn'))
+        assert query == 'SELECT id, name, isbn FROM books WHERE publisher=%s'
+
+
+class FakeCursor:
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = []
+
+    def execute(self, query, params):
+        self.executed.append((query, params))
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+
+    closed = False
+
+    def __init__(self, rows):
+        self.fake_cursor = FakeCursor(rows)
+        self.committed = False
+        self.rolled_back = False
+
+    def cursor(self):
+        return self.fake_cursor
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        self.rolled_back = True
+
+
+class FakeConnectionPool:
+
+    def __init__(self, rows):
+        self.conn = FakeConnection(rows)
+
+    def getconn(self):
+        return self.conn
+
+    def putconn(self, conn):
+        pass
+
+
+class TestBookRepoIds:
+
+    def test_parse_ids(self):
+        assert BookRepo.parse_ids('3, 1,3') == (3, 1)
+        assert BookRepo.parse_ids([2, '1']) == (2, 1)
+
+    def test_get_books_by_ids_in_given_order(self):
+        cpool = FakeConnectionPool([(1, 'A'), (3, 'C')])
+        books, missing = BookRepo(PostgresStorage(cpool)).get_books_by_ids([3, 2, 1], 'name')
+
+        assert [book.values() for book in books] == [{'id': 3, 'name': 'C'}, {'id': 1, 'name': 'A'}]
+        assert missing == [2]
+        assert cpool.conn.fake_cursor.executed == [('SELECT id, name FROM books WHERE id = ANY(%s)', ([3, 2, 1],))]
+
+    def test_too_many_ids(self):
+        with pytest.raises(BookError) as err:
+            BookRepo(None, max_ids=2).get_books_by_ids('1,2,3')
+        assert err.value.name() == 'FILTER_ERROR'
+
+
+class TestBookRepoDeadline:
+
+    def test_statements_are_bounded_by_deadline(self):
+        cpool = FakeConnectionPool([(1, 'A')])
+        token = start_deadline(2.5)
+        try:
+            BookRepo(PostgresStorage(cpool)).get_books_by_ids([1], 'name')
+        finally:
+            end_deadline(token)
+
+        (set_timeout, timeout), query = cpool.conn.fake_cursor.executed
+        assert set_timeout == 'SET LOCAL statement_timeout = %s'
+        assert 2000 < timeout[0] <= 2500
+        assert query[0] == 'SELECT id, name FROM books WHERE id = ANY(%s)'
+
+    def test_exceeded_deadline_does_not_borrow_a_connection(self):
+        cpool = FakeConnectionPool([])
+        token = start_deadline(0)
+        try:
+            with pytest.raises(DeadlineExceeded):
+                BookRepo(PostgresStorage(cpool)).get_books_by_ids([1])
+        finally:
+            end_deadline(token)
+        assert cpool.conn.fake_cursor.executed == []
+
+
+class TestBookRepoBulkWrites:
+
+    def test_update_books(self):
+        cpool = FakeConnectionPool([(3,), (1,)])
+        written = []
+        book_repo = BookRepo(PostgresStorage(cpool))
+        book_repo.add_write_listener(lambda operation, id: written.append((operation, id)))
+
+        ids = book_repo.update_books({'publisher': 'Manning', 'authors': ['A']}, publisher='Bantam', release_date=1996)
+        assert ids == [1, 3]
+        assert cpool.conn.fake_cursor.executed == [(
+            "UPDATE books SET authors = %s, publisher = %s WHERE publisher=%s and date_part('year', release_date)=%s "
+            "RETURNING id",
+            ('["A"]', 'Manning', 'Bantam', 1996))]
+        assert cpool.conn.committed
+        assert written == [('update', 1), ('update', 3)]
+
+    def test_delete_books_dry_run(self):
+        cpool = FakeConnectionPool([(2,)])
+        assert BookRepo(PostgresStorage(cpool)).delete_books(dry_run=True, publisher='Bantam') == [2]
+        assert cpool.conn.fake_cursor.executed == [('SELECT id FROM books WHERE publisher=%s', ('Bantam',))]
+        assert cpool.conn.rolled_back
+        assert not cpool.conn.committed
+
+    def test_too_many_books(self):
+        cpool = FakeConnectionPool([(1,), (2,), (3,)])
+        with pytest.raises(BookError) as err:
+            BookRepo(PostgresStorage(cpool)).delete_books(max_affected=2, publisher='Bantam')
+        assert err.value.name() == 'TOO_MANY_BOOKS'
+        assert cpool.conn.rolled_back
+        assert not cpool.conn.committed
+
+    test_invalid_data = [
+        ({'publisher': 'Manning'}, {}),
+        ({'publisher': 'Manning'}, {'isbn': '123'}),
+        ({'id': 3}, {'publisher': 'Bantam'}),
+        ({}, {'publisher': 'Bantam'}),
+        ({'release_date': '1996'}, {'publisher': 'Bantam'}),
+    ]
+
+    @pytest.mark.parametrize('values, filters', test_invalid_data)
+    def test_invalid_update(self, values, filters):
+        with pytest.raises(BookError):
+            BookRepo(PostgresStorage(FakeConnectionPool([]))).update_books(values, **filters)
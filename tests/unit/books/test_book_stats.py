@@ -0,0 +1,37 @@
+from books import BookStatsRepo, BookError
+from books.stats import StatsRefresher
+import threading
+import time
+import pytest
+
+
+class TestBookStatsRepo:
+
+    def test_get_stats_query(self):
+        query = BookStatsRepo(None)._get_stats_query('publisher')
+        assert query == ('SELECT publisher, sum(books), sum(pages) FROM book_stats '
+                         'GROUP BY publisher ORDER BY sum(books) DESC, publisher')
+
+    def test_get_stats_by_unsupported_dimension(self):
+        with pytest.raises(BookError) as err:
+            BookStatsRepo(None).get_stats_by('name; DROP TABLE books')
+        assert err.value.name() == 'DIMENSION_ERROR'
+
+
+class TestStatsRefresher:
+
+    def test_coalesces_schedules_into_one_refresh(self):
+        refreshed = threading.Event()
+        count = []
+
+        def refresh():
+            count.append(1)
+            refreshed.set()
+
+        refresher = StatsRefresher(refresh, 0.05)
+        for _ in range(10):
+            refresher.schedule()
+
+        assert refreshed.wait(2)
+        time.sleep(0.1)
+        assert len(count) == 1
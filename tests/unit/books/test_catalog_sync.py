@@ -0,0 +1,177 @@
+from books import BookRepo, BookError
+from books.catalog_sync import CatalogSync
+from books.routes import CatalogSyncRoutes, handle_book_error
+from books.storage import MemoryStorage
+from external_books import ExternalBook, ExternalBookError
+from app import BooksApiFlask
+import pytest
+import threading
+import time
+
+
+def catalog_book(**values):
+    book_info = {
+        'name': 'A Game of Thrones',
+        'isbn': '978-0553103540',
+        'authors': ['George R. R. Martin'],
+        'country': 'United States',
+        'numberOfPages': 694,
+        'publisher': 'Bantam Books',
+        'released': '1996-08-01T00:00:00'
+    }
+    book_info.update(values)
+    return ExternalBook._from_api(book_info)
+
+
+class FakeCatalog:
+
+    def __init__(self, books=(), error=None):
+        self.books = list(books)
+        self.error = error
+        # Cleared to hold fetching until it is set
+        self.fetching = threading.Event()
+        self.fetching.set()
+
+    def fetch_books(self):
+        self.fetching.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.books, {'requests': 1, 'not_modified': 0}
+
+
+class FakeLock:
+
+    def __init__(self, free=True):
+        self.free = free
+        self.holds = False
+
+    def acquire(self):
+        if self.free:
+            self.holds = True
+        return self.holds
+
+    def held(self):
+        return self.holds
+
+
+class TestCatalogSync:
+
+    @pytest.fixture
+    def book_repo(self):
+        return BookRepo(MemoryStorage())
+
+    def create_book(self, book_repo, **values):
+        book_info = {
+            'name': 'A Game of Thrones',
+            'isbn': '978-0553103540',
+            'authors': ['George R. R. Martin'],
+            'country': 'United States',
+            'number_of_pages': 694,
+            'publisher': 'Bantam Books',
+            'release_date': '1996-08-01'
+        }
+        book_info.update(values)
+        book = book_repo.get_empty_book()
+        book.set_values(**book_info)
+        book.save()
+        return book
+
+    def test_updates_changed_fields(self, book_repo):
+        drifted = self.create_book(book_repo, number_of_pages=600, publisher='Unknown')
+        unchanged = self.create_book(book_repo, name='A Clash of Kings', isbn='978-0553108033', number_of_pages=768,
+                                     release_date='1999-02-02')
+        renamed_isbn = self.create_book(book_repo, name='a storm of  swords', isbn='local-isbn', release_date=None)
+        self.create_book(book_repo, name='Not in catalog', isbn='other-isbn')
+        catalog = FakeCatalog([
+            catalog_book(),
+            catalog_book(name='A Clash of Kings', isbn='978-0553108033', numberOfPages=768,
+                         released='1999-02-02T00:00:00'),
+            catalog_book(name='A Storm of Swords', isbn='978-0553106633', numberOfPages=992,
+                         released='2000-10-31T00:00:00'),
+        ])
+        writes = []
+        book_repo.add_write_listener(lambda operation, id: writes.append((operation, id)))
+
+        report = CatalogSync(book_repo, catalog).run()
+        assert book_repo.get_book(drifted.id).values() == dict(drifted.values(), publisher='Bantam Books',
+                                                               number_of_pages=694)
+        assert book_repo.get_book(unchanged.id).values() == unchanged.values()
+        assert book_repo.get_book(renamed_isbn.id).values() == dict(
+            renamed_isbn.values(), number_of_pages=992, release_date='2000-10-31')
+        assert writes == [('update', drifted.id), ('update', renamed_isbn.id)]
+
+        assert (report['catalog_books'], report['local_books'], report['matched'], report['updated']) == (3, 4, 3, 2)
+        assert report['changes'][0] == {'id': drifted.id, 'isbn': '978-0553103540', 'fields': {
+            'number_of_pages': {'from': 600, 'to': 694}, 'publisher': {'from': 'Unknown', 'to': 'Bantam Books'}}}
+        assert set(report['phases']) == {'fetch_ms', 'read_ms', 'diff_ms', 'apply_ms'}
+
+        assert CatalogSync(book_repo, catalog, batch_size=1).run()['updated'] == 0
+
+    def test_skips_invalid_and_ambiguous_catalog_books(self, book_repo):
+        book = self.create_book(book_repo, number_of_pages=600)
+        named = self.create_book(book_repo, name='Dunk and Egg', isbn='local-isbn', number_of_pages=1)
+        catalog = FakeCatalog([
+            catalog_book(numberOfPages=-1),
+            catalog_book(name='Dunk and Egg', isbn='1'),
+            catalog_book(name='Dunk and Egg', isbn='2'),
+        ])
+
+        report = CatalogSync(book_repo, catalog).run()
+        assert (report['matched'], report['invalid'], report['updated']) == (1, 1, 0)
+        assert book_repo.get_book(book.id).number_of_pages == 600
+        assert book_repo.get_book(named.id).number_of_pages == 1
+
+    def test_catalog_error(self, book_repo):
+        sync = CatalogSync(book_repo, FakeCatalog(error=ExternalBookError('ICE_AND_FIRE_API_EXCEPTION', None,
+                                                                          'Connection refused')))
+        with pytest.raises(BookError) as err:
+            sync.run()
+        assert err.value.name() == 'CATALOG_UNAVAILABLE'
+        assert sync.report() == {'last_sync': None, 'error': 'Connection refused', 'running': False,
+                                 'leader': True}
+
+    def test_only_the_process_holding_the_lock_syncs(self, book_repo):
+        book = self.create_book(book_repo, number_of_pages=600)
+        catalog = FakeCatalog(error=AssertionError('The catalog must not be fetched'))
+        sync = CatalogSync(book_repo, catalog, lock=FakeLock(free=False))
+        with pytest.raises(BookError) as err:
+            sync.run()
+        assert err.value.name() == 'SYNC_IN_PROGRESS'
+        assert sync.report() == {'last_sync': None, 'error': None, 'running': False, 'leader': False}
+        with pytest.raises(BookError) as err:
+            sync.start()
+        assert err.value.name() == 'SYNC_IN_PROGRESS'
+        assert not sync.report()['running']
+
+        sync = CatalogSync(book_repo, FakeCatalog([catalog_book()]), lock=FakeLock())
+        assert sync.run()['updated'] == 1
+        assert sync.report()['leader']
+        assert book_repo.get_book(book.id).number_of_pages == 694
+
+
+class TestCatalogSyncRoutes:
+
+    def test_runs_and_reports_sync(self):
+        catalog = FakeCatalog()
+        sync = CatalogSync(BookRepo(MemoryStorage()), catalog)
+        app = BooksApiFlask(__name__)
+        app.register_error_handler(BookError, handle_book_error)
+        routes = CatalogSyncRoutes(sync, 'secret')
+        app.add_url_rule('/admin/catalog-sync', view_func=routes.get_catalog_sync, methods=['GET'])
+        app.add_url_rule('/admin/catalog-sync', view_func=routes.run_catalog_sync, methods=['POST'])
+        client = app.test_client()
+
+        assert client.post('/admin/catalog-sync').status_code == 403
+        catalog.fetching.clear()
+        resp = client.post('/admin/catalog-sync', headers={'X-Admin-Token': 'secret'})
+        assert resp.status_code == 202
+        assert resp.get_json()['data']['running']
+        assert client.post('/admin/catalog-sync', headers={'X-Admin-Token': 'secret'}).status_code == 409
+
+        catalog.fetching.set()
+        for _ in range(100):
+            report = client.get('/admin/catalog-sync', headers={'X-Admin-Token': 'secret'}).get_json()['data']
+            if not report['running']:
+                break
+            time.sleep(0.01)
+        assert report['last_sync']['catalog_books'] == 0
@@ -0,0 +1,151 @@
+from books import ChangeFeed, BookError
+from books.routes import BookChangesRoutes, handle_book_error
+from app import BooksApiFlask
+import admission
+import threading
+
+
+class FakeChangeFeed(ChangeFeed):
+
+    def __init__(self, recorded=None, buffer_size=1000):
+        super().__init__(None, {'minconn': 1, 'maxconn': 5, 'database': 'booksapi'}, buffer_size=buffer_size)
+        self.recorded = recorded or []
+
+    def start(self):
+        pass
+
+    def changes_since(self, seq, limit=1000, gaps=(), block=False):
+        return [event for event in self.recorded if event['seq'] > seq or event['seq'] in gaps][:limit]
+
+
+def event(seq, id=1, op='update'):
+    return {'seq': seq, 'id': id, 'op': op}
+
+
+class TestChangeFeed:
+
+    def test_pool_settings_are_not_used_to_listen(self):
+        assert FakeChangeFeed()._connection_config == {'database': 'booksapi'}
+
+    def test_wait_for_events(self):
+        feed = FakeChangeFeed()
+        feed.publish(event(1))
+        feed.publish(event(2))
+
+        events, position, missed = feed.wait_for_events(1, 0)
+        assert events == [event(2)]
+        assert position == 2
+        assert not missed
+
+        events, position, missed = feed.wait_for_events(2, 0.01)
+        assert events == []
+        assert position == 2
+
+    def test_wait_is_woken_up_by_publish(self):
+        feed = FakeChangeFeed()
+        threading.Timer(0.05, feed.publish, [event(1)]).start()
+        events, _, _ = feed.wait_for_events(0, 5)
+        assert events == [event(1)]
+
+    def test_missed_events(self):
+        feed = FakeChangeFeed(buffer_size=2)
+        for seq in range(1, 5):
+            feed.publish(event(seq))
+        events, position, missed = feed.wait_for_events(1, 0)
+        assert missed
+        assert position == 4
+
+    def test_subscribe_resumes_from_table_without_duplicates(self):
+        feed = FakeChangeFeed([event(1), event(2), event(3)])
+        subscription = feed.subscribe(since=1, heartbeat=0.01)
+        assert next(subscription) == event(2)
+        assert next(subscription) == event(3)
+        # Notified after it was read from the table
+        feed.publish(event(3))
+        feed.publish(event(4))
+        assert next(subscription) == event(4)
+        assert next(subscription) is None
+
+    def test_subscribe_catches_up_when_falling_behind(self):
+        feed = FakeChangeFeed(buffer_size=2)
+        subscription = feed.subscribe(since=0, heartbeat=0.01)
+        assert next(subscription) is None
+        feed.recorded = [event(seq) for seq in range(1, 5)]
+        for seq in range(1, 5):
+            feed.publish(event(seq))
+        assert [next(subscription) for _ in range(4)] == feed.recorded
+
+    def test_subscribe_reads_every_page_of_the_table(self):
+        feed = FakeChangeFeed([event(seq) for seq in range(1, 6)])
+        subscription = feed.subscribe(since=0, heartbeat=0.01, batch_size=2)
+        assert [next(subscription) for _ in range(5)] == feed.recorded
+        assert next(subscription) is None
+
+    def test_subscribe_reads_gaps_again_when_catching_up(self):
+        feed = FakeChangeFeed([event(1), event(3)], buffer_size=2)
+        subscription = feed.subscribe(since=0, heartbeat=0.01, batch_size=2)
+        assert [next(subscription), next(subscription), next(subscription)] == [event(1), event(3), None]
+
+        # 2 is committed after 3, and its notification is dropped along with the others
+        feed.recorded = [event(seq) for seq in range(1, 7)]
+        for seq in range(4, 7):
+            feed.publish(event(seq))
+        assert [next(subscription) for _ in range(4)] == [event(2), event(4), event(5), event(6)]
+
+
+class TestBookChangesRoutes:
+
+    def create_client(self, feed):
+        app = BooksApiFlask(__name__)
+        app.register_error_handler(BookError, handle_book_error)
+        routes = BookChangesRoutes(feed, {'heartbeat': 0.01, 'max_wait': 1})
+        app.add_url_rule('/api/v1/books/changes', view_func=routes.get_changes, methods=['GET'])
+        return app.test_client()
+
+    def test_event_stream_resumes_from_last_event_id(self):
+        client = self.create_client(FakeChangeFeed([event(1), event(2, 5, 'delete')]))
+        resp = client.get('/api/v1/books/changes', headers={'Accept': 'text/event-stream', 'Last-Event-ID': '1'},
+                          buffered=False)
+        assert resp.status_code == 200
+        assert resp.mimetype == 'text/event-stream'
+        chunks = resp.response
+        assert next(chunks) == b'retry: 3000\n\n'
+        assert next(chunks) == b'id: 2\nevent: book_change\ndata: {"seq":2,"id":5,"op":"delete"}\n\n'
+        assert next(chunks) == b': keep-alive\n\n'
+        resp.close()
+
+    def test_event_stream_holds_admission_slot_until_closed(self):
+        feed = FakeChangeFeed([event(1)])
+        app = BooksApiFlask(__name__)
+        admission.init_app(app, {'groups': {'changes': {'max_concurrency': 1}}, 'routes': {'get_changes': 'changes'}})
+        routes = BookChangesRoutes(feed, {'heartbeat': 0.01})
+        app.add_url_rule('/api/v1/books/changes', view_func=routes.get_changes, methods=['GET'])
+        client = app.test_client()
+
+        resp = client.get('/api/v1/books/changes', headers={'Accept': 'text/event-stream', 'Last-Event-ID': '0'},
+                          buffered=False)
+        assert next(resp.response) == b'retry: 3000\n\n'
+        assert client.get('/api/v1/books/changes?since=1').status_code == 503
+        resp.close()
+        assert client.get('/api/v1/books/changes?since=1').status_code == 200
+
+    def test_poll(self):
+        client = self.create_client(FakeChangeFeed([event(1), event(2)]))
+        resp = client.get('/api/v1/books/changes?since=1&wait=1')
+        assert resp.status_code == 200
+        assert resp.get_json()['data'] == [event(2)]
+        assert resp.get_json()['last_seq'] == 2
+
+    def test_poll_without_changes_waits(self):
+        feed = FakeChangeFeed([event(1)])
+        client = self.create_client(feed)
+        resp = client.get('/api/v1/books/changes?since=1&wait=1')
+        assert resp.get_json()['data'] == []
+        assert resp.get_json()['last_seq'] == 1
+
+    def test_invalid_since_and_wait(self):
+        client = self.create_client(FakeChangeFeed())
+        for query in ('since=abc', 'since=%C2%B2', 'since=1&wait=%C2%B2'):
+            resp = client.get('/api/v1/books/changes?' + query)
+            assert resp.status_code == 400
+            assert resp.get_json()['name'] == 'FILTER_ERROR'
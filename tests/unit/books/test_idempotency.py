@@ -0,0 +1,58 @@
+from books import BookError
+from books.idempotency import IdempotencyStore
+import pytest
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestIdempotencyStore:
+
+    def test_replays_completed_request(self):
+        store = IdempotencyStore()
+        assert store.begin('key', 'a') is None
+        store.complete('key', {'id': 1})
+        assert store.begin('key', 'a') == {'id': 1}
+
+    def test_key_reused_for_another_request(self):
+        store = IdempotencyStore()
+        store.begin('key', 'a')
+        store.complete('key', {'id': 1})
+        with pytest.raises(BookError) as err:
+            store.begin('key', 'b')
+        assert err.value.name() == 'IDEMPOTENCY_KEY_REUSED'
+
+    def test_request_in_progress(self):
+        store = IdempotencyStore()
+        store.begin('key', 'a')
+        with pytest.raises(BookError) as err:
+            store.begin('key', 'a')
+        assert err.value.name() == 'IDEMPOTENCY_IN_PROGRESS'
+
+    def test_aborted_request_can_be_retried(self):
+        store = IdempotencyStore()
+        store.begin('key', 'a')
+        store.abort('key')
+        assert store.begin('key', 'a') is None
+
+    def test_keys_expire(self):
+        clock = Clock()
+        store = IdempotencyStore(ttl=10, clock=clock)
+        store.begin('key', 'a')
+        store.complete('key', {'id': 1})
+        clock.now = 11
+        assert store.begin('key', 'a') is None
+
+    def test_least_recently_used_keys_are_dropped(self):
+        store = IdempotencyStore(max_keys=2)
+        for key in ('a', 'b', 'c'):
+            store.begin(key, key)
+            store.complete(key, key)
+        assert len(store) == 2
+        assert store.begin('a', 'a') is None
@@ -0,0 +1,97 @@
+from books import BookError
+from books.params import parse_list_params, parse_bulk_params, parse_body_filters, canonical_query
+from werkzeug.datastructures import MultiDict
+import pytest
+
+
+class TestListParams:
+
+    def test_parse_and_canonicalize(self):
+        args = MultiDict([('Publisher', ' Bantam Books '), ('release_date', '1996'), ('fields', 'isbn,name')])
+        filters, options = parse_list_params(args)
+        assert filters == {'publisher': 'Bantam Books', 'release_date': 1996}
+        assert options == {'fields': 'id,name,isbn'}
+        assert canonical_query(filters, options) == 'fields=id%2Cname%2Cisbn&publisher=Bantam+Books&release_date=1996'
+
+    def test_equivalent_requests_have_same_canonical_query(self):
+        first = parse_list_params(MultiDict([('name', 'A'), ('COUNTRY', 'India')]))
+        second = parse_list_params(MultiDict([('country', 'India'), ('name', 'A ')]))
+        assert canonical_query(*first) == canonical_query(*second)
+
+    def test_parse_ids(self):
+        filters, options = parse_list_params(MultiDict([('IDS', ' 3, 1,3,2')]))
+        assert filters == {}
+        assert options == {'ids': '3,1,2'}
+
+    def test_parse_sort_and_limit(self):
+        filters, options = parse_list_params(MultiDict([('publisher', 'X'), ('Sort', ' -release_date, name'),
+                                                        ('limit', '010')]))
+        assert filters == {'publisher': 'X'}
+        assert options == {'sort': '-release_date,name', 'limit': '10'}
+        assert canonical_query(filters, options) == 'limit=10&publisher=X&sort=-release_date%2Cname'
+
+    def test_parse_facets(self):
+        filters, options = parse_list_params(MultiDict([('facets', 'release_year, publisher')]))
+        assert options == {'facets': 'publisher,release_year'}
+
+    test_invalid_data = [
+        MultiDict([('name', 'A'), ('name', 'B')]),
+        MultiDict([('name', 'A'), ('NAME', 'B')]),
+        MultiDict([('release_date', '1996-01-01')]),
+        MultiDict([('release_date', '\u00b2')]),
+        MultiDict([('fields', 'password')]),
+        MultiDict([('ids', '1,a')]),
+        MultiDict([('ids', '1,\u00b2')]),
+        MultiDict([('ids', '')]),
+        MultiDict([('ids', '1,2'), ('name', 'A')]),
+        MultiDict([('sort', 'isbn')]),
+        MultiDict([('sort', 'name,-name')]),
+        MultiDict([('limit', '-1')]),
+        MultiDict([('limit', '\u00b2')]),
+        MultiDict([('ids', '1,2'), ('limit', '1')]),
+        MultiDict([('facets', 'isbn')]),
+        MultiDict([('ids', '1,2'), ('facets', 'country')]),
+    ]
+
+    @pytest.mark.parametrize('args', test_invalid_data)
+    def test_invalid_params(self, args):
+        with pytest.raises(BookError):
+            parse_list_params(args)
+
+
+class TestBodyFilters:
+
+    def test_release_date_becomes_a_year(self):
+        assert parse_body_filters({'name': 'A', 'release_date': '1996'}) == {'name': 'A', 'release_date': 1996}
+        assert parse_body_filters({'release_date': 1996}) == {'release_date': 1996}
+
+    @pytest.mark.parametrize('body', [
+        {'release_date': '1996-08-01'},
+        {'release_date': True},
+        {'release_date': [1996]},
+        {'name': 5},
+        {'limit': 3},
+        ['name'],
+    ])
+    def test_invalid_filters(self, body):
+        with pytest.raises(BookError) as err:
+            parse_body_filters(body)
+        assert err.value.name() == 'FILTER_ERROR'
+
+
+class TestBulkParams:
+
+    def test_parse(self):
+        filters, options = parse_bulk_params(MultiDict([('publisher', 'Bantam'), ('Dry_Run', 'true')]), 100)
+        assert filters == {'publisher': 'Bantam'}
+        assert options == {'dry_run': True, 'max_affected': 100}
+
+    def test_max_affected_can_not_be_raised(self):
+        assert parse_bulk_params(MultiDict([('max_affected', '10')]), 100)[1]['max_affected'] == 10
+        assert parse_bulk_params(MultiDict([('max_affected', '1000')]), 100)[1]['max_affected'] == 100
+
+    def test_invalid_max_affected(self):
+        with pytest.raises(BookError):
+            parse_bulk_params(MultiDict([('max_affected', '-1')]), 100)
+        with pytest.raises(BookError):
+            parse_bulk_params(MultiDict([('max_affected', '\u00b2')]), 100)
@@ -0,0 +1,135 @@
+from books.pool import ForkSafeConnectionPool
+from deadlines import DeadlineExceeded, start_deadline, end_deadline
+from psycopg2 import pool
+import books.pool
+import os
+import threading
+import pytest
+
+
+class FakeThreadedConnectionPool:
+
+    def __init__(self, **config):
+        self.config = config
+        self.closed = False
+
+    def getconn(self, key=None):
+        return self
+
+    def putconn(self, conn, key=None, close=False):
+        pass
+
+    def closeall(self):
+        self.closed = True
+
+    def cursor(self):
+        return self
+
+    def execute(self, query):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class TestForkSafeConnectionPool:
+
+    @pytest.fixture
+    def cpool(self, monkeypatch):
+        monkeypatch.setattr(books.pool.pool, 'ThreadedConnectionPool', FakeThreadedConnectionPool)
+        return ForkSafeConnectionPool({'minconn': 1, 'maxconn': 5}, 'test_db')
+
+    def test_reuses_pool_in_same_process(self, cpool):
+        assert cpool.getconn() is cpool.getconn()
+
+    def test_pool_is_opened_lazily(self, cpool):
+        assert cpool._pool is None
+        assert cpool.state() == ('cold', None)
+        cpool.getconn()
+        assert cpool.state() == ('ready', None)
+
+    def test_warm_up(self, cpool):
+        cpool.warm_up()
+        assert cpool._pool is not None
+        assert cpool.state() == ('ready', None)
+
+    def test_creates_new_pool_after_fork(self, cpool, monkeypatch):
+        parent_pool = cpool.getconn()
+        monkeypatch.setattr(os, 'getpid', lambda: -1)
+        cpool.reset_after_fork()
+
+        child_pool = cpool.getconn()
+        assert child_pool is not parent_pool
+        assert child_pool.config == {'minconn': 1, 'maxconn': 5}
+        # Connections of the parent are neither closed nor garbage collected
+        assert not parent_pool.closed
+        assert parent_pool in ForkSafeConnectionPool._inherited
+
+    def test_close(self, cpool):
+        current = cpool.getconn()
+        cpool.close()
+        assert current.closed
+
+
+class ExhaustedConnectionPool(FakeThreadedConnectionPool):
+    """
+    A pool of a single connection
+    """
+
+    def __init__(self, **config):
+        super().__init__(**config)
+        self.free = True
+
+    def getconn(self, key=None):
+        if not self.free:
+            raise pool.PoolError('connection pool exhausted')
+        self.free = False
+        return self
+
+    def putconn(self, conn, key=None, close=False):
+        self.free = True
+
+
+class TestConnectionWait:
+
+    @pytest.fixture
+    def cpool(self, monkeypatch):
+        monkeypatch.setattr(books.pool.pool, 'ThreadedConnectionPool', ExhaustedConnectionPool)
+        return ForkSafeConnectionPool({'minconn': 1, 'maxconn': 1}, 'test_db')
+
+    def test_fails_right_away_without_deadline(self, cpool):
+        cpool.getconn()
+        with pytest.raises(pool.PoolError):
+            cpool.getconn()
+
+    def test_waits_for_a_connection_until_deadline(self, cpool):
+        conn = cpool.getconn()
+        token = start_deadline(5)
+        try:
+            threading.Timer(0.05, lambda: cpool.putconn(conn)).start()
+            assert cpool.getconn() is conn
+        finally:
+            end_deadline(token)
+
+    def test_fails_when_deadline_is_exceeded(self, cpool):
+        cpool.getconn()
+        token = start_deadline(0.05)
+        try:
+            with pytest.raises(DeadlineExceeded) as err:
+                cpool.getconn()
+            assert err.value.name() == 'DB_POOL_TIMEOUT'
+        finally:
+            end_deadline(token)
+
+    def test_blocking_caller_waits_without_deadline(self, cpool):
+        conn = cpool.getconn()
+        threading.Timer(0.05, lambda: cpool.putconn(conn)).start()
+        assert cpool.getconn(block=True) is conn
+
+    def test_blocking_caller_fails_when_pool_is_closed(self, cpool):
+        cpool.getconn()
+        closing = threading.Timer(0.05, cpool.close)
+        closing.start()
+        with pytest.raises(pool.PoolError):
+            cpool.getconn(block=True)
+        closing.join()
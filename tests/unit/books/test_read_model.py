@@ -0,0 +1,195 @@
+from books import BookError
+from books.storage import ReadModelStorage, BookColumns, MemoryStorage
+from datetime import date
+import time
+from .storage_contract import BookStorageContract
+import pytest
+
+
+def row(id, name='A Game of thrones', country='United States', publisher='Bantam Books', release_date=date(1996, 8, 1),
+        isbn=None):
+    return (id, name, isbn or 'isbn-{}'.format(id), '["John Doe"]', country, 450, publisher, release_date)
+
+
+class FakeChangeSource:
+
+    def __init__(self):
+        self.recorded = []
+
+    def record(self, seq, id, op='update'):
+        self.recorded.append({'seq': seq, 'id': id, 'op': op})
+
+    def last_seq(self):
+        return max((change['seq'] for change in self.recorded), default=0)
+
+    def changes_since(self, seq, limit=1000, gaps=()):
+        return [change for change in sorted(self.recorded, key=lambda change: change['seq'])
+                if change['seq'] > seq or change['seq'] in gaps][:limit]
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestBookColumns:
+
+    def test_filters_intersect_indexes(self):
+        columns = BookColumns()
+        columns.upsert(row(1))
+        columns.upsert(row(2, country='India'))
+        columns.upsert(row(3, release_date=date(1998, 1, 2)))
+        columns.upsert(row(4, publisher=None, release_date=None))
+
+        assert columns.positions({}) == [0, 1, 2, 3]
+        assert [columns.row(position)[0] for position in columns.positions(
+            {'publisher': 'Bantam Books', 'country': 'United States'})] == [1, 3]
+        assert [columns.row(position, ('id', 'release_date')) for position in columns.positions(
+            {'release_date': 1998})] == [(3, date(1998, 1, 2))]
+        assert columns.positions({'country': 'India', 'release_date': 1998}) == []
+        assert columns.positions({'name': 'Unknown'}) == []
+        assert columns.row(columns.position_of('id', 4)) == row(4, publisher=None, release_date=None)
+
+    def test_update_reindexes_row(self):
+        columns = BookColumns()
+        columns.upsert(row(1))
+        columns.upsert(row(1, country='India', isbn='new-isbn'))
+
+        assert columns.positions({'country': 'United States'}) == []
+        assert columns.positions({'country': 'India'}) == [0]
+        assert columns.position_of('isbn', 'isbn-1') is None
+        assert columns.position_of('isbn', 'new-isbn') == 0
+        assert len(columns) == 1
+
+    def test_deleted_position_is_reused(self):
+        columns = BookColumns()
+        columns.upsert(row(1))
+        columns.upsert(row(2))
+        columns.delete(1)
+        columns.delete(5)
+
+        assert columns.position_of('id', 1) is None
+        assert columns.positions({'publisher': 'Bantam Books'}) == [1]
+        columns.upsert(row(3, country='India'))
+        assert columns.position_of('id', 3) == 0
+        assert columns.row(0) == row(3, country='India')
+
+
+class TestReadModelStorage(BookStorageContract):
+
+    @pytest.fixture
+    def storage(self):
+        storage = ReadModelStorage(MemoryStorage())
+        storage.warm_up()
+        assert storage.state() == ('ready', None)
+        return storage
+
+    def test_reads_are_served_by_columns(self, book_repo, storage):
+        book = self.create_book(book_repo)
+        # Written behind the read model, as if by another process
+        storage.storage.delete(book.id)
+        assert book_repo.get_book(book.id).values() == book.values()
+        assert [found.id for found in book_repo.get_books(publisher=book.publisher)] == [book.id]
+
+
+class TestReadModelFreshness:
+
+    @pytest.fixture
+    def backing(self):
+        backing = MemoryStorage()
+        for release_date in ('1996-08-01', '1998-11-02'):
+            backing.insert({'name': 'A Game of thrones', 'isbn': release_date, 'authors': '["John Doe"]',
+                            'country': 'United States', 'number_of_pages': 450, 'publisher': 'Bantam Books',
+                            'release_date': release_date})
+        return backing
+
+    def test_changes_of_other_processes_are_applied(self, backing):
+        changes = FakeChangeSource()
+        changes.record(1, 1)
+        storage = ReadModelStorage(backing, changes)
+        storage.load()
+
+        backing.update(1, {'country': 'India'})
+        backing.delete(2)
+        assert storage.select({'country': 'India'}) == []
+
+        changes.record(2, 1)
+        changes.record(3, 2, 'delete')
+        storage.catch_up()
+        assert [found[0] for found in storage.select({'country': 'India'})] == [1]
+        assert storage.select_by('id', 2) is None
+
+    def test_stale_model_reads_from_storage(self, backing):
+        clock = FakeClock()
+        storage = ReadModelStorage(backing, FakeChangeSource(), max_staleness=5.0, clock=clock)
+        storage.load()
+        backing.delete(2)
+        assert len(storage.select({})) == 2
+
+        clock.now += 6
+        assert len(storage.select({})) == 1
+        storage.catch_up()
+        assert len(storage.select({})) == 2
+
+    def test_missed_sequences_are_read_again(self, backing):
+        changes = FakeChangeSource()
+        clock = FakeClock()
+        storage = ReadModelStorage(backing, changes, gap_timeout=60.0, clock=clock)
+        storage.load()
+
+        changes.record(1, 1)
+        changes.record(3, 1)
+        storage.catch_up()
+        assert storage._gaps == {2: clock.now}
+
+        # The transaction recording sequence 2 commits after sequence 3 was read
+        backing.delete(2)
+        changes.record(2, 2, 'delete')
+        storage.catch_up()
+        assert storage._gaps == {}
+        assert storage.select_by('id', 2) is None
+
+        changes.record(6, 1)
+        storage.catch_up()
+        clock.now += 61
+        storage.catch_up()
+        assert storage._gaps == {}
+
+    def test_writes_are_applied_right_away(self, backing):
+        storage = ReadModelStorage(backing, FakeChangeSource())
+        storage.load()
+        storage.write_where('update', {'release_date': 1996}, {'country': 'India'})
+        assert [found[0] for found in storage.select({'country': 'India'})] == [1]
+        storage.write_where('delete', {'release_date': 1998}, dry_run=True)
+        assert storage.select_by('id', 2) is not None
+
+    def test_not_loaded_model_reads_from_storage(self, backing):
+        storage = ReadModelStorage(backing)
+        assert storage.state() == ('cold', None)
+        assert len(storage.select({})) == 2
+
+    def test_failed_load_is_retried_in_background(self, backing):
+        select = backing.select
+        failures = [BookError('GET_BOOKS_ERROR', 'Connection refused')]
+
+        def flaky_select(*args):
+            if failures:
+                raise failures.pop()
+            return select(*args)
+
+        backing.select = flaky_select
+        storage = ReadModelStorage(backing, refresh_interval=0.01)
+        storage.warm_up()
+        assert storage.state() == ('failed', 'Connection refused')
+        for _ in range(100):
+            if storage.state()[0] == 'ready':
+                break
+            time.sleep(0.01)
+        storage.close()
+        assert storage.state() == ('ready', None)
+        assert len(storage.select({})) == 2
+
@@ -0,0 +1,195 @@
+from books import BookRoutes, BookError
+from books.idempotency import IdempotencyStore
+from books.routes import handle_book_error
+from psycopg2.extensions import QueryCanceledError
+from app import BooksApiFlask
+import jsoncodec
+import pytest
+
+
+class FakeBookRepo:
+
+    def __init__(self):
+        self.calls = []
+
+    def get_books_encoded(self, fields=None, sort=None, limit=None, **filters):
+        self.calls.append((fields, filters) if sort is None and limit is None else (fields, sort, limit, filters))
+        return [jsoncodec.dumps({'id': 1, 'name': 'A Game of Thrones'})]
+
+    def get_books_with_facets_encoded(self, facets, fields=None, sort=None, limit=None, **filters):
+        self.calls.append((facets, fields, sort, limit, filters))
+        return [jsoncodec.dumps({'id': 1})], {'country': [{'country': 'United States', 'books': 1}]}
+
+    def get_books_by_ids_encoded(self, ids, fields=None):
+        self.calls.append((fields, {'ids': ids}))
+        return [jsoncodec.dumps({'id': 2}), jsoncodec.dumps({'id': 1})], [3]
+
+    def get_empty_book(self):
+        return FakeBook(self)
+
+    def delete_books(self, dry_run=False, max_affected=None, **filters):
+        self.calls.append(('delete', dry_run, max_affected, filters))
+        return [1, 2]
+
+    def get_book_by_isbn(self, isbn, fields=None):
+        self.calls.append((fields, {'isbn': isbn}))
+        return FakeBook(self, 1) if isbn == '978-0553103540' else None
+
+
+class FakeBook:
+
+    def __init__(self, book_repo, id=None):
+        self._book_repo = book_repo
+        self.id = id
+        self._values = {}
+
+    def set_values(self, **values):
+        self._values = values
+
+    def save(self):
+        self._book_repo.calls.append(('save', self._values))
+        self.id = 1
+        return True
+
+    def values(self):
+        return dict(self._values, id=self.id)
+
+
+class TestBookRoutes:
+
+    def create_client(self, book_repo, http_cache):
+        app = BooksApiFlask(__name__)
+        app.register_error_handler(BookError, handle_book_error)
+        book_routes = BookRoutes(book_repo, http_cache, IdempotencyStore())
+        app.add_url_rule('/api/v1/books', view_func=book_routes.get_books, methods=['GET'])
+        app.add_url_rule('/api/v1/books', view_func=book_routes.create_book, methods=['POST'])
+        app.add_url_rule('/api/v1/books', view_func=book_routes.delete_books, methods=['DELETE'])
+        app.add_url_rule('/api/v1/books/isbn/<isbn>', view_func=book_routes.get_book_by_isbn, methods=['GET'])
+        return app.test_client()
+
+    def test_get_sorted_books(self):
+        book_repo = FakeBookRepo()
+        client = self.create_client(book_repo, {})
+        resp = client.get('/api/v1/books?publisher=Bantam&sort=-release_date&limit=10')
+        assert resp.status_code == 200
+        assert book_repo.calls == [(None, '-release_date', '10', {'publisher': 'Bantam'})]
+        assert resp.headers['Content-Location'] == '/api/v1/books?limit=10&publisher=Bantam&sort=-release_date'
+
+    def test_get_books_with_facets(self):
+        book_repo = FakeBookRepo()
+        client = self.create_client(book_repo, {})
+        resp = client.get('/api/v1/books?publisher=Bantam&facets=country&limit=10')
+        assert resp.status_code == 200
+        assert book_repo.calls == [('country', None, None, '10', {'publisher': 'Bantam'})]
+        assert resp.get_json()['data'] == [{'id': 1}]
+        assert resp.get_json()['facets'] == {'country': [{'country': 'United States', 'books': 1}]}
+
+    def test_get_books_by_ids(self):
+        book_repo = FakeBookRepo()
+        client = self.create_client(book_repo, {})
+        resp = client.get('/api/v1/books?ids=2,1,2,3')
+        assert resp.status_code == 200
+        assert resp.get_json()['data'] == [{'id': 2}, {'id': 1}]
+        assert resp.get_json()['missing_ids'] == [3]
+        assert book_repo.calls == [(None, {'ids': '2,1,3'})]
+        assert resp.headers['Content-Location'] == '/api/v1/books?ids=2%2C1%2C3'
+
+    def test_delete_books(self):
+        book_repo = FakeBookRepo()
+        client = self.create_client(book_repo, {})
+        resp = client.delete('/api/v1/books?publisher=Bantam&dry_run=true&max_affected=5000')
+        assert resp.status_code == 200
+        assert resp.get_json()['data'] == [1, 2]
+        assert resp.get_json()['count'] == 2
+        assert resp.get_json()['dry_run']
+        assert book_repo.calls == [('delete', True, 1000, {'publisher': 'Bantam'})]
+
+    def test_create_book_with_idempotency_key(self):
+        book_repo = FakeBookRepo()
+        client = self.create_client(book_repo, {})
+
+        resp = client.post('/api/v1/books', json={'name': 'A', 'isbn': '1'}, headers={'Idempotency-Key': 'k1'})
+        assert resp.status_code == 200
+        assert 'Idempotent-Replayed' not in resp.headers
+
+        retry = client.post('/api/v1/books', json={'name': 'A', 'isbn': '1'}, headers={'Idempotency-Key': 'k1'})
+        assert retry.headers['Idempotent-Replayed'] == 'true'
+        assert retry.get_json() == resp.get_json()
+        assert book_repo.calls == [('save', {'name': 'A', 'isbn': '1'})]
+
+        reused = client.post('/api/v1/books', json={'name': 'B', 'isbn': '1'}, headers={'Idempotency-Key': 'k1'})
+        assert reused.status_code == 422
+
+    def test_invalid_book_is_rejected_before_repo(self):
+        book_repo = FakeBookRepo()
+        client = self.create_client(book_repo, {})
+        resp = client.post('/api/v1/books', json={'name': ' ', 'number_of_pages': '450', 'release_date': '2019-13-01',
+                                                  'title': 'A'})
+        assert resp.status_code == 400
+        assert resp.get_json()['errors'] == {
+            'name': 'name is blank',
+            'number_of_pages': 'number_of_pages is not an integer',
+            'release_date': 'release_date is not a date',
+            'title': 'title is not a field of a book',
+            'isbn': 'isbn is required'
+        }
+        assert book_repo.calls == []
+
+    def test_get_book_by_isbn(self):
+        book_repo = FakeBookRepo()
+        client = self.create_client(book_repo, {})
+        resp = client.get('/api/v1/books/isbn/978-0553103540?fields=name')
+        assert resp.status_code == 200
+        assert book_repo.calls == [('name', {'isbn': '978-0553103540'})]
+        assert 'ETag' in resp.headers
+
+        resp = client.get('/api/v1/books/isbn/000')
+        assert resp.status_code == 404
+        assert resp.get_json()['name'] == 'BOOK_NOT_FOUND'
+
+    def test_get_books_with_query_params(self):
+        book_repo = FakeBookRepo()
+        client = self.create_client(book_repo, {'cache_control': 'public, max-age=30', 'vary': ['Accept-Encoding']})
+
+        resp = client.get('/api/v1/books?Publisher=Bantam%20Books&name=A')
+        assert resp.status_code == 200
+        assert resp.get_json()['data'] == [{'id': 1, 'name': 'A Game of Thrones'}]
+        assert book_repo.calls == [(None, {'publisher': 'Bantam Books', 'name': 'A'})]
+        assert resp.headers['Cache-Control'] == 'public, max-age=30'
+        assert resp.headers['Vary'] == 'Accept-Encoding'
+        assert resp.headers['Content-Location'] == '/api/v1/books?name=A&publisher=Bantam+Books'
+
+        resp = client.get('/api/v1/books?Publisher=Bantam%20Books&name=A',
+                          headers={'If-None-Match': resp.headers['ETag']})
+        assert resp.status_code == 304
+
+    def test_get_books_with_json_filters_is_not_cacheable(self):
+        client = self.create_client(FakeBookRepo(), {'cache_control': 'public, max-age=30'})
+        resp = client.get('/api/v1/books', json={'name': 'A'})
+        assert resp.status_code == 200
+        assert resp.headers['Cache-Control'] == 'no-store'
+
+    def test_get_books_with_invalid_json_filters(self):
+        book_repo = FakeBookRepo()
+        client = self.create_client(book_repo, {})
+        for body in ({'fields': 'name'}, {'limit': 3}, {'title': 'A'}, ['name'], {'release_date': 'abc'}):
+            resp = client.get('/api/v1/books', json=body)
+            assert resp.status_code == 400
+            assert resp.get_json()['name'] == 'FILTER_ERROR'
+        assert book_repo.calls == []
+
+    def test_redirect_to_canonical_url(self):
+        client = self.create_client(FakeBookRepo(), {'redirect_to_canonical': True})
+        resp = client.get('/api/v1/books?name=A&Country=India')
+        assert resp.status_code == 301
+        assert resp.headers['Location'].endswith('/api/v1/books?country=India&name=A')
+        assert client.get('/api/v1/books?country=India&name=A').status_code == 200
+
+
+class TestHandleBookError:
+
+    def test_cancelled_statement(self):
+        err = BookError('GET_BOOKS_ERROR', 'canceling statement due to statement timeout', QueryCanceledError())
+        body, status_code = handle_book_error(err)
+        assert status_code == 504
+        assert body['name'] == 'DB_STATEMENT_TIMEOUT'
@@ -0,0 +1,76 @@
+from books import BookError
+from books.schema import Schema, Field, book_schema
+import pytest
+
+
+class TestSchema:
+
+    def book_info(self, **values):
+        book_info = {
+            'name': 'A Game of thrones',
+            'isbn': '978-0553103540',
+            'authors': ['George R. R. Martin'],
+            'country': 'United States',
+            'number_of_pages': 694,
+            'publisher': 'Bantam Books',
+            'release_date': '1996-08-01'
+        }
+        book_info.update(values)
+        return book_info
+
+    def test_validate_book(self):
+        book_info = self.book_info()
+        assert book_schema.validate(dict(book_info, id=1)) == book_info
+        assert book_schema.validate(self.book_info(publisher=None, release_date=None, number_of_pages=None))
+
+    test_invalid_values_data = [
+        ('name', '  ', 'name is blank'),
+        ('name', None, 'name is blank'),
+        ('name', 'A' * 101, 'name is longer than 100 characters'),
+        ('isbn', 123, 'isbn is not a str'),
+        ('authors', 'John Doe', 'authors is not a list of str'),
+        ('authors', ['John Doe', 1], 'authors is not a list of str'),
+        ('authors', ['John Doe'] * 10, 'authors are longer than 100 characters as json'),
+        ('country', None, 'country is required'),
+        ('number_of_pages', '450', 'number_of_pages is not an integer'),
+        ('number_of_pages', True, 'number_of_pages is not an integer'),
+        ('number_of_pages', -1, 'number_of_pages is less than 0'),
+        ('release_date', '2019-02-30', 'release_date is not a date'),
+        ('release_date', '2019-1-1', 'release_date is not a date'),
+        ('release_date', 'Some date in 2019', 'release_date is not a date'),
+    ]
+
+    @pytest.mark.parametrize('field, value, message', test_invalid_values_data)
+    def test_invalid_values(self, field, value, message):
+        with pytest.raises(BookError) as err:
+            book_schema.validate(self.book_info(**{field: value}))
+        assert err.value.name() == 'INVALID_PROPERTY'
+        assert err.value.details() == {field: message}
+
+    def test_collects_errors_of_all_fields(self):
+        errors = book_schema.errors({'name': '', 'release_date': '2019', 'title': 'A'})
+        assert errors == {
+            'name': 'name is blank',
+            'release_date': 'release_date is not a date',
+            'title': 'title is not a field of a book',
+            'isbn': 'isbn is required'
+        }
+        assert book_schema.errors({'country': 'India'}, partial=True) == {}
+        assert book_schema.errors(['A']) == {'': 'book is not a json object'}
+
+    def test_validate_many(self):
+        assert book_schema.validate_many([self.book_info(), self.book_info(isbn='1')]) == \
+            [self.book_info(), self.book_info(isbn='1')]
+
+        with pytest.raises(BookError) as err:
+            book_schema.validate_many([self.book_info(), self.book_info(name=''), {'country': 'India'}],
+                                      partial=True)
+        assert err.value.details() == {'[1].name': 'name is blank'}
+        assert err.value.message() == 'Invalid books: [1] name is blank'
+
+    def test_check_field(self):
+        schema = Schema({'pages': Field(int, minimum=1)})
+        schema.check('pages', 5)
+        with pytest.raises(BookError) as err:
+            schema.check('pages', 0)
+        assert err.value.message() == 'pages is less than 1'
@@ -0,0 +1,149 @@
+from books import BookError
+from books.slow_queries import SlowQueryLog, query_shape, is_read_only
+from books.storage import PostgresStorage
+from books.routes import SlowQueryRoutes, handle_book_error
+from app import BooksApiFlask
+from datetime import date
+from psycopg2.extensions import QueryCanceledError
+import pytest
+
+
+class FakeExplainer:
+
+    def __init__(self, accept=True):
+        self.submitted = []
+        self._accept = accept
+
+    def submit(self, statement, params, callback):
+        self.submitted.append((statement, params))
+        if self._accept:
+            callback([{'Plan': {'Node Type': 'Seq Scan'}}], None)
+        return self._accept
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeCursor:
+
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, statement, params):
+        self.executed.append((statement, params))
+
+
+class TestSlowQueryLog:
+
+    def test_query_shape(self):
+        assert query_shape('SELECT id\n  FROM books WHERE  name=%s') == 'SELECT id FROM books WHERE name=%s'
+
+    def test_is_read_only(self):
+        assert is_read_only('SELECT id FROM books WHERE name=%s')
+        assert is_read_only(' with matched AS (SELECT id, updated_at FROM books) SELECT count(*) FROM matched')
+        assert is_read_only(PostgresStorage(None)._get_faceted_books_query(
+            {'publisher': 'Bantam Books'}, ('country', 'release_year'), ('id', 'name'), [('id', False)], 10))
+        assert not is_read_only('WITH gone AS (DELETE FROM books RETURNING id) SELECT count(*) FROM gone')
+        assert not is_read_only('SELECT id FROM books FOR UPDATE')
+        assert not is_read_only('SELECT id INTO copies FROM books')
+        assert not is_read_only('UPDATE books SET name=%s')
+        assert not is_read_only('')
+
+    def test_records_slow_statements_by_shape(self):
+        log = SlowQueryLog(threshold_ms=100)
+        log.record('SELECT id FROM books WHERE name=%s', ('A',), 0.05)
+        log.record('SELECT id FROM books WHERE name=%s', ('A',), 0.2)
+        log.record('SELECT id FROM  books WHERE name=%s', ('B',), 0.4)
+        log.record('SELECT id FROM books WHERE country=%s and release_date=%s', ('India', date(2019, 1, 1)), 0.5)
+
+        slowest = log.slowest()
+        assert [(stats['shape'], stats['count'], stats['total_ms'], stats['max_ms']) for stats in slowest] == [
+            ('SELECT id FROM books WHERE name=%s', 2, 600.0, 400.0),
+            ('SELECT id FROM books WHERE country=%s and release_date=%s', 1, 500.0, 500.0)
+        ]
+        assert slowest[0]['mean_ms'] == 300.0
+        assert slowest[1]['param_types'] == ['str', 'date']
+        assert log.slowest(1) == slowest[:1]
+
+    def test_least_costly_shape_is_evicted(self):
+        log = SlowQueryLog(threshold_ms=0, max_shapes=2)
+        log.record('SELECT 1', (), 0.3)
+        log.record('SELECT 2', (), 0.1)
+        log.record('SELECT 3', (), 0.2)
+        assert [stats['shape'] for stats in log.slowest()] == ['SELECT 1', 'SELECT 3']
+
+    def test_plans_of_slowest_shapes_are_captured(self):
+        explainer = FakeExplainer()
+        clock = FakeClock()
+        log = SlowQueryLog(threshold_ms=0, explainer=explainer, explain_top=1, explain_sample_rate=0.5,
+                           explain_interval=300, clock=clock, sample=lambda: 0.1)
+        log.record('SELECT 1', ('A',), 0.3)
+        log.record('SELECT 2', ('B',), 0.1)
+        log.record('SELECT 1', ('C',), 0.3)
+        assert explainer.submitted == [('SELECT 1', ('A',))]
+        assert log.slowest()[0]['plan'] == [{'Plan': {'Node Type': 'Seq Scan'}}]
+        assert log.slowest()[1]['plan'] is None
+
+        clock.now += 301
+        log.record('SELECT 1', ('D',), 0.3)
+        assert explainer.submitted[-1] == ('SELECT 1', ('D',))
+
+    def test_plans_are_sampled(self):
+        explainer = FakeExplainer(accept=False)
+        samples = iter([0.9, 0.1, 0.1])
+        log = SlowQueryLog(threshold_ms=0, explainer=explainer, explain_sample_rate=0.5, sample=lambda: next(samples))
+        log.record('SELECT 1', (), 0.3)
+        assert explainer.submitted == []
+        # A plan which could not be queued is tried again on the next slow execution
+        log.record('SELECT 1', (), 0.3)
+        log.record('SELECT 1', (), 0.3)
+        assert len(explainer.submitted) == 2
+
+    def test_storage_times_statements(self):
+        log = SlowQueryLog(threshold_ms=0)
+        cur = FakeCursor()
+        PostgresStorage(None, slow_query_log=log)._run(cur, 'DELETE FROM books WHERE id = %s', (1,))
+        assert cur.executed == [('DELETE FROM books WHERE id = %s', (1,))]
+        assert log.slowest()[0]['shape'] == 'DELETE FROM books WHERE id = %s'
+
+    def test_storage_times_failed_statements(self):
+        class CancelledCursor(FakeCursor):
+            def execute(self, statement, params):
+                raise QueryCanceledError('canceling statement due to statement timeout')
+
+        log = SlowQueryLog(threshold_ms=0)
+        with pytest.raises(QueryCanceledError):
+            PostgresStorage(None, slow_query_log=log)._run(CancelledCursor(), 'SELECT pg_sleep(%s)', (10,))
+        assert log.slowest()[0]['shape'] == 'SELECT pg_sleep(%s)'
+
+
+class TestSlowQueryRoutes:
+
+    def create_client(self, log):
+        app = BooksApiFlask(__name__)
+        app.register_error_handler(BookError, handle_book_error)
+        routes = SlowQueryRoutes(log, 'secret')
+        app.add_url_rule('/admin/slow-queries', view_func=routes.get_slow_queries, methods=['GET'])
+        return app.test_client()
+
+    def test_lists_slowest_queries(self):
+        log = SlowQueryLog(threshold_ms=0)
+        log.record('SELECT 1', (), 0.2)
+        log.record('SELECT 2', (), 0.1)
+        client = self.create_client(log)
+
+        assert client.get('/admin/slow-queries').status_code == 403
+        assert client.get('/admin/slow-queries', headers={'X-Admin-Token': 'wrong'}).status_code == 403
+        assert client.get('/admin/slow-queries', headers={'X-Admin-Token': 'secr\u00e9t'}).status_code == 403
+        resp = client.get('/admin/slow-queries?limit=1', headers={'X-Admin-Token': 'secret'})
+        assert resp.status_code == 200
+        assert [stats['shape'] for stats in resp.get_json()['data']] == ['SELECT 1']
+        assert client.get('/admin/slow-queries?limit=a', headers={'X-Admin-Token': 'secret'}).status_code == 400
+        assert client.get('/admin/slow-queries?limit=%C2%B2', headers={'X-Admin-Token': 'secret'}).status_code == 400
+        assert client.get('/admin/slow-queries?limit=0', headers={'X-Admin-Token': 'secret'}).status_code == 400
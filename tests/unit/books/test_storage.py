@@ -0,0 +1,40 @@
+from books.storage import MemoryStorage, SqliteStorage
+from .storage_contract import BookStorageContract
+import threading
+import pytest
+
+
+class TestMemoryStorage(BookStorageContract):
+
+    @pytest.fixture
+    def storage(self):
+        return MemoryStorage()
+
+
+class TestSqliteStorage(BookStorageContract):
+
+    @pytest.fixture
+    def storage(self, tmp_path):
+        storage = SqliteStorage(str(tmp_path / 'books.db'))
+        yield storage
+        storage.close()
+
+    def test_wal_mode(self, storage):
+        assert storage._connection().execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+    def test_threads_use_own_connections(self, book_repo):
+        book = self.create_book(book_repo)
+        found = []
+        thread = threading.Thread(target=lambda: found.append(book_repo.get_book(book.id).values()))
+        thread.start()
+        thread.join()
+        assert found == [book.values()]
+
+    def test_connections_of_ended_threads_are_closed(self, storage):
+        threads = [threading.Thread(target=storage.select, args=({},)) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Only the connection of this thread is left
+        assert len(storage._connections) == 1
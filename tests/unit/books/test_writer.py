@@ -0,0 +1,161 @@
+from books.writer import GroupCommitWriter
+from deadlines import DeadlineExceeded, start_deadline, end_deadline
+import psycopg2
+import threading
+import pytest
+
+
+class FakeCursor:
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def execute(self, query, params=None):
+        self._conn.statements.append(query)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+
+    closed = False
+
+    def __init__(self, fail_commit=False):
+        self.statements = []
+        self.commits = 0
+        self.fail_commit = fail_commit
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        if self.fail_commit:
+            raise psycopg2.OperationalError('server closed the connection')
+        self.commits += 1
+
+    def rollback(self):
+        self.statements.append('ROLLBACK')
+
+
+class FakeConnectionPool:
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def getconn(self, block=False):
+        self.block = block
+        return self.conn
+
+    def putconn(self, conn):
+        pass
+
+
+class BusyConnectionPool(FakeConnectionPool):
+    """
+    A pool whose connection is put back by release()
+    """
+
+    def __init__(self, conn):
+        super().__init__(conn)
+        self.released = threading.Event()
+
+    def getconn(self, block=False):
+        self.released.wait()
+        return super().getconn(block)
+
+    def release(self):
+        self.released.set()
+
+
+def insert(id):
+    def write(cur):
+        cur.execute('INSERT {}'.format(id))
+        return id
+    return write
+
+
+class TestGroupCommitWriter:
+
+    def test_concurrent_writes_are_committed_together(self):
+        conn = FakeConnection()
+        writer = GroupCommitWriter(FakeConnectionPool(conn), max_batch=10, max_delay=0.2)
+        results = []
+        threads = [threading.Thread(target=lambda id=id: results.append(writer.submit(insert(id))))
+                   for id in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.close()
+
+        assert sorted(results) == [0, 1, 2, 3, 4]
+        assert conn.commits == 1
+        assert conn.statements.count('SAVEPOINT write') == 5
+
+    def test_failed_write_does_not_fail_others(self):
+        conn = FakeConnection()
+        writer = GroupCommitWriter(FakeConnectionPool(conn), max_delay=0.1)
+
+        def fail(cur):
+            raise psycopg2.IntegrityError('duplicate key')
+
+        errors = []
+
+        def submit_failing():
+            try:
+                writer.submit(fail)
+            except psycopg2.IntegrityError as err:
+                errors.append(err)
+
+        thread = threading.Thread(target=submit_failing)
+        thread.start()
+        assert writer.submit(insert(1)) == 1
+        thread.join()
+        writer.close()
+
+        assert len(errors) == 1
+        assert 'ROLLBACK TO SAVEPOINT write' in conn.statements
+        assert 'INSERT 1' in conn.statements
+
+    def test_commit_error_is_raised_to_every_caller(self):
+        writer = GroupCommitWriter(FakeConnectionPool(FakeConnection(fail_commit=True)))
+        with pytest.raises(psycopg2.OperationalError):
+            writer.submit(insert(1))
+        writer.close()
+
+    def test_batch_size_is_limited(self):
+        conn = FakeConnection()
+        writer = GroupCommitWriter(FakeConnectionPool(conn), max_batch=2, max_delay=0.2)
+        threads = [threading.Thread(target=writer.submit, args=(insert(id),)) for id in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.close()
+        assert conn.commits >= 2
+
+    def test_writer_waits_for_a_pooled_connection(self):
+        cpool = FakeConnectionPool(FakeConnection())
+        writer = GroupCommitWriter(cpool)
+        assert writer.submit(insert(1)) == 1
+        writer.close()
+        assert cpool.block
+
+    def test_write_is_dropped_when_deadline_is_exceeded(self):
+        conn = FakeConnection()
+        cpool = BusyConnectionPool(conn)
+        writer = GroupCommitWriter(cpool)
+        token = start_deadline(0.05)
+        try:
+            with pytest.raises(DeadlineExceeded) as err:
+                writer.submit(insert(1))
+            assert err.value.name() == 'DB_WRITE_TIMEOUT'
+        finally:
+            end_deadline(token)
+
+        cpool.release()
+        assert writer.submit(insert(2)) == 2
+        writer.close()
+        assert 'INSERT 1' not in conn.statements
+        assert 'INSERT 2' in conn.statements
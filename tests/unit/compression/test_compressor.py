@@ -0,0 +1,77 @@
+import gzip
+from flask import Flask, Response
+import compression
+from compression import negotiate, CompressedBodyCache, available_encodings
+import pytest
+
+
+class TestNegotiate:
+
+    test_data = [
+        ('', None),
+        ('gzip', 'gzip'),
+        ('gzip;q=0', None),
+        ('deflate, gzip;q=0.5', 'gzip'),
+        ('*', 'zstd'),
+        ('br;q=0.8, gzip', 'gzip'),
+        ('br, gzip', 'br'),
+        ('identity', None),
+    ]
+
+    @pytest.mark.parametrize('accept_encoding, expected', test_data)
+    def test_negotiate(self, accept_encoding, expected):
+        assert negotiate(accept_encoding, ['zstd', 'br', 'gzip']) == expected
+
+
+class TestCompressedBodyCache:
+
+    def test_compresses_once_per_encoding(self):
+        encoder = available_encodings({})['gzip']
+        cache = CompressedBodyCache(1024 * 1024)
+        body = b'{"data": []}' * 100
+        compressed = cache.get_or_compress(body, encoder)
+        assert gzip.decompress(compressed) == body
+        assert cache.get_or_compress(body, encoder) is compressed
+        assert len(cache) == 1
+
+
+class TestCompressor:
+
+    @pytest.fixture
+    def client(self):
+        app = Flask(__name__)
+        compression.init_app(app, {'min_size': 100})
+
+        @app.route('/large')
+        def large():
+            return {'data': ['A Game of Thrones'] * 100}
+
+        @app.route('/small')
+        def small():
+            return {'data': []}
+
+        @app.route('/stream')
+        def stream():
+            return Response((b'{"id": %d}\n' % i for i in range(100)), mimetype='application/json')
+
+        return app.test_client()
+
+    def test_compresses_large_response(self, client):
+        resp = client.get('/large', headers={'Accept-Encoding': 'gzip'})
+        assert resp.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in resp.headers['Vary']
+        assert b'A Game of Thrones' in gzip.decompress(resp.get_data())
+
+    def test_skips_small_response(self, client):
+        resp = client.get('/small', headers={'Accept-Encoding': 'gzip'})
+        assert 'Content-Encoding' not in resp.headers
+
+    def test_skips_without_accept_encoding(self, client):
+        resp = client.get('/large')
+        assert 'Content-Encoding' not in resp.headers
+        assert 'Accept-Encoding' in resp.headers['Vary']
+
+    def test_compresses_streamed_response(self, client):
+        resp = client.get('/stream', headers={'Accept-Encoding': 'gzip'})
+        assert resp.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(resp.get_data()).count(b'\n') == 100
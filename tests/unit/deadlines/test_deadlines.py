@@ -0,0 +1,84 @@
+from deadlines import DeadlineExceeded, start_deadline, end_deadline, remaining, check_deadline, timeout
+from flask import Flask, Blueprint
+import deadlines
+import pytest
+
+
+class TestDeadline:
+
+    def test_without_deadline(self):
+        assert remaining() is None
+        assert timeout(3.0) == 3.0
+        check_deadline('anything')
+
+    def test_time_left_bounds_timeouts(self):
+        token = start_deadline(2.0)
+        try:
+            assert 1.9 < remaining() <= 2.0
+            assert timeout(1.0) == 1.0
+            assert 1.9 < timeout(5.0) <= 2.0
+            assert 1.9 < timeout() <= 2.0
+        finally:
+            end_deadline(token)
+        assert remaining() is None
+
+    def test_exceeded_deadline(self):
+        token = start_deadline(0)
+        try:
+            assert remaining() == 0
+            with pytest.raises(DeadlineExceeded) as err:
+                check_deadline('calling the api')
+            assert err.value.name() == 'DEADLINE_EXCEEDED'
+            assert err.value.message() == 'Request deadline is exceeded before calling the api'
+        finally:
+            end_deadline(token)
+
+
+class TestMiddleware:
+
+    def create_client(self):
+        app = Flask(__name__)
+        deadlines.init_app(app, {
+            'default': 10.0,
+            'max': 20.0,
+            'header': 'X-Request-Timeout-Ms',
+            'routes': {'slow_api.wait': None, 'slow_api': 2.0}
+        })
+
+        @app.route('/remaining')
+        def get_remaining():
+            return {'remaining': remaining()}
+
+        @app.route('/exceeded')
+        def exceeded():
+            raise DeadlineExceeded('DB_POOL_TIMEOUT', 'No db connection is available')
+
+        blueprint = Blueprint('slow_api', __name__)
+        blueprint.add_url_rule('/slow', 'slow', view_func=get_remaining)
+        blueprint.add_url_rule('/wait', 'wait', view_func=get_remaining)
+        app.register_blueprint(blueprint, url_prefix='/api')
+        return app.test_client()
+
+    def test_deadline_of_routes(self):
+        client = self.create_client()
+        assert 9.0 < client.get('/remaining').get_json()['remaining'] <= 10.0
+        assert 1.0 < client.get('/api/slow').get_json()['remaining'] <= 2.0
+        assert client.get('/api/wait').get_json()['remaining'] is None
+
+    def test_deadline_header(self):
+        client = self.create_client()
+        left = client.get('/remaining', headers={'X-Request-Timeout-Ms': '500'}).get_json()['remaining']
+        assert 0.4 < left <= 0.5
+        left = client.get('/remaining', headers={'X-Request-Timeout-Ms': '60000'}).get_json()['remaining']
+        assert 19.0 < left <= 20.0
+
+        for given in ('soon', '0', '\u00b2', '-5'):
+            resp = client.get('/remaining', headers={'X-Request-Timeout-Ms': given})
+            assert resp.status_code == 400
+            assert resp.get_json()['name'] == 'INVALID_DEADLINE'
+
+    def test_exceeded_deadline_fails_with_504(self):
+        resp = self.create_client().get('/exceeded')
+        assert resp.status_code == 504
+        assert resp.get_json() == {'code': 504, 'name': 'DB_POOL_TIMEOUT',
+                                   'description': 'No db connection is available'}
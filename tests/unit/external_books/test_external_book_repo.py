@@ -1,7 +1,11 @@
 import pytest
-from external_books import ExternalBookRepo, ExternalBookError
+from external_books import ExternalBookRepo, ExternalBookError, ExternalCatalog
+from external_books.external_book import RateLimiter
+from deadlines import start_deadline, end_deadline
 import config
+import json
 import requests
+import time
 
 
 class TestExternalBookRepo:
@@ -16,7 +20,7 @@ class TestExternalBookRepo:
             resp.params = kwargs['params']
             return resp
 
-        monkeypatch.setattr(requests, 'get', mock_get)
+        monkeypatch.setattr(requests.Session, 'get', lambda session, *args, **kwargs: mock_get(*args, **kwargs))
         return resp
 
     def test_find_books_by_name(self, mock_get_response):
@@ -74,6 +78,45 @@ class TestExternalBookRepo:
         book = repo.find_books_by_name('')
         assert book is None, 'Expected: {}, but got {}'.format(expected, book)
 
+    def test_find_books_by_name_is_bounded_by_deadline(self, monkeypatch):
+        timeouts = []
+
+        def mock_get(session, url, **kwargs):
+            timeouts.append(kwargs['timeout'])
+            raise requests.exceptions.ReadTimeout('Read timed out')
+
+        monkeypatch.setattr(requests.Session, 'get', mock_get)
+        repo = ExternalBookRepo(dict(config.external_books_api, connect_timeout=3.0, read_timeout=10.0))
+        token = start_deadline(5.0)
+        try:
+            with pytest.raises(ExternalBookError) as err:
+                repo.find_books_by_name('A Game of Thrones')
+        finally:
+            end_deadline(token)
+        assert err.value.name() == 'UPSTREAM_TIMEOUT'
+        connect_timeout, read_timeout = timeouts[0]
+        assert connect_timeout == 3.0
+        assert 4.9 < read_timeout <= 5.0
+
+    def test_find_books_by_name_is_bounded_by_deadline_while_reading(self, mock_get_response, monkeypatch):
+        mock_get_response.json_value = [{'name': 'A Game of Thrones'}]
+        chunks = mock_get_response.iter_content
+
+        def trickle(chunk_size=1):
+            for chunk in chunks(1):
+                time.sleep(0.01)
+                yield chunk
+
+        monkeypatch.setattr(mock_get_response, 'iter_content', trickle)
+        repo = ExternalBookRepo(dict(config.external_books_api, connect_timeout=3.0, read_timeout=10.0))
+        token = start_deadline(0.1)
+        try:
+            with pytest.raises(ExternalBookError) as err:
+                repo.find_books_by_name('A Game of Thrones')
+        finally:
+            end_deadline(token)
+        assert err.value.name() == 'UPSTREAM_TIMEOUT'
+
     @pytest.fixture
     def mock_get_throwing_error(self, monkeypatch):
 
@@ -84,7 +127,7 @@ class TestExternalBookRepo:
             resp.params = kwargs['params']
             raise requests.exceptions.RequestException('Unable to process the request')
 
-        monkeypatch.setattr(requests, 'get', mock_get)
+        monkeypatch.setattr(requests.Session, 'get', lambda session, *args, **kwargs: mock_get(*args, **kwargs))
         return resp
 
     def test_find_books_by_name_when_api_throws_error(self, mock_get_throwing_error):
@@ -107,6 +150,13 @@ class MockGetResponse:
     def json(self):
         return self.json_value
 
+    def iter_content(self, chunk_size=1):
+        body = json.dumps(self.json_value).encode()
+        return (body[start:start + chunk_size] for start in range(0, len(body), chunk_size))
+
+    def close(self):
+        pass
+
     @property
     def url(self):
         return self._url
@@ -122,3 +172,83 @@ class MockGetResponse:
     @params.setter
     def params(self, params):
         self._params = params
+
+
+def api_book(isbn):
+    return {'name': 'Book ' + isbn, 'isbn': isbn, 'authors': ['George R. R. Martin'], 'country': 'United States',
+            'numberOfPages': 694, 'publisher': 'Bantam Books', 'released': '1996-08-01T00:00:00'}
+
+
+class CatalogResponse:
+
+    def __init__(self, status_code, books=None, headers=None, last_page=None):
+        self.status_code = status_code
+        self._books = books
+        self.headers = headers or {}
+        self.links = {}
+        if last_page is not None:
+            self.links['last'] = {'url': 'https://anapioficeandfire.com/api/books?page={}&pageSize=2'.format(last_page)}
+
+    def json(self):
+        return self._books
+
+
+class FakeCatalogSession:
+    """
+    Serves pages of 2 books, every page has an ETag of its own
+    """
+
+    def __init__(self, books):
+        self.books = books
+        self.requests = []
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        self.requests.append((params['page'], headers.get('If-None-Match')))
+        page = params['page']
+        etag = '"page-{}-{}"'.format(page, hash(str(self.books)))
+        last_page = (len(self.books) + 1) // 2
+        if headers.get('If-None-Match') == etag:
+            return CatalogResponse(304, headers={'ETag': etag})
+        return CatalogResponse(200, self.books[(page - 1) * 2:page * 2], {'ETag': etag}, last_page)
+
+
+class TestExternalCatalog:
+
+    def test_fetches_all_pages(self):
+        session = FakeCatalogSession([api_book(str(isbn)) for isbn in range(5)])
+        catalog = ExternalCatalog(config.external_books_api, session, page_size=2, rate_limit=0)
+        books, stats = catalog.fetch_books()
+        assert [book.values()['isbn'] for book in books] == ['0', '1', '2', '3', '4']
+        assert stats == {'requests': 3, 'not_modified': 0}
+        assert sorted(session.requests) == [(1, None), (2, None), (3, None)]
+
+    def test_revalidates_pages(self):
+        session = FakeCatalogSession([api_book(str(isbn)) for isbn in range(4)])
+        catalog = ExternalCatalog(config.external_books_api, session, page_size=2, rate_limit=0)
+        catalog.fetch_books()
+        session.requests = []
+
+        books, stats = catalog.fetch_books()
+        assert len(books) == 4
+        assert stats == {'requests': 2, 'not_modified': 2}
+        assert all(etag is not None for page, etag in session.requests)
+
+        session.books = session.books + [api_book('4')]
+        books, stats = catalog.fetch_books()
+        assert [book.values()['isbn'] for book in books] == ['0', '1', '2', '3', '4']
+        assert stats == {'requests': 3, 'not_modified': 0}
+
+    def test_fails_on_error_status(self):
+        session = FakeCatalogSession([])
+        session.get = lambda url, **kwargs: CatalogResponse(500)
+        with pytest.raises(ExternalBookError):
+            ExternalCatalog(config.external_books_api, session).fetch_books()
+
+    def test_rate_limiter_spaces_calls(self):
+        now = [10.0]
+        slept = []
+        limiter = RateLimiter(2.0, clock=lambda: now[0], sleep=slept.append)
+        limiter.acquire()
+        limiter.acquire()
+        limiter.acquire()
+        assert slept == [0.5, 1.0]
@@ -0,0 +1,63 @@
+from flask import Flask
+import health
+import lifecycle
+import pytest
+
+
+class FakeResource:
+
+    def __init__(self, state):
+        self.name = 'fake_db'
+        self._state = state
+        self.warmed_up = False
+
+    def warm_up(self):
+        self.warmed_up = True
+        self._state = 'ready'
+
+    def state(self):
+        return self._state, None
+
+
+class TestHealthRoutes:
+
+    @pytest.fixture
+    def client(self):
+        app = Flask(__name__)
+        app.register_blueprint(health.createBlueprint(), url_prefix='/health')
+        return app.test_client()
+
+    def test_live(self, client):
+        assert client.get('/health/live').status_code == 200
+
+    def test_ready(self, client, monkeypatch):
+        resource = FakeResource('ready')
+        monkeypatch.setattr(lifecycle, '_resources', [resource])
+        resp = client.get('/health/ready')
+        assert resp.status_code == 200
+        assert resp.get_json()['data'] == {'fake_db': {'state': 'ready', 'error': None}}
+
+    def test_not_ready_starts_warm_up(self, client, monkeypatch):
+        resource = FakeResource('cold')
+        monkeypatch.setattr(lifecycle, '_resources', [resource])
+        monkeypatch.setattr(lifecycle, 'warm_up', lambda: resource.warm_up())
+        resp = client.get('/health/ready')
+        assert resp.status_code == 503
+        assert resp.get_json()['data']['fake_db']['state'] == 'cold'
+        assert resource.warmed_up
+
+
+class TestLifecycle:
+
+    def test_start_warms_up_unless_preloading(self, monkeypatch):
+        resource = FakeResource('cold')
+        monkeypatch.setattr(lifecycle, '_resources', [resource])
+        monkeypatch.setattr(lifecycle, 'warm_up', lambda: resource.warm_up())
+
+        monkeypatch.setattr(lifecycle, '_preloading', True)
+        lifecycle.start()
+        assert not resource.warmed_up
+
+        monkeypatch.setattr(lifecycle, '_preloading', False)
+        lifecycle.start()
+        assert resource.warmed_up
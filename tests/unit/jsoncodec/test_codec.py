@@ -0,0 +1,31 @@
+import json
+from datetime import date
+import jsoncodec
+import pytest
+
+
+class TestCodec:
+
+    @pytest.fixture(params=['stdlib', 'auto'])
+    def backend(self, request):
+        jsoncodec.use(request.param)
+        yield request.param
+        jsoncodec.use('auto')
+
+    def test_dumps(self, backend):
+        value = {'name': 'A Game of Thrones', 'authors': ['George'], 'released': date(1996, 8, 1)}
+        assert json.loads(jsoncodec.dumps(value)) == {
+            'name': 'A Game of Thrones', 'authors': ['George'], 'released': '1996-08-01'}
+
+    def test_dumps_splices_fragments(self, backend):
+        books = [jsoncodec.dumps({'id': 1}), jsoncodec.dumps({'id': 2})]
+        encoded = jsoncodec.dumps({'status_code': 200, 'data': jsoncodec.Fragments(books)})
+        assert json.loads(encoded) == {'status_code': 200, 'data': [{'id': 1}, {'id': 2}]}
+
+    def test_dumps_only_fragments(self, backend):
+        encoded = jsoncodec.dumps({'data': jsoncodec.Fragments([])})
+        assert json.loads(encoded) == {'data': []}
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            jsoncodec.use('simplejson')
@@ -0,0 +1,76 @@
+import os
+import threading
+import time
+from flask import Flask
+from profiling import StackSampler
+import profiling
+
+
+def busy_loop(stop_event):
+    while not stop_event.is_set():
+        sum(range(1000))
+
+
+class TestStackSampler:
+
+    def test_sample_collapses_stacks_of_other_threads(self):
+        stop_event = threading.Event()
+        worker = threading.Thread(target=busy_loop, args=(stop_event,), name='busy-worker')
+        worker.start()
+        try:
+            sampler = StackSampler()
+            sampler.sample()
+            sampler.sample()
+        finally:
+            stop_event.set()
+            worker.join()
+
+        lines = sampler.collapsed().splitlines()
+        busy = [line for line in lines if line.startswith('busy-worker;')]
+        assert busy, 'Expected a stack of busy-worker thread in {}'.format(lines)
+        assert 'test_profiling.py:busy_loop' in busy[0]
+        assert sampler.samples == 2
+
+    def test_start_and_stop(self):
+        sampler = StackSampler(interval=0.001)
+        assert sampler.start()
+        assert not sampler.start()
+        time.sleep(0.05)
+        collapsed = sampler.stop()
+        assert not sampler.running
+        assert sampler.samples > 0
+        assert collapsed.endswith('\n')
+
+
+class TestProfilerRoutes:
+
+    def create_app(self, tmpdir):
+        app = Flask(__name__)
+        profiling.init_app(app, {'enabled': True, 'admin_token': 'secret', 'output_dir': str(tmpdir)})
+
+        @app.route('/ping')
+        def ping():
+            return {'status': 'success'}
+        return app
+
+    def test_admin_end_points_require_token(self, tmpdir):
+        client = self.create_app(tmpdir).test_client()
+        assert client.post('/admin/profiler/sampler/start').status_code == 403
+        assert client.post('/admin/profiler/sampler/start',
+                           headers={'X-Admin-Token': 'wrong'}).status_code == 403
+
+        headers = {'X-Admin-Token': 'secret'}
+        assert client.post('/admin/profiler/sampler/start', headers=headers).status_code == 200
+        resp = client.post('/admin/profiler/sampler/stop', headers=headers)
+        assert resp.status_code == 200
+        assert resp.content_type.startswith('text/plain')
+
+    def test_request_profiled_with_header(self, tmpdir):
+        client = self.create_app(tmpdir).test_client()
+        resp = client.get('/ping')
+        assert 'X-Profile-File' not in resp.headers
+
+        resp = client.get('/ping', headers={'X-Profile': 'secret'})
+        profile_file = resp.headers['X-Profile-File']
+        assert profile_file.endswith('-get-ping.pstats')
+        assert os.path.exists(os.path.join(str(tmpdir), profile_file))
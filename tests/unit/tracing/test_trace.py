@@ -0,0 +1,54 @@
+from tracing import Trace, span, start_trace, end_trace, current_trace, current_request_id
+from flask import Flask
+import tracing
+
+
+class TestTrace:
+
+    def test_server_timing_adds_up_spans_with_same_name(self):
+        trace = Trace('abc')
+        trace.add_span('sql', 0.001, 'Query execution')
+        trace.add_span('sql', 0.002)
+        trace.add_span('hydrate', 0.0005)
+
+        metrics = trace.server_timing().split(', ')
+        assert metrics[0] == 'sql;dur=3.00;desc="Query execution"'
+        assert metrics[1] == 'hydrate;dur=0.50'
+        assert metrics[2].startswith('total;dur=')
+
+    def test_span_is_recorded_into_current_trace(self):
+        trace, token = start_trace('req-1')
+        try:
+            with span('pool'):
+                pass
+            assert current_request_id() == 'req-1'
+        finally:
+            end_trace(token)
+
+        assert [s[0] for s in trace.spans] == ['pool']
+        assert current_trace() is None
+
+    def test_span_without_trace(self):
+        with span('sql'):
+            pass
+        assert current_trace() is None
+
+    def test_middleware_emits_headers(self):
+        app = Flask(__name__)
+        tracing.init_app(app, {'request_id_header': 'X-Request-ID'})
+
+        @app.route('/ping')
+        def ping():
+            with span('sql'):
+                pass
+            return {'status': 'success'}
+
+        client = app.test_client()
+        resp = client.get('/ping', headers={'X-Request-ID': 'given-id'})
+        assert resp.headers['X-Request-ID'] == 'given-id'
+        assert resp.headers['Server-Timing'].startswith('sql;dur=')
+
+        # Unsafe request ids are replaced by generated ones
+        resp = client.get('/ping', headers={'X-Request-ID': 'bad id;'})
+        assert resp.headers['X-Request-ID'] != 'bad id;'
+        assert len(resp.headers['X-Request-ID']) == 32
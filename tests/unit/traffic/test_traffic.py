@@ -0,0 +1,54 @@
+import json
+from flask import Flask
+import traffic
+from traffic import replay
+
+
+class TestTrafficRecorder:
+
+    def test_records_sanitized_requests(self, tmpdir):
+        file_name = str(tmpdir.join('traffic.jsonl'))
+        app = Flask(__name__)
+        recorder = traffic.init_app(app, {'enabled': True, 'file_name': file_name, 'redact_keys': ['password']})
+
+        @app.route('/api/v1/books', methods=['GET', 'POST'])
+        def books():
+            return {'status': 'success'}
+
+        client = app.test_client()
+        client.get('/api/v1/books?name=A&name=B')
+        client.post('/api/v1/books', json={'name': 'A', 'password': 'secret', 'nested': {'Password': 'x'}},
+                    headers={'Authorization': 'Bearer abc'})
+        recorder.close()
+
+        with open(file_name) as f:
+            records = [json.loads(line) for line in f]
+        assert len(records) == 2
+        assert records[0]['method'] == 'GET'
+        assert records[0]['query'] == {'name': ['A', 'B']}
+        assert records[0]['body'] is None
+        assert records[1]['body'] == {'name': 'A', 'password': '***', 'nested': {'Password': '***'}}
+        assert records[1]['status'] == 200
+        assert 'Bearer abc' not in json.dumps(records)
+
+    def test_not_installed_when_disabled(self):
+        assert traffic.init_app(Flask(__name__), {'enabled': False}) is None
+
+
+class TestReplay:
+
+    records = [{'ts': 100.0}, {'ts': 101.0}, {'ts': 103.0}]
+
+    def test_schedule_original_speed(self):
+        assert replay.schedule(self.records, replay.parse_speed('original')) == [0.0, 1.0, 3.0]
+
+    def test_schedule_scaled_speed(self):
+        assert replay.schedule(self.records, replay.parse_speed('2')) == [0.0, 0.5, 1.5]
+
+    def test_schedule_max_speed(self):
+        assert replay.schedule(self.records, replay.parse_speed('max')) == [0.0, 0.0, 0.0]
+
+    def test_route_of(self):
+        assert replay.route_of('/api/v1/books/12') == '/api/v1/books/{id}'
+        assert replay.route_of('/api/v1/books/12/update') == '/api/v1/books/{id}/update'
+        assert replay.route_of('/api/v1/books') == '/api/v1/books'
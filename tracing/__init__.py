@@ -0,0 +1,2 @@
+from .trace import Trace, span, start_trace, end_trace, current_trace, current_request_id
+from .middleware import init_app
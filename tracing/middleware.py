@@ -0,0 +1,49 @@
+import json
+import logging
+import re
+import uuid
+from flask import g, request
+from .trace import start_trace, end_trace, current_trace
+logger = logging.getLogger(__name__)
+
+# Incoming request ids are echoed in headers and logs, hence only a safe subset is accepted.
+_valid_request_id = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+
+def init_app(app, config):
+    """
+    Starts a trace for every request and emits its spans as 'Server-Timing' header and
+    optionally as a structured log record.
+    """
+    request_id_header = config.get('request_id_header', 'X-Request-ID')
+    server_timing = config.get('server_timing', True)
+    log_records = config.get('log_records', False)
+
+    def before_request():
+        request_id = request.headers.get(request_id_header, '')
+        if not _valid_request_id.match(request_id):
+            request_id = uuid.uuid4().hex
+        g.trace_token = start_trace(request_id)[1]
+
+    def after_request(response):
+        trace = current_trace()
+        if trace is None:
+            return response
+
+        response.headers[request_id_header] = trace.request_id
+        if server_timing:
+            response.headers['Server-Timing'] = trace.server_timing()
+        if log_records:
+            record = trace.record()
+            record.update(method=request.method, path=request.path, status=response.status_code)
+            logger.info(json.dumps(record))
+        return response
+
+    def teardown_request(exc):
+        token = g.pop('trace_token', None)
+        if token is not None:
+            end_trace(token)
+
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
@@ -0,0 +1,106 @@
+import contextvars
+import time
+from collections import OrderedDict
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+class Trace:
+    """
+    Collects timed spans of a single request.
+    Spans having the same name are added up, so that a stage executed several times
+    (e.g. two queries in one request) is reported as a single Server-Timing metric.
+    """
+
+    def __init__(self, request_id):
+        self._request_id = request_id
+        self._start = time.perf_counter()
+        self._spans = []
+
+    @property
+    def request_id(self):
+        return self._request_id
+
+    @property
+    def spans(self):
+        return list(self._spans)
+
+    def add_span(self, name, duration, description=None):
+        self._spans.append((name, duration, description))
+
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def totals(self):
+        """
+        Returns an ordered dict of span name -> (total duration in seconds, description)
+        """
+        totals = OrderedDict()
+        for name, duration, description in self._spans:
+            total, desc = totals.get(name, (0.0, description))
+            totals[name] = (total + duration, desc or description)
+        return totals
+
+    def server_timing(self):
+        """
+        Formats the spans as a value of 'Server-Timing' response header
+        """
+        metrics = []
+        for name, (duration, description) in self.totals().items():
+            metric = '{};dur={:.2f}'.format(name, duration * 1000)
+            if description:
+                metric += ';desc="{}"'.format(description)
+            metrics.append(metric)
+        metrics.append('total;dur={:.2f}'.format(self.elapsed() * 1000))
+        return ', '.join(metrics)
+
+    def record(self):
+        """
+        Returns the trace as a structured record which can be logged as json
+        """
+        return {
+            'request_id': self._request_id,
+            'duration_ms': round(self.elapsed() * 1000, 3),
+            'spans': [{'name': name, 'duration_ms': round(duration * 1000, 3)}
+                      for name, duration, _ in self._spans]
+        }
+
+
+class span:
+    """
+    Times the enclosed block and records it into the trace of current request.
+    It does nothing but measuring time when there is no active trace, so that
+    repositories can be used outside of a request as well.
+    """
+
+    def __init__(self, name, description=None):
+        self._name = name
+        self._description = description
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_span(self._name, time.perf_counter() - self._start, self._description)
+
+
+def start_trace(request_id):
+    trace = Trace(request_id)
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(token):
+    _current_trace.reset(token)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def current_request_id():
+    trace = _current_trace.get()
+    return trace.request_id if trace else None
@@ -0,0 +1 @@
+from .capture import TrafficRecorder, init_app
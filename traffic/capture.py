@@ -0,0 +1,93 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from flask import g, request
+logger = logging.getLogger(__name__)
+
+REDACTED = '***'
+
+
+def init_app(app, config):
+    """
+    Records sampled requests into a jsonl file when capturing is enabled in the config.
+    """
+    if not config.get('enabled', False):
+        return None
+
+    recorder = TrafficRecorder(config)
+    app.before_request(recorder.before_request)
+    app.after_request(recorder.after_request)
+    return recorder
+
+
+class TrafficRecorder:
+    """
+    Writes one json line per sampled request: its method, path, query, json body,
+    response status and duration. Values of sensitive keys are redacted and headers
+    are never recorded.
+    """
+
+    def __init__(self, config):
+        self._file_name = config.get('file_name', 'captures/traffic.jsonl')
+        self._sample_rate = config.get('sample_rate', 1.0)
+        self._redact_keys = {key.lower() for key in config.get('redact_keys', [])}
+        self._max_body_bytes = config.get('max_body_bytes', 65536)
+        self._lock = threading.Lock()
+        self._file = None
+
+    def before_request(self):
+        if random.random() < self._sample_rate:
+            g.capture_start = (time.time(), time.perf_counter())
+
+    def after_request(self, response):
+        start = g.pop('capture_start', None)
+        if start is None:
+            return response
+
+        record = {
+            'ts': round(start[0], 6),
+            'method': request.method,
+            'path': request.path,
+            'query': self.sanitize(request.args.to_dict(flat=False)),
+            'body': self._json_body(),
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - start[1]) * 1000, 3)
+        }
+        try:
+            self.write(record)
+        except OSError as err:
+            logger.error('Unable to record request due to error: %s', err)
+        return response
+
+    def _json_body(self):
+        if request.content_length and request.content_length > self._max_body_bytes:
+            return None
+        body = request.get_json(silent=True)
+        return self.sanitize(body) if body is not None else None
+
+    def sanitize(self, value):
+        if isinstance(value, dict):
+            return {key: REDACTED if key.lower() in self._redact_keys else self.sanitize(item)
+                    for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.sanitize(item) for item in value]
+        return value
+
+    def write(self, record):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._file is None:
+                directory = os.path.dirname(self._file_name)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._file = open(self._file_name, 'a', buffering=1)
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
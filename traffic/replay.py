@@ -0,0 +1,146 @@
+"""
+Replays a traffic capture against a target server and reports the latency distribution.
+
+    > python -m traffic.replay captures/traffic.jsonl --target http://127.0.0.1:5000 --speed 2 --concurrency 16
+
+'--speed' is 'original' (same pacing as captured), a factor such as '2' (twice as fast) or 'max'
+(no pacing at all, limited only by concurrency).
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks import report
+
+
+def load_capture(path):
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return sorted(records, key=lambda record: record['ts'])
+
+
+def parse_speed(speed):
+    """
+    Returns the speed factor, or None when requests should be sent as fast as possible
+    """
+    if speed == 'max':
+        return None
+    if speed == 'original':
+        return 1.0
+    factor = float(speed)
+    if factor <= 0:
+        raise ValueError('speed must be greater than 0')
+    return factor
+
+
+def schedule(records, factor):
+    """
+    Returns the offsets (seconds from the replay start) at which each record is due
+    """
+    if not records:
+        return []
+    if factor is None:
+        return [0.0] * len(records)
+    first = records[0]['ts']
+    return [(record['ts'] - first) / factor for record in records]
+
+
+def route_of(path):
+    """
+    Groups paths like /api/v1/books/12 and /api/v1/books/13 into /api/v1/books/{id}
+    """
+    return re.sub(r'/\d+(?=/|$)', '/{id}', path)
+
+
+class Replayer:
+
+    def __init__(self, target, concurrency, timeout=30):
+        self._target = target.rstrip('/')
+        self._concurrency = concurrency
+        self._timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = Counter()
+        self.lateness = []
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def send(self, record, due):
+        lateness = max(0.0, time.perf_counter() - due)
+        start = time.perf_counter()
+        try:
+            resp = self._session().request(
+                record['method'], self._target + record['path'], params=record.get('query'),
+                json=record.get('body'), timeout=self._timeout)
+            status = resp.status_code
+        except requests.exceptions.RequestException:
+            status = 'error'
+        duration = time.perf_counter() - start
+
+        with self._lock:
+            self.latencies[route_of(record['path'])].append(duration)
+            self.statuses[status] += 1
+            self.lateness.append(lateness)
+
+    def replay(self, records, offsets):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self._concurrency) as executor:
+            for record, offset in zip(records, offsets):
+                due = start + offset
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(self.send, record, due)
+        return time.perf_counter() - start
+
+    def summary(self, elapsed):
+        all_latencies = [latency for latencies in self.latencies.values() for latency in latencies]
+        result = {
+            'elapsed_sec': round(elapsed, 3),
+            'requests': len(all_latencies),
+            'throughput_rps': round(len(all_latencies) / elapsed, 1) if elapsed else None,
+            'statuses': {str(status): count for status, count in self.statuses.items()},
+            'max_lateness_ms': round(max(self.lateness) * 1000, 3) if self.lateness else 0,
+            'routes': {}
+        }
+        if all_latencies:
+            result['overall'] = report.summarize(all_latencies)
+        for route, latencies in sorted(self.latencies.items()):
+            result['routes'][route] = report.summarize(latencies)
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay captured traffic against a server')
+    parser.add_argument('capture', help='jsonl file recorded by traffic capture')
+    parser.add_argument('--target', default='http://127.0.0.1:5000')
+    parser.add_argument('--speed', default='original', help="'original', 'max' or a factor such as 2")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--output', help='Writes the summary as json into given file')
+    args = parser.parse_args()
+
+    records = load_capture(args.capture)
+    offsets = schedule(records, parse_speed(args.speed))
+    replayer = Replayer(args.target, args.concurrency, args.timeout)
+    summary = replayer.summary(replayer.replay(records, offsets))
+
+    print(json.dumps(summary, indent=2, sort_keys=True))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()